@@ -6,23 +6,39 @@ Models, routes, and services are organized in their respective packages.
 """
 from flask import Flask
 from flask_cors import CORS
-from sqlalchemy import func, select
+from sqlalchemy import exists, func, select, text
 import os
 
 # Import database and models
 from models import (
     db,
     Agent,
+    AgentClosure,
+    AgentMonthlyVolume,
+    AgentPayoutLedger,
     Sale,
     Commission,
     Bonus,
     Clawback,
+    DownlinePeriodVolume,
     HierarchySnapshot,
     PerformanceTier,
 )
 
 # Import route registration
 from routes import register_blueprints
+from cli import register_commands
+from services import (
+    rebuild_agent_closure,
+    rebuild_agent_monthly_volume,
+    rebuild_downline_period_volume,
+    rebuild_payout_ledger,
+    ensure_sale_path_column,
+    count_legacy_snapshot_sales,
+    merge_duplicate_bonuses,
+    init_cancellation_workers,
+    resume_pending_cancellation_jobs,
+)
 
 
 def create_app():
@@ -45,12 +61,36 @@ def create_app():
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///commission.db"
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+    # Upline/downline lookups: "cache" (in-memory, version-checked),
+    # "closure" (closure table) or "cte" (recursive SQL)
+    app.config["HIERARCHY_STRATEGY"] = os.getenv("HIERARCHY_STRATEGY", "cache")
+
+    # Bonus runs read downline volumes from the maintained rollup ("rollup") or
+    # roll them up the cached tree ("tree") with the "auto" (numpy if installed),
+    # "python" or "numpy" engine
+    app.config["BONUS_VOLUME_SOURCE"] = os.getenv("BONUS_VOLUME_SOURCE", "rollup")
+    app.config["BONUS_ENGINE"] = os.getenv("BONUS_ENGINE", "auto")
+
+    # Cancellation clawbacks run on a background worker pool; "eager" runs them inline
+    app.config["CANCELLATION_WORKERS"] = int(os.getenv("CANCELLATION_WORKERS", "2"))
+    app.config["CANCELLATION_JOBS_EAGER"] = False
+    # Running jobs claimed longer ago than this are re-queued at startup
+    app.config["CANCELLATION_JOB_LEASE_SECONDS"] = int(
+        os.getenv("CANCELLATION_JOB_LEASE_SECONDS", "900")
+    )
+
     # Initialize database with app
     db.init_app(app)
 
     # Register all route blueprints
     register_blueprints(app)
 
+    # Register CLI commands (flask import-sales, ...)
+    register_commands(app)
+
+    # Worker pool for queued cancellation jobs
+    init_cancellation_workers(app)
+
     return app
 
 
@@ -93,6 +133,103 @@ def seed_performance_tiers(app):
         print("Performance tiers seeded successfully!")
 
 
+def sync_agent_closure(app):
+    """
+    Backfills the agent closure table for databases created before it existed.
+    Like the other startup syncs this only probes for an empty table; checking
+    it against Agent.parent_id is `flask check-closure --repair`.
+    """
+    with app.app_context():
+        if not db.session.scalar(select(exists().select_from(Agent))):
+            return
+        if db.session.scalar(select(exists().select_from(AgentClosure))):
+            return
+
+        print("Building agent closure table...")
+        rebuild_agent_closure(db.session)
+        db.session.commit()
+        print("Agent closure table built successfully!")
+
+
+def sync_volume_aggregates(app):
+    """
+    Backfills the bonus volume aggregates for databases created before they
+    existed. This runs at every import (each gunicorn worker, each CLI call),
+    so it only checks whether the tables are empty; comparing them with the
+    sales is `flask check-volumes --repair`, run as a deploy step.
+    """
+    with app.app_context():
+        has_sales = db.session.scalar(
+            select(exists().where(Sale.is_cancelled == False))
+        )
+        if not has_sales:
+            return
+
+        if not db.session.scalar(select(exists().select_from(AgentMonthlyVolume))):
+            print("Building monthly volume aggregate...")
+            rebuild_agent_monthly_volume(db.session)
+            db.session.commit()
+            print("Monthly volume aggregate built successfully!")
+
+        if not db.session.scalar(select(exists().select_from(DownlinePeriodVolume))):
+            print("Building downline volume rollup...")
+            rebuild_downline_period_volume(db.session)
+            db.session.commit()
+            print("Downline volume rollup built successfully!")
+
+
+def sync_payout_ledger(app):
+    """Backfills the payout ledger for databases created before it existed."""
+    with app.app_context():
+        commission_count = db.session.scalar(select(func.count(Commission.id)))
+        ledger_count = db.session.scalar(
+            select(func.count()).select_from(AgentPayoutLedger)
+        )
+        if commission_count == 0 or ledger_count > 0:
+            return
+
+        print("Building payout ledger...")
+        rebuild_payout_ledger(db.session)
+        db.session.commit()
+        print("Payout ledger built successfully!")
+
+
+def check_legacy_snapshots(app):
+    """
+    Adds the compact path column to older databases. Converting (and deleting)
+    legacy per-level snapshots is left to `flask migrate-snapshots`; until then
+    cancellations read them directly.
+    """
+    with app.app_context():
+        ensure_sale_path_column(db.session)
+        legacy_sales = count_legacy_snapshot_sales(db.session)
+        if legacy_sales:
+            print(
+                f"{legacy_sales} sales still use legacy hierarchy snapshots; "
+                "run `flask migrate-snapshots` to convert them."
+            )
+
+
+def migrate_bonus_uniqueness(app):
+    """Merges duplicate bonuses so the (agent_id, period, bonus_type) unique index can be built."""
+    with app.app_context():
+        removed = merge_duplicate_bonuses(db.session)
+        # Superseded by uq_bonus_agent_period_type
+        db.session.execute(text("DROP INDEX IF EXISTS ix_bonus_agent_period_type"))
+        db.session.execute(text("DROP INDEX IF EXISTS ix_bonus_period_type_agent"))
+        db.session.commit()
+        if removed:
+            print(f"Merged {removed} duplicate bonus rows.")
+
+
+def sync_indexes(app):
+    """Creates declared indexes missing from existing tables (create_all skips them)."""
+    with app.app_context():
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+
+
 # Create app instance
 app = create_app()
 
@@ -101,7 +238,15 @@ with app.app_context():
     db.create_all()
     print("✅ Database tables created!")
 
+check_legacy_snapshots(app)
+migrate_bonus_uniqueness(app)
+sync_indexes(app)
+
 seed_performance_tiers(app)
+sync_agent_closure(app)
+sync_volume_aggregates(app)
+sync_payout_ledger(app)
+resume_pending_cancellation_jobs(app)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,287 @@
+"""
+Flask CLI commands - bulk maintenance tasks run outside HTTP requests.
+"""
+import os
+import random
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db
+from services import (
+    IMPORT_DEFAULT_CHUNK_SIZE,
+    parse_ndjson,
+    parse_csv,
+    import_sales,
+    migrate_hierarchy_snapshots,
+    agent_closure_is_consistent,
+    rebuild_agent_closure,
+    rebuild_agent_monthly_volume,
+    rebuild_downline_period_volume,
+    find_volume_aggregate_drift,
+    rebuild_payout_ledger,
+    find_payout_ledger_drift,
+    get_tier_table,
+    compute_period_bonuses,
+    compute_bonuses_in_parallel,
+    shutdown_bonus_process_pool,
+    calculate_bonuses_for_periods,
+    get_year_periods,
+    BONUS_TYPES,
+)
+from services.hierarchy_cache import HierarchyCache
+
+
+@click.command("import-sales")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["ndjson", "csv"]),
+    default=None,
+    help="Input format (defaults to the file extension).",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=IMPORT_DEFAULT_CHUNK_SIZE,
+    show_default=True,
+    help="Rows validated and committed per transaction.",
+)
+@with_appcontext
+def import_sales_command(path, file_format, chunk_size):
+    """Streams sales from an NDJSON or CSV file into the database."""
+    if file_format is None:
+        file_format = "csv" if os.path.splitext(path)[1].lower() == ".csv" else "ndjson"
+    parse = parse_csv if file_format == "csv" else parse_ndjson
+
+    progress = None
+    with open(path, newline="", encoding="utf-8") as fh:
+        for progress in import_sales(parse(fh), db.session, chunk_size=chunk_size):
+            for row_number, error in progress["errors"]:
+                click.echo(f"Row {row_number}: {error}", err=True)
+            click.echo(
+                f"{progress['created'] + progress['failed']} rows processed "
+                f"({progress['rows_per_second']:.0f} rows/sec)"
+            )
+
+    if progress is None:
+        click.echo("No rows found.")
+        return
+    click.echo(
+        f"Import finished. Created: {progress['created']}, Failed: {progress['failed']}, "
+        f"Elapsed: {progress['elapsed']:.2f}s, Throughput: {progress['rows_per_second']:.0f} rows/sec"
+    )
+
+
+@click.command("migrate-snapshots")
+@with_appcontext
+def migrate_snapshots_command():
+    """Converts legacy per-level hierarchy snapshots to compact per-sale paths."""
+    converted = migrate_hierarchy_snapshots(db.session)
+    click.echo(f"Converted hierarchy snapshots for {converted} sales.")
+
+
+@click.command("check-closure")
+@click.option("--repair", is_flag=True, help="Rebuild the closure table if it drifted.")
+@with_appcontext
+def check_closure_command(repair):
+    """Compares the agent closure table with Agent.parent_id (e.g. after out-of-band writes)."""
+    if agent_closure_is_consistent(db.session):
+        click.echo("Agent closure table matches Agent.parent_id.")
+        return
+    click.echo("Agent closure table does not match Agent.parent_id.")
+    if not repair:
+        raise SystemExit(1)
+    click.echo(f"Rebuilt {rebuild_agent_closure(db.session)} agent closure rows.")
+    db.session.commit()
+
+
+@click.command("rebuild-volumes")
+@with_appcontext
+def rebuild_volumes_command():
+    """Reconstructs the monthly volume aggregate and downline rollup from the sales table."""
+    monthly_rows = rebuild_agent_monthly_volume(db.session)
+    downline_rows = rebuild_downline_period_volume(db.session)
+    db.session.commit()
+    click.echo(f"Rebuilt {monthly_rows} agent monthly volume rows.")
+    click.echo(f"Rebuilt {downline_rows} downline period volume rows.")
+
+
+@click.command("check-volumes")
+@click.option("--repair", is_flag=True, help="Rebuild the tables that drifted.")
+@with_appcontext
+def check_volumes_command(repair):
+    """Compares the volume aggregates with the sales (e.g. after out-of-band writes)."""
+    drifted = find_volume_aggregate_drift(db.session)
+    if not drifted:
+        click.echo("Volume aggregates match the sales.")
+        return
+    click.echo(f"Drifted: {', '.join(drifted)}")
+    if not repair:
+        raise SystemExit(1)
+    if "agent_monthly_volume" in drifted:
+        click.echo(f"Rebuilt {rebuild_agent_monthly_volume(db.session)} agent monthly volume rows.")
+    click.echo(f"Rebuilt {rebuild_downline_period_volume(db.session)} downline period volume rows.")
+    db.session.commit()
+
+
+@click.command("rebuild-ledger")
+@with_appcontext
+def rebuild_ledger_command():
+    """Reconstructs the payout ledger from the commission, bonus and clawback tables."""
+    ledger_rows = rebuild_payout_ledger(db.session)
+    db.session.commit()
+    click.echo(f"Rebuilt {ledger_rows} payout ledger rows.")
+
+
+@click.command("check-ledger")
+@click.option("--repair", is_flag=True, help="Rebuild the ledger if it drifted.")
+@with_appcontext
+def check_ledger_command(repair):
+    """Compares the payout ledger with the commission, bonus and clawback totals."""
+    drifted = find_payout_ledger_drift(db.session)
+    if not drifted:
+        click.echo("Payout ledger matches the commission, bonus and clawback tables.")
+        return
+    click.echo(f"Drifted agent months: {len(drifted)}")
+    for agent_id, period in drifted[:10]:
+        click.echo(f"  agent {agent_id}, {period}")
+    if not repair:
+        raise SystemExit(1)
+    click.echo(f"Rebuilt {rebuild_payout_ledger(db.session)} payout ledger rows.")
+    db.session.commit()
+
+
+@click.command("calculate-bonuses")
+@click.option("--year", type=int, required=True)
+@click.option(
+    "--type",
+    "bonus_types",
+    type=click.Choice(BONUS_TYPES),
+    multiple=True,
+    help="Bonus types to calculate (default: all).",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Processes computing top-level subtrees of full runs in parallel.",
+)
+@click.option("--full", is_flag=True, help="Recompute every agent, not only dirty ones.")
+@with_appcontext
+def calculate_bonuses_command(year, bonus_types, workers, full):
+    """Calculates and saves every bonus period of a year in one transaction."""
+    periods = get_year_periods(year, bonus_types or BONUS_TYPES)
+    started = time.perf_counter()
+    try:
+        results = calculate_bonuses_for_periods(
+            periods,
+            db.session,
+            engine=current_app.config["BONUS_ENGINE"],
+            volume_source=current_app.config["BONUS_VOLUME_SOURCE"],
+            workers=workers,
+            incremental=not full,
+        )
+        db.session.commit()
+    finally:
+        shutdown_bonus_process_pool()
+    for result in results:
+        click.echo(
+            f"{result['type']} {result['period']} ({result['mode']}): "
+            f"created {result['created']}, updated {result['updated']}, skipped {result['skipped']}"
+        )
+    click.echo(f"Calculated {len(results)} periods in {time.perf_counter() - started:.2f}s.")
+
+
+@click.command("benchmark-bonuses")
+@click.option("--agents", type=click.IntRange(min=10), default=100000, show_default=True)
+@click.option("--repeat", type=click.IntRange(min=1), default=3, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Also time the parallel per-subtree run with this many processes.",
+)
+@with_appcontext
+def benchmark_bonuses_command(agents, repeat, seed, workers):
+    """Times the Python and NumPy bonus engines on a synthetic org."""
+    rng = random.Random(seed)
+    # Directors -> managers -> team leads -> agents, each attached to a random parent
+    layer_sizes = [
+        (4, max(1, agents // 1000)),
+        (3, max(1, agents // 100)),
+        (2, max(1, agents // 20)),
+    ]
+    layer_sizes.append((1, agents - sum(size for _, size in layer_sizes)))
+    rows, parents, next_id = [], [None], 1
+    for level, size in layer_sizes:
+        layer = list(range(next_id, next_id + size))
+        rows.extend((agent_id, rng.choice(parents), level) for agent_id in layer)
+        parents, next_id = layer, next_id + size
+    hierarchy = HierarchyCache(0, rows)
+    personal_volumes = {
+        agent_id: rng.uniform(0, 150000) for agent_id, _, level in rows if level == 1
+    }
+    tier_table = get_tier_table(db.session)
+
+    results = {}
+    for engine in ("python", "numpy"):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results[engine] = compute_period_bonuses(
+                hierarchy, personal_volumes, tier_table, engine=engine
+            )
+            timings.append(time.perf_counter() - started)
+        click.echo(f"{engine:>6}: {min(timings) * 1000:.1f} ms (best of {repeat})")
+        if engine == "python":
+            python_best = min(timings)
+    numpy_best = min(timings)
+    click.echo(f"Speedup: {python_best / numpy_best:.1f}x for {len(rows)} agents")
+
+    python_results, numpy_results = results["python"], results["numpy"]
+    mismatched = [
+        agent_id
+        for agent_id in python_results.keys() | numpy_results.keys()
+        if agent_id not in python_results
+        or agent_id not in numpy_results
+        or abs(python_results[agent_id][1] - numpy_results[agent_id][1]) > 0.01
+    ]
+    click.echo(f"Bonuses: {len(python_results)}, mismatched: {len(mismatched)}")
+
+    if workers:
+        # The first run starts the pool's processes; later runs reuse them
+        timings = []
+        for _ in range(repeat + 1):
+            started = time.perf_counter()
+            (parallel_results,) = compute_bonuses_in_parallel(
+                hierarchy, [(personal_volumes, None)], tier_table, "numpy", workers
+            )
+            timings.append(time.perf_counter() - started)
+        cold, warm = timings[0], min(timings[1:])
+        click.echo(
+            f"{workers} workers: {warm * 1000:.1f} ms (best of {repeat} on a warm pool, "
+            f"first run {cold * 1000:.1f} ms), matches serial: {parallel_results == numpy_results}"
+        )
+        click.echo(
+            f"Parallel speedup over serial numpy: {numpy_best / warm:.2f}x "
+            f"on {os.cpu_count()} CPUs"
+        )
+        shutdown_bonus_process_pool()
+
+
+def register_commands(app):
+    """Register all CLI commands with the Flask app."""
+    app.cli.add_command(import_sales_command)
+    app.cli.add_command(migrate_snapshots_command)
+    app.cli.add_command(check_closure_command)
+    app.cli.add_command(rebuild_volumes_command)
+    app.cli.add_command(check_volumes_command)
+    app.cli.add_command(rebuild_ledger_command)
+    app.cli.add_command(check_ledger_command)
+    app.cli.add_command(calculate_bonuses_command)
+    app.cli.add_command(benchmark_bonuses_command)
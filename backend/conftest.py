@@ -1,7 +1,9 @@
 # backend/conftest.py
 import pytest
+from sqlalchemy import event
 from app import app as flask_app, seed_performance_tiers
 from models import db as sqlalchemy_db, PerformanceTier
+from services import clear_hierarchy_cache, clear_tier_table
 
 
 # Provide the Flask app instance
@@ -12,6 +14,7 @@ def app():
         {
             "TESTING": True,
             "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",  # Use in-memory DB
+            "CANCELLATION_JOBS_EAGER": True,  # Process clawbacks inside the request
         }
     )
 
@@ -53,6 +56,9 @@ def db(app):
         # This is slightly slower but more robust than complex transaction fixtures
         sqlalchemy_db.drop_all()
         sqlalchemy_db.create_all()
+        # The hierarchy version restarts at 0 with the fresh tables
+        clear_hierarchy_cache()
+        clear_tier_table()
         # Re-seed performance tiers for each test
         try:
             seed_performance_tiers(app)
@@ -65,3 +71,17 @@ def db(app):
         # Clean up after test
         sqlalchemy_db.session.remove()
         # No need to drop_all here if we do it before the next test
+
+
+# Records every SQL statement sent to the database while the test runs
+@pytest.fixture(scope="function")
+def sql_statements(db):
+    """List of SQL strings executed during the test (for query-count assertions)."""
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    yield statements
+    event.remove(db.engine, "before_cursor_execute", record_statement)
@@ -7,20 +7,40 @@ db = SQLAlchemy()
 
 # Import all models after db is defined to avoid circular imports
 from models.agent import Agent
+from models.agent_closure import AgentClosure
+from models.agent_monthly_volume import AgentMonthlyVolume
+from models.agent_payout_ledger import AgentPayoutLedger
 from models.sale import Sale
 from models.commission import Commission
 from models.bonus import Bonus
+from models.bonus_dirty_agent import BonusDirtyAgent
+from models.bonus_run import BonusRun
 from models.clawback import Clawback
+from models.downline_period_volume import DownlinePeriodVolume
+from models.cancellation_job import CancellationJob
 from models.hierarchy_snapshot import HierarchySnapshot
+from models.hierarchy_path import HierarchyPath
+from models.hierarchy_version import HierarchyVersion
 from models.performance_tier import PerformanceTier
+from models.tier_version import TierVersion
 
 __all__ = [
     "db",
     "Agent",
+    "AgentClosure",
+    "AgentMonthlyVolume",
+    "AgentPayoutLedger",
     "Sale",
     "Commission",
     "Bonus",
+    "BonusDirtyAgent",
+    "BonusRun",
     "Clawback",
+    "DownlinePeriodVolume",
+    "CancellationJob",
     "HierarchySnapshot",
+    "HierarchyPath",
+    "HierarchyVersion",
     "PerformanceTier",
+    "TierVersion",
 ]
@@ -18,6 +18,12 @@ class Agent(db.Model):
     )
     sales = db.relationship("Sale", backref="agent", lazy=True)
 
+    __table_args__ = (
+        # Child lookups (subtree child counts, delete checks, recursive CTE joins)
+        db.Index("ix_agent_parent_id", "parent_id"),
+        db.Index("ix_agent_level", "level"),
+    )
+
     def to_dict(self, include_children=False):
         data = {
             "id": self.id,
@@ -0,0 +1,21 @@
+"""
+AgentClosure model - closure table indexing every ancestor/descendant pair.
+"""
+from models import db
+
+
+class AgentClosure(db.Model):
+    ancestor_id = db.Column(db.Integer, db.ForeignKey("agent.id"), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey("agent.id"), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)  # 0 = self, 1 = direct parent, etc.
+
+    __table_args__ = (
+        db.Index("ix_agent_closure_descendant_depth", "descendant_id", "depth"),
+        # Breadth-first subtree pages: WHERE ancestor_id = ? ORDER BY depth, descendant_id
+        db.Index(
+            "ix_agent_closure_ancestor_depth_descendant",
+            "ancestor_id",
+            "depth",
+            "descendant_id",
+        ),
+    )
@@ -0,0 +1,25 @@
+"""
+AgentMonthlyVolume model - each agent's non-cancelled sales volume per calendar month.
+"""
+from datetime import datetime, timezone
+from models import db
+
+
+class AgentMonthlyVolume(db.Model):
+    agent_id = db.Column(db.Integer, db.ForeignKey("agent.id"), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    volume = db.Column(db.Float, nullable=False, default=0.0)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Whole-period reads in bonus runs (every agent, a range of months)
+        db.Index(
+            "ix_agent_monthly_volume_year_month_agent",
+            "year",
+            "month",
+            "agent_id",
+            "volume",
+        ),
+    )
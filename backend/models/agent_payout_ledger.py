@@ -0,0 +1,27 @@
+"""
+AgentPayoutLedger model - each agent's gross commissions, bonuses, clawbacks and net payout per month.
+"""
+from datetime import datetime, timezone
+from models import db
+
+
+class AgentPayoutLedger(db.Model):
+    agent_id = db.Column(db.Integer, db.ForeignKey("agent.id"), primary_key=True)
+    # Payout month "2025-10": commissions by payout_date, clawbacks by
+    # processed_date, bonuses by the last month of their bonus period
+    period = db.Column(db.String(7), primary_key=True)
+    commissions = db.Column(db.Float, nullable=False, default=0.0)
+    bonuses = db.Column(db.Float, nullable=False, default=0.0)
+    clawbacks = db.Column(db.Float, nullable=False, default=0.0)  # Negative, like Clawback.amount
+    net = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self):
+        return {
+            "agent_id": self.agent_id,
+            "period": self.period,
+            "commissions": self.commissions,
+            "bonuses": self.bonuses,
+            "clawbacks": self.clawbacks,
+            "net": self.net,
+        }
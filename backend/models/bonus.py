@@ -13,3 +13,16 @@ class Bonus(db.Model):
     agent_id = db.Column(db.Integer, db.ForeignKey("agent.id"), nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # One bonus per agent, period and type: the conflict target of bonus
+        # run upserts, and the lookup for cancellation recalculation
+        # (a unique index, so existing databases can add it at startup)
+        db.Index(
+            "uq_bonus_agent_period_type",
+            "agent_id",
+            "period",
+            "bonus_type",
+            unique=True,
+        ),
+    )
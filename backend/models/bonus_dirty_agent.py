@@ -0,0 +1,17 @@
+"""
+BonusDirtyAgent model - agents whose bonus inputs changed since their period's last bonus run.
+"""
+from datetime import datetime, timezone
+from models import db
+
+
+class BonusDirtyAgent(db.Model):
+    agent_id = db.Column(db.Integer, db.ForeignKey("agent.id"), primary_key=True)
+    # Bonus period string: "2025-10" (Monthly), "2025-Q4" (Quarterly) or "2025" (Annual)
+    period_key = db.Column(db.String(20), primary_key=True)
+    marked_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Incremental bonus runs read and clear whole periods
+        db.Index("ix_bonus_dirty_agent_period_agent", "period_key", "agent_id"),
+    )
@@ -0,0 +1,24 @@
+"""
+BonusRun model - record of each successful bonus calculation per period and type.
+"""
+from datetime import datetime, timezone
+from models import db
+
+
+class BonusRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(50), nullable=False)
+    bonus_type = db.Column(db.String(50), nullable=False)
+    mode = db.Column(db.String(20), nullable=False)  # "full" or "incremental"
+    # TierTable.signature the run used; a different one forces a full run
+    tier_signature = db.Column(db.String(64), nullable=False)
+    agents_computed = db.Column(db.Integer, nullable=False, default=0)
+    agents_skipped = db.Column(db.Integer, nullable=False, default=0)
+    created_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_count = db.Column(db.Integer, nullable=False, default=0)
+    completed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Latest run of a period and type
+        db.Index("ix_bonus_run_period_type_id", "period", "bonus_type", "id"),
+    )
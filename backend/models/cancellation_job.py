@@ -0,0 +1,36 @@
+"""
+CancellationJob model - DB-backed queue of pending clawback processing for cancelled sales.
+"""
+import json
+from datetime import datetime, timezone
+from models import db
+
+
+class CancellationJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sale_ids = db.Column(db.Text, nullable=False)  # JSON list of cancelled sale IDs
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)
+    total_sales = db.Column(db.Integer, nullable=False, default=0)
+    processed_sales = db.Column(db.Integer, nullable=False, default=0)
+    commission_clawbacks = db.Column(db.Integer, nullable=False, default=0)
+    bonus_clawbacks = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "sale_ids": json.loads(self.sale_ids),
+            "status": self.status,
+            "total_sales": self.total_sales,
+            "processed_sales": self.processed_sales,
+            "commission_clawbacks": self.commission_clawbacks,
+            "bonus_clawbacks": self.bonus_clawbacks,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+        }
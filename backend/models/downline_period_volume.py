@@ -0,0 +1,19 @@
+"""
+DownlinePeriodVolume model - each agent's whole-downline sales volume per bonus period.
+"""
+from datetime import datetime, timezone
+from models import db
+
+
+class DownlinePeriodVolume(db.Model):
+    ancestor_id = db.Column(db.Integer, db.ForeignKey("agent.id"), primary_key=True)
+    # Bonus period string: "2025-10" (Monthly), "2025-Q4" (Quarterly) or "2025" (Annual)
+    period_key = db.Column(db.String(20), primary_key=True)
+    volume = db.Column(db.Float, nullable=False, default=0.0)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Whole-period reads in bonus runs
+        db.Index("ix_downline_period_volume_period_agent", "period_key", "ancestor_id", "volume"),
+    )
@@ -0,0 +1,12 @@
+"""
+HierarchyPath model - deduplicated seller-to-top upline paths referenced by sales.
+"""
+from datetime import datetime, timezone
+from models import db
+
+
+class HierarchyPath(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # Agent IDs from the seller up to the top-level agent, e.g. "42/17/5/1"
+    path = db.Column(db.String(255), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
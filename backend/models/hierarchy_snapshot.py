@@ -1,5 +1,8 @@
 """
-HierarchySnapshot model - preserves hierarchy at time of sale for accurate clawbacks.
+HierarchySnapshot model - legacy one-row-per-level hierarchy snapshot.
+
+New sales store their upline as a single Sale.hierarchy_path_id reference;
+existing rows are converted by services.snapshot_service.migrate_hierarchy_snapshots.
 """
 from datetime import datetime, timezone
 from models import db
@@ -13,3 +16,7 @@ class HierarchySnapshot(db.Model):
     upline_agent_id = db.Column(db.Integer, db.ForeignKey("agent.id"))
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.Index("ix_hierarchy_snapshot_sale_id", "sale_id"),
+    )
@@ -0,0 +1,11 @@
+"""
+HierarchyVersion model - single-row counter bumped on every agent hierarchy change.
+"""
+from datetime import datetime, timezone
+from models import db
+
+
+class HierarchyVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
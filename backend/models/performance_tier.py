@@ -14,3 +14,8 @@ class PerformanceTier(db.Model):
     bonus_rate = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Tier lookup by level and volume threshold
+        db.Index("ix_performance_tier_level_min_volume", "agent_level", "min_volume"),
+    )
@@ -12,5 +12,23 @@ class Sale(db.Model):
     sale_date = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     agent_id = db.Column(db.Integer, db.ForeignKey("agent.id"), nullable=False)
     is_cancelled = db.Column(db.Boolean, default=False)
+    # Hierarchy at time of sale (seller + upline), preserved for accurate clawbacks
+    hierarchy_path_id = db.Column(db.Integer, db.ForeignKey("hierarchy_path.id"))
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Keyset pagination of the sales list (ORDER BY sale_date DESC, id DESC)
+        db.Index("ix_sale_sale_date_id", "sale_date", "id"),
+        # The same order within one agent's sales (?agent_id= filter)
+        db.Index("ix_sale_agent_id_sale_date_id", "agent_id", "sale_date", "id"),
+        # Covering index for bonus volume sums:
+        # WHERE agent_id IN (...) AND sale_date range AND NOT is_cancelled -> SUM(policy_value)
+        db.Index(
+            "ix_sale_agent_date_cancelled_value",
+            "agent_id",
+            "sale_date",
+            "is_cancelled",
+            "policy_value",
+        ),
+    )
@@ -1,13 +1,30 @@
 """
 Agent routes - CRUD operations for agent hierarchy.
 """
+import re
 from flask import Blueprint, request, jsonify, current_app
-from sqlalchemy import func, select
-from models import db, Agent, Sale
-from services import get_downline_agent_ids
+from sqlalchemy import func, select, tuple_
+from models import db, Agent, AgentClosure, AgentPayoutLedger, Sale
+from services import (
+    get_downline_agent_ids,
+    add_agent_to_closure,
+    move_agent_in_closure,
+    remove_agent_from_closure,
+    move_downline_volumes,
+    mark_agent_periods_dirty,
+    bump_hierarchy_version,
+    build_agent_tree,
+    get_payout_statement,
+    encode_cursor,
+    decode_cursor,
+)
 
 agents_bp = Blueprint("agents", __name__)
 
+SUBTREE_DEFAULT_LIMIT = 100
+SUBTREE_MAX_LIMIT = 500
+PAYOUT_PERIOD_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
 
 @agents_bp.route("/agents", methods=["POST"])
 def add_agent():
@@ -62,6 +79,9 @@ def add_agent():
             name=data["name"].strip(), level=data["level"], parent_id=parent_id
         )
         db.session.add(new_agent)
+        db.session.flush()  # Need the new ID for the closure rows
+        add_agent_to_closure(new_agent.id, parent_id, db.session)
+        bump_hierarchy_version(db.session)
         db.session.commit()
         return jsonify(new_agent.to_dict()), 201
 
@@ -89,9 +109,8 @@ def get_agents():
             agents = db.session.scalars(stmt).all()
             return jsonify([agent.to_dict() for agent in agents])
 
-        stmt = select(Agent).filter_by(parent_id=None)
-        top_level_agents = db.session.scalars(stmt).all()
-        hierarchy = [agent.to_dict(include_children=True) for agent in top_level_agents]
+        # One flat query regardless of hierarchy size (no per-node lazy loads)
+        hierarchy = build_agent_tree(db.session)
         return jsonify(hierarchy)
     except Exception as e:
         current_app.logger.error(f"Error fetching agents: {e}", exc_info=True)
@@ -101,6 +120,153 @@ def get_agents():
         )
 
 
+@agents_bp.route("/agents/<int:agent_id>/payouts", methods=["GET"])
+def get_agent_payouts(agent_id):
+    """
+    Payout statement from the ledger: ?period=YYYY-MM returns one month (a
+    primary-key read), otherwise every month the agent has entries in.
+    """
+    try:
+        period = request.args.get("period")
+        if period is not None:
+            if not PAYOUT_PERIOD_PATTERN.match(period):
+                return jsonify({"error": "Period must be in YYYY-MM format"}), 400
+
+            statement = get_payout_statement(agent_id, period, db.session)
+            if statement:
+                return jsonify(statement.to_dict())
+            if not db.session.get(Agent, agent_id):
+                return jsonify({"error": "Agent not found"}), 404
+            # Nothing booked that month
+            return jsonify(
+                {
+                    "agent_id": agent_id,
+                    "period": period,
+                    "commissions": 0.0,
+                    "bonuses": 0.0,
+                    "clawbacks": 0.0,
+                    "net": 0.0,
+                }
+            )
+
+        if not db.session.get(Agent, agent_id):
+            return jsonify({"error": "Agent not found"}), 404
+        statements = db.session.scalars(
+            select(AgentPayoutLedger)
+            .where(AgentPayoutLedger.agent_id == agent_id)
+            .order_by(AgentPayoutLedger.period)
+        ).all()
+        return jsonify([statement.to_dict() for statement in statements])
+
+    except Exception as e:
+        current_app.logger.error(f"Error fetching agent payouts: {e}", exc_info=True)
+        return (
+            jsonify({"error": "An internal error occurred while fetching payouts"}),
+            500,
+        )
+
+
+@agents_bp.route("/agents/<int:agent_id>/subtree", methods=["GET"])
+def get_agent_subtree(agent_id):
+    """
+    Returns a bounded, breadth-first page of the hierarchy under one agent.
+    Nodes are ordered by (depth, id); every node carries its child_count so
+    frontier nodes (depth == requested depth) can be expanded lazily.
+    """
+    try:
+        depth = request.args.get("depth", default=1, type=int)
+        limit = request.args.get("limit", default=SUBTREE_DEFAULT_LIMIT, type=int)
+        cursor = request.args.get("cursor")
+
+        if depth is None or depth < 1:
+            return jsonify({"error": "Depth must be a positive integer"}), 400
+        if limit is None or not (1 <= limit <= SUBTREE_MAX_LIMIT):
+            return (
+                jsonify({"error": f"Limit must be between 1 and {SUBTREE_MAX_LIMIT}"}),
+                400,
+            )
+
+        after_depth, after_id = None, None
+        if cursor:
+            try:
+                after_depth, after_id = decode_cursor(cursor, key_type=int)
+            except ValueError:
+                return jsonify({"error": "Invalid cursor"}), 400
+
+        agent = db.session.get(Agent, agent_id)
+        if not agent:
+            return jsonify({"error": "Agent not found"}), 404
+
+        # Walk the (ancestor_id, depth, descendant_id) index in order, so a
+        # page costs `limit` index entries however large the subtree is
+        stmt = (
+            select(
+                Agent.id,
+                Agent.name,
+                Agent.level,
+                Agent.parent_id,
+                AgentClosure.depth,
+            )
+            .join(Agent, AgentClosure.descendant_id == Agent.id)
+            .where(
+                AgentClosure.ancestor_id == agent_id,
+                AgentClosure.depth.between(1, depth),
+            )
+            .order_by(AgentClosure.depth, AgentClosure.descendant_id)
+            .limit(limit + 1)  # One extra row tells us whether another page exists
+        )
+        if after_depth is not None:
+            stmt = stmt.where(
+                tuple_(AgentClosure.depth, AgentClosure.descendant_id)
+                > tuple_(after_depth, after_id)
+            )
+
+        rows = db.session.execute(stmt).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        # Child counts for the root and the returned page only
+        child_counts = dict(
+            db.session.execute(
+                select(AgentClosure.ancestor_id, func.count())
+                .where(
+                    AgentClosure.ancestor_id.in_([agent_id] + [row.id for row in rows]),
+                    AgentClosure.depth == 1,
+                )
+                .group_by(AgentClosure.ancestor_id)
+            ).all()
+        )
+
+        nodes = [
+            {
+                "id": row.id,
+                "name": row.name,
+                "level": row.level,
+                "parent_id": row.parent_id,
+                "depth": row.depth,
+                "child_count": child_counts.get(row.id, 0),
+            }
+            for row in rows
+        ]
+        root_child_count = child_counts.get(agent_id, 0)
+        next_cursor = encode_cursor(rows[-1].depth, rows[-1].id) if has_more else None
+
+        return jsonify(
+            {
+                "agent": {**agent.to_dict(), "child_count": root_child_count},
+                "depth": depth,
+                "nodes": nodes,
+                "next_cursor": next_cursor,
+            }
+        )
+    except Exception as e:
+        current_app.logger.error(f"Error fetching agent subtree: {e}", exc_info=True)
+        return (
+            jsonify({"error": "An internal error occurred while fetching the subtree"}),
+            500,
+        )
+
+
 @agents_bp.route("/agents/<int:agent_id>", methods=["PUT"])
 def update_agent(agent_id):
     """Updates an existing agent's details."""
@@ -113,18 +279,21 @@ def update_agent(agent_id):
         if not data:
             return jsonify({"error": "Request body is required"}), 400
 
+        # Validate the whole request before touching the agent, so a rejected
+        # update never leaves changes in the session to be autoflushed
         if "name" in data:
             if not isinstance(data["name"], str) or not data["name"].strip():
                 return jsonify({"error": "Agent name must be a non-empty string"}), 400
-            agent.name = data["name"].strip()
 
+        new_level = agent.level
         if "level" in data:
             if not isinstance(data["level"], int) or data["level"] not in [1, 2, 3, 4]:
                 return jsonify({"error": "Agent level must be 1, 2, 3, or 4"}), 400
+            new_level = data["level"]
 
-            if agent.parent_id:
+            if agent.parent_id and "parent_id" not in data:
                 parent = db.session.get(Agent, agent.parent_id)
-                if parent and parent.level <= data["level"]:
+                if parent and parent.level <= new_level:
                     return (
                         jsonify(
                             {
@@ -135,7 +304,7 @@ def update_agent(agent_id):
                     )
 
             for child in agent.children:
-                if child.level >= data["level"]:
+                if child.level >= new_level:
                     return (
                         jsonify(
                             {
@@ -145,8 +314,7 @@ def update_agent(agent_id):
                         400,
                     )
 
-            agent.level = data["level"]
-
+        parent_id = agent.parent_id
         if "parent_id" in data:
             parent_id = data["parent_id"]
 
@@ -169,7 +337,11 @@ def update_agent(agent_id):
                 if parent_id == agent_id:
                     return jsonify({"error": "Agent cannot be its own parent"}), 400
 
-                descendant_ids = get_downline_agent_ids(agent_id, db.session)
+                descendant_ids = get_downline_agent_ids(
+                    agent_id,
+                    db.session,
+                    strategy=current_app.config["HIERARCHY_STRATEGY"],
+                )
                 if parent_id in descendant_ids:
                     return (
                         jsonify(
@@ -180,7 +352,7 @@ def update_agent(agent_id):
                         400,
                     )
 
-                if parent_agent.level <= agent.level:
+                if parent_agent.level <= new_level:
                     return (
                         jsonify(
                             {
@@ -190,8 +362,21 @@ def update_agent(agent_id):
                         400,
                     )
 
+        if "name" in data:
+            agent.name = data["name"].strip()
+
+        if new_level != agent.level:
+            # The new level changes the agent's rate (and, to or from
+            # level 1, its volume basis) in every period it has volume in
+            mark_agent_periods_dirty(agent_id, db.session)
+            agent.level = new_level
+
+        if parent_id != agent.parent_id:
+            move_agent_in_closure(agent_id, parent_id, db.session)
+            move_downline_volumes(agent_id, agent.parent_id, parent_id, db.session)
             agent.parent_id = parent_id
 
+        bump_hierarchy_version(db.session)
         db.session.commit()
         return jsonify(agent.to_dict()), 200
 
@@ -238,7 +423,9 @@ def delete_agent(agent_id):
                 400,
             )
 
+        remove_agent_from_closure(agent_id, db.session)
         db.session.delete(agent)
+        bump_hierarchy_version(db.session)
         db.session.commit()
         return jsonify({"message": "Agent deleted successfully"}), 200
 
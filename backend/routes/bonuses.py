@@ -1,127 +1,161 @@
 """
 Bonus routes - bonus calculation and retrieval.
 """
-from flask import Blueprint, request, jsonify, current_app
-from sqlalchemy import func, select, and_
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from sqlalchemy import select
 from models import db, Agent, Bonus
 from services import (
-    get_downline_agent_ids,
-    get_monthly_sales_volume,
-    get_quarterly_sales_volume,
-    get_annual_sales_volume,
-    get_bonus_rate_for_volume,
+    BONUS_TYPES,
+    parse_bonus_period,
+    get_year_periods,
+    calculate_bonuses_for_periods,
+    preview_bonuses_for_periods,
+    STREAM_YIELD_PER,
+    iter_json_array,
 )
 
 bonuses_bp = Blueprint("bonuses", __name__)
 
+# A year close is 17 periods (12 monthly, 4 quarterly, 1 annual)
+BONUS_PERIODS_MAX = 100
+
 
 @bonuses_bp.route("/bonuses/calculate", methods=["POST"])
 def calculate_bonuses():
-    """Calculates and saves bonuses for Monthly, Quarterly, or Annual periods."""
+    """
+    Calculates and saves bonuses for Monthly, Quarterly, or Annual periods.
+    Accepts one period ({"period", "type"}), a list of them ({"periods": [...]})
+    or a whole year ({"year": 2025, "types": [...]}, all three types by default).
+    All requested periods are calculated in one transaction.
+    A period that was calculated before only recomputes the agents whose
+    volume or level changed since; pass "full": true to recompute everyone.
+    With ?dry_run=true nothing is written: the response lists each bonus the
+    run would save with its volume, tier, rate and delta against the saved amount.
+    """
     data = request.get_json()
-    period_str = data.get("period")  # e.g., "2025-10", "2026-Q1", "2027"
-    bonus_type = data.get("type")  # e.g., "Monthly", "Quarterly", "Annual"
-
-    # Validate bonus_type
-    if bonus_type not in ["Monthly", "Quarterly", "Annual"]:
-        return (
-            jsonify(
-                {"error": "Invalid bonus type. Use Monthly, Quarterly, or Annual."}
-            ),
-            400,
+    incremental = data.get("full") is not True
+
+    if "year" in data:
+        year = data["year"]
+        bonus_types = data.get("types", list(BONUS_TYPES))
+        if (
+            isinstance(year, bool)
+            or not isinstance(year, int)
+            or not (1 <= year <= 9999)
+        ):
+            return (
+                jsonify({"error": "Year must be an integer between 1 and 9999."}),
+                400,
+            )
+        if (
+            not isinstance(bonus_types, list)
+            or not bonus_types
+            or any(bonus_type not in BONUS_TYPES for bonus_type in bonus_types)
+        ):
+            return (
+                jsonify(
+                    {
+                        "error": "Types must be a non-empty list of Monthly, Quarterly, or Annual."
+                    }
+                ),
+                400,
+            )
+        periods = get_year_periods(year, bonus_types)
+    elif "periods" in data:
+        requested = data["periods"]
+        if not isinstance(requested, list) or not requested:
+            return jsonify({"error": "Periods must be a non-empty list."}), 400
+        if len(requested) > BONUS_PERIODS_MAX:
+            return (
+                jsonify({"error": f"At most {BONUS_PERIODS_MAX} periods per request."}),
+                400,
+            )
+        periods = []
+        for item in requested:
+            if not isinstance(item, dict):
+                return (
+                    jsonify(
+                        {"error": "Each period must be an object with period and type."}
+                    ),
+                    400,
+                )
+            period, error_response = parse_period_request(
+                item.get("period"), item.get("type")
+            )
+            if error_response:
+                return error_response
+            periods.append(period)
+        periods = list(dict.fromkeys(periods))
+    else:
+        period, error_response = parse_period_request(
+            data.get("period"), data.get("type")
         )
-    if not period_str:
-        return jsonify({"error": "Period string is required."}), 400
+        if error_response:
+            return error_response
+        periods = [period]
+
+    if request.args.get("dry_run", "").lower() == "true":
+        try:
+            # Reads only; the rollback just ends the read transaction
+            results = preview_bonuses_for_periods(
+                periods,
+                db.session,
+                engine=current_app.config["BONUS_ENGINE"],
+                volume_source=current_app.config["BONUS_VOLUME_SOURCE"],
+                incremental=incremental,
+            )
+            db.session.rollback()
+            bonuses_created_count = sum(result["created"] for result in results)
+            bonuses_updated_count = sum(result["updated"] for result in results)
+            return (
+                jsonify(
+                    {
+                        "message": f"Dry run for {len(results)} periods. Would create: {bonuses_created_count}, Would update: {bonuses_updated_count}",
+                        "dry_run": True,
+                        "results": results,
+                    }
+                ),
+                200,
+            )
 
-    # Parse period string based on type
-    year, month, quarter = None, None, None
-    try:
-        if bonus_type == "Monthly":
-            year, month = map(int, period_str.split("-"))
-            if not (1 <= month <= 12):
-                raise ValueError("Invalid month")
-        elif bonus_type == "Quarterly":
-            year_str, q_str = period_str.split("-")
-            year = int(year_str)
-            quarter = int(q_str[1:])  # Extract number from Q1, Q2 etc.
-            if not (1 <= quarter <= 4):
-                raise ValueError("Invalid quarter")
-        elif bonus_type == "Annual":
-            year = int(period_str)
-    except (ValueError, IndexError):
-        return (
-            jsonify(
-                {
-                    "error": f"Invalid period format for {bonus_type}. Use YYYY-MM, YYYY-Q#, or YYYY."
-                }
-            ),
-            400,
-        )
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error previewing bonuses: {e}", exc_info=True)
+            return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
 
     try:
-        all_agents_stmt = select(Agent)
-        all_agents = db.session.scalars(all_agents_stmt).all()
-
-        bonuses_created_count = 0
-        bonuses_updated_count = 0
-
-        for agent in all_agents:
-            volume = 0
-            agent_ids_to_sum = []  # List of IDs for volume calculation
-
-            # Determine volume scope (personal or downline) and calculate
-            if agent.level == 1:
-                agent_ids_to_sum = [agent.id]  # Level 1 uses personal sales
-            else:
-                agent_ids_to_sum = get_downline_agent_ids(
-                    agent.id, db.session
-                )  # Others use downline
-
-            # Calculate volume based on bonus type
-            if bonus_type == "Monthly":
-                volume = get_monthly_sales_volume(
-                    agent_ids_to_sum, year, month, db.session
-                )
-            elif bonus_type == "Quarterly":
-                volume = get_quarterly_sales_volume(
-                    agent_ids_to_sum, year, quarter, db.session
-                )
-            elif bonus_type == "Annual":
-                volume = get_annual_sales_volume(agent_ids_to_sum, year, db.session)
-
-            if volume > 0:
-                bonus_rate = get_bonus_rate_for_volume(agent.level, volume, db.session)
-                if bonus_rate > 0:
-                    bonus_amount = volume * bonus_rate
-
-                    # Check if bonus exists and Save/Update
-                    existing_bonus_stmt = select(Bonus).where(
-                        and_(
-                            Bonus.agent_id == agent.id,
-                            Bonus.period == period_str,
-                            Bonus.bonus_type == bonus_type,
-                        )
-                    )
-                    existing_bonus = db.session.scalar(existing_bonus_stmt)
-
-                    if existing_bonus:
-                        existing_bonus.amount = bonus_amount
-                        bonuses_updated_count += 1
-                    else:
-                        new_bonus = Bonus(
-                            amount=bonus_amount,
-                            bonus_type=bonus_type,
-                            period=period_str,
-                            agent_id=agent.id,
-                        )
-                        db.session.add(new_bonus)
-                        bonuses_created_count += 1
+        # Set-based volume reads; no per-agent subtree queries
+        results = calculate_bonuses_for_periods(
+            periods,
+            db.session,
+            engine=current_app.config["BONUS_ENGINE"],
+            volume_source=current_app.config["BONUS_VOLUME_SOURCE"],
+            incremental=incremental,
+        )
+        bonuses_created_count = sum(result["created"] for result in results)
+        bonuses_updated_count = sum(result["updated"] for result in results)
+        # Agents an incremental run did not need to recompute
+        agents_skipped_count = sum(result["skipped"] for result in results)
 
         db.session.commit()
+        if "year" not in data and "periods" not in data:
+            bonus_type, period_str = periods[0][0], periods[0][1]
+            return (
+                jsonify(
+                    {
+                        "message": f"{bonus_type} bonuses calculated for {period_str}. Created: {bonuses_created_count}, Updated: {bonuses_updated_count}",
+                        "mode": results[0]["mode"],
+                        "skipped": agents_skipped_count,
+                    }
+                ),
+                200,
+            )
         return (
             jsonify(
                 {
-                    "message": f"{bonus_type} bonuses calculated for {period_str}. Created: {bonuses_created_count}, Updated: {bonuses_updated_count}"
+                    "message": f"Bonuses calculated for {len(results)} periods. Created: {bonuses_created_count}, Updated: {bonuses_updated_count}",
+                    "skipped": agents_skipped_count,
+                    "results": results,
                 }
             ),
             200,
@@ -133,32 +167,69 @@ def calculate_bonuses():
         return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
 
 
+def parse_period_request(period_str, bonus_type):
+    """
+    Validates one requested period. Returns ((bonus_type, period_str, year,
+    month, quarter), None) or (None, error response).
+    """
+    # Validate bonus_type
+    if bonus_type not in BONUS_TYPES:
+        return None, (
+            jsonify(
+                {"error": "Invalid bonus type. Use Monthly, Quarterly, or Annual."}
+            ),
+            400,
+        )
+    if not period_str:
+        return None, (jsonify({"error": "Period string is required."}), 400)
+
+    try:
+        period_str, year, month, quarter = parse_bonus_period(bonus_type, period_str)
+    except ValueError:
+        return None, (
+            jsonify(
+                {
+                    "error": f"Invalid period format for {bonus_type}. Use YYYY-MM, YYYY-Q#, or YYYY."
+                }
+            ),
+            400,
+        )
+    return (bonus_type, period_str, year, month, quarter), None
+
+
 @bonuses_bp.route("/bonuses", methods=["GET"])
 def get_bonuses():
-    """Fetches calculated bonuses, joining with agent names."""
+    """
+    Fetches calculated bonuses, joining with agent names.
+    `stream=true` writes the list as a streamed JSON array in constant memory.
+    """
     try:
-        # Query bonuses and join with Agent to get names
+        # Query bonus columns and join with Agent to get names
         # Order by period descending, then agent name
         stmt = (
-            select(Bonus, Agent.name)
+            select(
+                Bonus.id,
+                Bonus.amount,
+                Bonus.bonus_type,
+                Bonus.period,
+                Bonus.agent_id,
+                Agent.name.label("agent_name"),
+            )
             .join(Agent, Bonus.agent_id == Agent.id)
             .order_by(Bonus.period.desc(), Agent.name)
         )
-        results = db.session.execute(stmt).all()
 
-        bonuses_list = []
-        for bonus, agent_name in results:
-            bonuses_list.append(
-                {
-                    "id": bonus.id,
-                    "amount": bonus.amount,
-                    "bonus_type": bonus.bonus_type,
-                    "period": bonus.period,
-                    "agent_id": bonus.agent_id,
-                    "agent_name": agent_name,
-                }
+        if request.args.get("stream", "").lower() == "true":
+            rows = db.session.execute(
+                stmt.execution_options(yield_per=STREAM_YIELD_PER)
+            )
+            return Response(
+                stream_with_context(iter_json_array(rows, serialize_bonus_row)),
+                mimetype="application/json",
             )
-        return jsonify(bonuses_list)
+
+        results = db.session.execute(stmt).all()
+        return jsonify([serialize_bonus_row(row) for row in results])
 
     except Exception as e:
         current_app.logger.error(f"Error fetching bonuses: {e}", exc_info=True)
@@ -166,3 +237,15 @@ def get_bonuses():
             jsonify({"error": "An internal error occurred while fetching bonuses"}),
             500,
         )
+
+
+def serialize_bonus_row(row):
+    """Converts a bonus list row (see get_bonuses) to its JSON shape."""
+    return {
+        "id": row.id,
+        "amount": row.amount,
+        "bonus_type": row.bonus_type,
+        "period": row.period,
+        "agent_id": row.agent_id,
+        "agent_name": row.agent_name,
+    }
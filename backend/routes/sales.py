@@ -1,17 +1,33 @@
 """
 Sales routes - sale recording and cancellation.
 """
-from flask import Blueprint, request, jsonify, current_app
-from sqlalchemy import select, and_
-from models import db, Agent, Sale, Commission, Clawback, Bonus, HierarchySnapshot
+from datetime import datetime, timezone
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from sqlalchemy import select, tuple_
+from models import db, Agent, Sale, Commission, CancellationJob
 from services import (
-    COMMISSION_RATES,
     get_upline,
-    get_downline_agent_ids,
-    get_monthly_sales_volume,
-    get_quarterly_sales_volume,
-    get_annual_sales_volume,
-    get_bonus_rate_for_volume,
+    SALES_BATCH_MAX_SIZE,
+    PAGE_DEFAULT_LIMIT,
+    PAGE_MAX_LIMIT,
+    encode_cursor,
+    decode_cursor,
+    STREAM_YIELD_PER,
+    iter_json_array,
+    parse_sale_date,
+    validate_sale_fields,
+    validate_sales_batch,
+    build_sale_records,
+    record_sales_bulk,
+    resolve_hierarchy_path_ids,
+    add_sales_to_volume_aggregates,
+    add_commissions_to_payout_ledger,
+    CANCEL_BATCH_MAX_SIZE,
+    cancel_sales,
+    mark_sales_cancelled,
+    enqueue_cancellation_job,
+    submit_cancellation_job,
+    retry_cancellation_job,
 )
 
 sales_bp = Blueprint("sales", __name__)
@@ -24,25 +40,9 @@ def create_sale():
     """
     data = request.get_json()
 
-    # Enhanced validation
-    if not data:
-        return jsonify({"error": "Request body is required"}), 400
-
-    if not data.get("policy_number") or not isinstance(data.get("policy_number"), str):
-        return jsonify({"error": "Policy number is required and must be a string"}), 400
-
-    # Check if policy_value exists in data (allowing 0 as a value)
-    if "policy_value" not in data or data.get("policy_value") is None:
-        return jsonify({"error": "Policy value is required and must be a number"}), 400
-
-    if not isinstance(data.get("policy_value"), (int, float)):
-        return jsonify({"error": "Policy value is required and must be a number"}), 400
-
-    if data.get("policy_value") <= 0:
-        return jsonify({"error": "Policy value must be greater than zero"}), 400
-
-    if not data.get("agent_id") or not isinstance(data.get("agent_id"), int):
-        return jsonify({"error": "Agent ID is required and must be an integer"}), 400
+    error = validate_sale_fields(data)
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
         # Verify agent exists
@@ -66,54 +66,42 @@ def create_sale():
                 ),
                 409,
             )
-        # 1. Save the Sale
+        # 1. Find the Upline
+        upline_managers = get_upline(
+            data["agent_id"],
+            db.session,
+            strategy=current_app.config["HIERARCHY_STRATEGY"],
+        )
+
+        # 2. Build the Hierarchy Snapshot path, FYC (seller) and Overrides (upline)
+        path, commission_rows = build_sale_records(
+            data["policy_value"], agent.id, upline_managers
+        )
+        path_id = resolve_hierarchy_path_ids([path], db.session)[path]
+
+        # 3. Save the Sale with its snapshot reference
         new_sale = Sale(
             policy_number=data["policy_number"],
             policy_value=data["policy_value"],
             agent_id=data["agent_id"],
+            hierarchy_path_id=path_id,
         )
         db.session.add(new_sale)
         # We need the sale_id, so we flush (like a pre-commit)
         db.session.flush()
 
-        # 2. Find the Upline
-        selling_agent = db.session.get(Agent, data["agent_id"])
-        upline_managers = get_upline(data["agent_id"], db.session)
-
-        all_recipients = [selling_agent] + upline_managers
+        # 4. Save the commissions and book them in the payout ledger
+        payout_date = datetime.now(timezone.utc)
+        db.session.add_all(
+            Commission(**row, sale_id=new_sale.id, payout_date=payout_date)
+            for row in commission_rows
+        )
+        add_commissions_to_payout_ledger(commission_rows, payout_date, db.session)
 
-        # 3. Create the Hierarchy Snapshot
-        for i, agent in enumerate(all_recipients):
-            snapshot = HierarchySnapshot(
-                sale_id=new_sale.id,
-                agent_id=agent.id,
-                upline_level=i,  # 0 = seller, 1 = first manager, etc.
-                upline_agent_id=agent.id,  # Storing the agent's own ID in this snapshot record
-            )
-            db.session.add(snapshot)
-
-        # 4. Calculate & Save FYC (for the seller)
-        fyc_amount = new_sale.policy_value * COMMISSION_RATES["FYC"]
-        fyc_commission = Commission(
-            amount=fyc_amount,
-            commission_type="FYC",
-            sale_id=new_sale.id,
-            agent_id=selling_agent.id,
+        # 5. Keep the monthly and downline volume aggregates in step
+        add_sales_to_volume_aggregates(
+            [(new_sale.agent_id, new_sale.sale_date, new_sale.policy_value)], db.session
         )
-        db.session.add(fyc_commission)
-
-        # 5. Calculate & Save Overrides (for the upline)
-        for manager in upline_managers:
-            rate = COMMISSION_RATES["Override"].get(manager.level)
-            if rate:
-                override_amount = new_sale.policy_value * rate
-                override_commission = Commission(
-                    amount=override_amount,
-                    commission_type="Override",
-                    sale_id=new_sale.id,
-                    agent_id=manager.id,
-                )
-                db.session.add(override_commission)
 
         # Commit all changes to the database
         db.session.commit()
@@ -132,35 +120,152 @@ def create_sale():
         )
 
 
+@sales_bp.route("/sales/batch", methods=["POST"])
+def create_sales_batch():
+    """
+    Records many sales (optionally with historical sale_date) in one transaction.
+    Valid rows are written with bulk inserts; invalid rows are reported per index.
+    """
+    data = request.get_json(silent=True)
+    payloads = data.get("sales") if isinstance(data, dict) else data
+
+    if not isinstance(payloads, list) or not payloads:
+        return jsonify({"error": "A non-empty list of sales is required"}), 400
+    if len(payloads) > SALES_BATCH_MAX_SIZE:
+        return (
+            jsonify(
+                {"error": f"A batch may contain at most {SALES_BATCH_MAX_SIZE} sales"}
+            ),
+            400,
+        )
+
+    try:
+        valid_rows, errors = validate_sales_batch(payloads, db.session)
+        sale_ids = record_sales_bulk(valid_rows, db.session)
+        db.session.commit()
+
+        results = [
+            {
+                "index": row["index"],
+                "policy_number": row["policy_number"],
+                "sale_id": sale_ids[row["policy_number"]],
+            }
+            for row in valid_rows
+        ]
+        return (
+            jsonify(
+                {
+                    "message": f"Batch processed. Created: {len(results)}, Failed: {len(errors)}",
+                    "created": len(results),
+                    "failed": len(errors),
+                    "results": results,
+                    "errors": errors,
+                }
+            ),
+            201 if results else 400,
+        )
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error recording sales batch: {e}", exc_info=True)
+        return (
+            jsonify({"error": "An internal error occurred while recording the batch"}),
+            500,
+        )
+
+
 @sales_bp.route("/sales", methods=["GET"])
 def get_sales():
+    """
+    Lists sales, newest first, with optional agent_id / from / to / is_cancelled
+    filters. Passing `limit` or `cursor` switches to keyset pagination on
+    (sale_date, id) and returns {"sales": [...], "next_cursor": ...}.
+    `stream=true` writes the full filtered list as a streamed JSON array.
+    """
     try:
-        # Query all sales, and join with the Agent table to get the agent's name
-        # Order by the most recent sale first
+        agent_id = request.args.get("agent_id", type=int)
+        is_cancelled = request.args.get("is_cancelled")
+        cursor = request.args.get("cursor")
+        limit = request.args.get("limit", type=int)
+        paginate = cursor is not None or "limit" in request.args
+
+        if paginate:
+            limit = limit if limit is not None else PAGE_DEFAULT_LIMIT
+            if not (1 <= limit <= PAGE_MAX_LIMIT):
+                return (
+                    jsonify({"error": f"Limit must be between 1 and {PAGE_MAX_LIMIT}"}),
+                    400,
+                )
+
+        # Select only the columns we serialize (no ORM objects per row)
         stmt = (
-            select(Sale, Agent.name)
+            select(
+                Sale.id,
+                Sale.policy_number,
+                Sale.policy_value,
+                Sale.sale_date,
+                Sale.agent_id,
+                Agent.name.label("agent_name"),
+                Sale.is_cancelled,
+            )
             .join(Agent, Sale.agent_id == Agent.id)
-            .order_by(Sale.sale_date.desc())
+            .order_by(Sale.sale_date.desc(), Sale.id.desc())
         )
 
-        # .all() will return a list of (Sale, agent_name) tuples
-        results = db.session.execute(stmt).all()
+        if agent_id is not None:
+            stmt = stmt.where(Sale.agent_id == agent_id)
+        if is_cancelled is not None:
+            if is_cancelled.lower() not in ("true", "false"):
+                return jsonify({"error": "is_cancelled must be true or false"}), 400
+            stmt = stmt.where(Sale.is_cancelled == (is_cancelled.lower() == "true"))
+        try:
+            if request.args.get("from"):
+                stmt = stmt.where(Sale.sale_date >= parse_sale_date(request.args["from"]))
+            if request.args.get("to"):
+                stmt = stmt.where(Sale.sale_date < parse_sale_date(request.args["to"]))
+        except ValueError:
+            return (
+                jsonify({"error": "from/to must be ISO 8601 dates (to is exclusive)"}),
+                400,
+            )
+
+        if request.args.get("stream", "").lower() == "true":
+            # Rows are fetched in batches and written as they arrive (constant memory)
+            rows = db.session.execute(
+                stmt.execution_options(yield_per=STREAM_YIELD_PER)
+            )
+            return Response(
+                stream_with_context(iter_json_array(rows, serialize_sale_row)),
+                mimetype="application/json",
+            )
 
-        sales_list = []
-        for sale, agent_name in results:  # Unpack the tuple here
-            sales_list.append(
-                {
-                    "id": sale.id,
-                    "policy_number": sale.policy_number,
-                    "policy_value": sale.policy_value,
-                    "sale_date": sale.sale_date.isoformat(),
-                    "agent_id": sale.agent_id,
-                    "agent_name": agent_name,
-                    "is_cancelled": sale.is_cancelled,
-                }
+        if not paginate:
+            return jsonify([serialize_sale_row(row) for row in db.session.execute(stmt)])
+
+        if cursor:
+            try:
+                after_date, after_id = decode_cursor(cursor)
+            except ValueError:
+                return jsonify({"error": "Invalid cursor"}), 400
+            # Seek past the last row of the previous page instead of OFFSET; the
+            # row-value comparison is a range on the (sale_date, id) index
+            stmt = stmt.where(
+                tuple_(Sale.sale_date, Sale.id) < tuple_(after_date, after_id)
             )
 
-        return jsonify(sales_list)
+        rows = db.session.execute(stmt.limit(limit + 1)).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = (
+            encode_cursor(rows[-1].sale_date, rows[-1].id) if has_more else None
+        )
+
+        return jsonify(
+            {
+                "sales": [serialize_sale_row(row) for row in rows],
+                "next_cursor": next_cursor,
+            }
+        )
 
     except Exception as e:
         current_app.logger.error(f"Error fetching sales: {e}", exc_info=True)
@@ -170,138 +275,125 @@ def get_sales():
         )
 
 
+def serialize_sale_row(row):
+    """Converts a sales list row (see get_sales) to its JSON shape."""
+    return {
+        "id": row.id,
+        "policy_number": row.policy_number,
+        "policy_value": row.policy_value,
+        "sale_date": row.sale_date.isoformat(),
+        "agent_id": row.agent_id,
+        "agent_name": row.agent_name,
+        "is_cancelled": row.is_cancelled,
+    }
+
+
 @sales_bp.route("/sales/<int:sale_id>/cancel", methods=["PUT"])
 def cancel_sale(sale_id):
     """
-    Marks a sale as cancelled. Creates clawback records for associated
-    commissions AND recalculates/creates clawbacks for affected monthly bonuses.
+    Marks a sale as cancelled and queues a job that creates clawback records
+    for associated commissions AND recalculates affected bonuses. The job's
+    progress is available from GET /api/sales/cancel-jobs/<job_id>.
     """
     try:
-        # 1. Find the sale
         sale_to_cancel = db.session.get(Sale, sale_id)
         if not sale_to_cancel:
             return jsonify({"error": "Sale not found"}), 404
         if sale_to_cancel.is_cancelled:
             return jsonify({"message": "Policy already marked as cancelled"}), 200
 
-        # --- Cancellation Starts ---
-        sale_to_cancel.is_cancelled = True
-
-        # --- Commission Clawback ---
-        related_commissions_stmt = select(Commission).where(
-            Commission.sale_id == sale_id
-        )
-        related_commissions = db.session.scalars(related_commissions_stmt).all()
+        # Commit the cancellation and its job together; clawbacks run in a worker
+        summary = mark_sales_cancelled([sale_id], db.session)
+        if not summary["cancelled"]:
+            # Another request cancelled it since the check above and owns its job
+            db.session.rollback()
+            return jsonify({"message": "Policy already marked as cancelled"}), 200
+        job = enqueue_cancellation_job(summary["cancelled"], db.session)
+        db.session.commit()
 
-        for commission in related_commissions:
-            clawback_record = Clawback(
-                amount=-commission.amount,
-                original_commission_id=commission.id,
-                sale_id=sale_id,
-            )
-            db.session.add(clawback_record)
+        submit_cancellation_job(current_app._get_current_object(), job.id)
 
-        # --- Bonus Clawback/Recalculation (Monthly, Quarterly, Annual) ---
-        # Find all agents involved in the original sale (seller + upline)
-        # We can use the HierarchySnapshot for this
-        snapshot_stmt = select(HierarchySnapshot.agent_id).where(
-            HierarchySnapshot.sale_id == sale_id
+        return (
+            jsonify(
+                {"message": "Policy cancelled and clawbacks initiated", "job_id": job.id}
+            ),
+            200,
         )
-        affected_agent_ids = db.session.scalars(snapshot_stmt).unique().all()
 
-        # Determine the periods of the sale
-        sale_year = sale_to_cancel.sale_date.year
-        sale_month = sale_to_cancel.sale_date.month
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error cancelling sale {sale_id}: {e}", exc_info=True)
+        return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
 
-        # Calculate which quarter the sale falls into
-        sale_quarter = (sale_month - 1) // 3 + 1
 
-        # Define periods for each bonus type
-        monthly_period = f"{sale_year}-{sale_month:02d}"
-        quarterly_period = f"{sale_year}-Q{sale_quarter}"
-        annual_period = f"{sale_year}"
+@sales_bp.route("/sales/cancel-jobs/<int:job_id>", methods=["GET"])
+def get_cancellation_job(job_id):
+    """Reports the status and progress of a queued cancellation job."""
+    job = db.session.get(CancellationJob, job_id)
+    if not job:
+        return jsonify({"error": "Cancellation job not found"}), 404
+    return jsonify(job.to_dict()), 200
 
-        # Process clawbacks for all three bonus types
-        bonus_types_and_periods = [
-            ("Monthly", monthly_period, sale_year, sale_month, None),
-            ("Quarterly", quarterly_period, sale_year, None, sale_quarter),
-            ("Annual", annual_period, sale_year, None, None),
-        ]
 
-        for bonus_type, period_str, year, month, quarter in bonus_types_and_periods:
-            for agent_id in affected_agent_ids:
-                agent = db.session.get(Agent, agent_id)
-                if not agent:
-                    continue  # Skip if agent somehow doesn't exist
-
-                # Find the original bonus calculation for this agent and period
-                original_bonus_stmt = select(Bonus).where(
-                    and_(
-                        Bonus.agent_id == agent_id,
-                        Bonus.period == period_str,
-                        Bonus.bonus_type == bonus_type,
-                    )
-                )
-                original_bonus = db.session.scalar(original_bonus_stmt)
-
-                if original_bonus:
-                    # Recalculate the volume *after* cancellation
-                    # Note: volume functions already exclude cancelled sales
-                    new_volume = 0
-                    agent_ids_to_sum = (
-                        [agent.id]
-                        if agent.level == 1
-                        else get_downline_agent_ids(agent.id, db.session)
-                    )
-
-                    # Calculate volume based on bonus type
-                    if bonus_type == "Monthly":
-                        new_volume = get_monthly_sales_volume(
-                            agent_ids_list=agent_ids_to_sum,
-                            year=year,
-                            month=month,
-                            db_session=db.session,
-                        )
-                    elif bonus_type == "Quarterly":
-                        new_volume = get_quarterly_sales_volume(
-                            agent_ids_list=agent_ids_to_sum,
-                            year=year,
-                            quarter=quarter,
-                            db_session=db.session,
-                        )
-                    elif bonus_type == "Annual":
-                        new_volume = get_annual_sales_volume(
-                            agent_ids_list=agent_ids_to_sum,
-                            year=year,
-                            db_session=db.session,
-                        )
-
-                    # Recalculate the expected bonus amount based on the new volume
-                    new_bonus_rate = get_bonus_rate_for_volume(
-                        agent.level, new_volume, db.session
-                    )
-                    new_expected_bonus_amount = new_volume * new_bonus_rate
-
-                    # Calculate the adjustment needed
-                    bonus_adjustment = new_expected_bonus_amount - original_bonus.amount
-
-                    # If an adjustment is needed, create a clawback record
-                    if (
-                        abs(bonus_adjustment) > 0.001
-                    ):  # Use a small tolerance for float comparison
-                        bonus_clawback = Clawback(
-                            amount=bonus_adjustment,  # Store the adjustment (can be negative)
-                            original_bonus_id=original_bonus.id,  # Link to the original bonus
-                            sale_id=sale_id,  # Link to the sale that triggered it
-                        )
-                        db.session.add(bonus_clawback)
-
-        # Commit sale cancellation, commission clawbacks, and bonus clawbacks
+@sales_bp.route("/sales/cancel-jobs/<int:job_id>/retry", methods=["POST"])
+def retry_failed_cancellation_job(job_id):
+    """Re-queues a failed cancellation job so its clawbacks are written."""
+    try:
+        job = db.session.get(CancellationJob, job_id)
+        if not job:
+            return jsonify({"error": "Cancellation job not found"}), 404
+        if not retry_cancellation_job(job_id, db.session):
+            return jsonify({"error": "Only failed jobs can be retried"}), 409
         db.session.commit()
 
-        return jsonify({"message": "Policy cancelled and clawbacks initiated"}), 200
+        submit_cancellation_job(current_app._get_current_object(), job_id)
+
+        db.session.refresh(job)
+        return jsonify(job.to_dict()), 202
 
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"Error cancelling sale {sale_id}: {e}", exc_info=True)
+        current_app.logger.error(f"Error retrying cancellation job {job_id}: {e}", exc_info=True)
+        return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
+
+
+@sales_bp.route("/sales/cancel", methods=["PUT"])
+def cancel_sales_batch():
+    """
+    Cancels a list of sales in one transaction. Affected bonus volumes are
+    recomputed once per (agent, period) across the whole batch.
+    """
+    data = request.get_json(silent=True)
+    sale_ids = data.get("sale_ids") if isinstance(data, dict) else data
+
+    if (
+        not isinstance(sale_ids, list)
+        or not sale_ids
+        or not all(isinstance(sale_id, int) for sale_id in sale_ids)
+    ):
+        return jsonify({"error": "A non-empty list of integer sale_ids is required"}), 400
+    if len(sale_ids) > CANCEL_BATCH_MAX_SIZE:
+        return (
+            jsonify(
+                {"error": f"A batch may cancel at most {CANCEL_BATCH_MAX_SIZE} sales"}
+            ),
+            400,
+        )
+
+    try:
+        summary = cancel_sales(sale_ids, db.session)
+        db.session.commit()
+        return (
+            jsonify(
+                {
+                    "message": f"Cancelled {len(summary['cancelled'])} policies and initiated clawbacks",
+                    **summary,
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error cancelling sales batch: {e}", exc_info=True)
         return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
@@ -3,22 +3,265 @@ Services package exports.
 """
 from services.commission_service import (
     COMMISSION_RATES,
+    HIERARCHY_STRATEGIES,
     get_upline,
     get_downline_agent_ids,
 )
+from services.hierarchy_cache import (
+    HierarchyNode,
+    get_hierarchy_cache,
+    get_hierarchy_version,
+    bump_hierarchy_version,
+    clear_hierarchy_cache,
+)
+from services.tier_cache import (
+    TierTable,
+    get_tier_table,
+    get_tier_version,
+    bump_tier_version,
+    clear_tier_table,
+)
+from services.hierarchy_service import (
+    add_agent_to_closure,
+    move_agent_in_closure,
+    remove_agent_from_closure,
+    rebuild_agent_closure,
+    agent_closure_is_consistent,
+    build_agent_tree,
+)
 from services.bonus_service import (
+    get_months_sales_volume,
     get_monthly_sales_volume,
     get_quarterly_sales_volume,
     get_annual_sales_volume,
     get_bonus_rate_for_volume,
+    get_bonus_rates_for_volumes,
+    get_sale_periods,
+    get_period_sales_volume,
+    get_period_months,
+    BONUS_TYPES,
+    parse_bonus_period,
+    get_year_periods,
+)
+from services.bonus_engine import (
+    BONUS_ENGINES,
+    BONUS_VOLUME_SOURCES,
+    resolve_bonus_engine,
+    get_personal_volumes,
+    rollup_downline_volumes,
+    compute_period_bonuses,
+    compute_period_bonuses_vectorized,
+    get_monthly_volume_buckets,
+    sum_monthly_buckets,
+    partition_subtrees,
+    compute_subtree_bonuses,
+    compute_bonuses_in_parallel,
+    get_bonus_process_pool,
+    shutdown_bonus_process_pool,
+    compute_bonuses_for_periods,
+    compute_dirty_bonuses_for_periods,
+    get_incremental_periods,
+    compute_bonus_runs,
+    calculate_bonuses_for_periods,
+    preview_bonuses_for_periods,
+    get_current_bonus_amounts,
+    calculate_period_bonuses,
+    upsert_bonuses,
+    merge_duplicate_bonuses,
+)
+from services.volume_service import (
+    add_sales_to_volume_aggregates,
+    remove_sales_from_volume_aggregates,
+    apply_sale_volume_deltas,
+    move_downline_volumes,
+    mark_bonus_agents_dirty,
+    mark_agent_periods_dirty,
+    get_dirty_bonus_agents,
+    clear_dirty_bonus_agents,
+    rebuild_agent_monthly_volume,
+    rebuild_downline_period_volume,
+    find_volume_aggregate_drift,
+    ensure_agent_closure,
+    get_periods_downline_volumes,
+    get_downline_period_volumes,
+)
+from services.ledger_service import (
+    LEDGER_COLUMNS,
+    get_payout_period,
+    get_bonus_payout_period,
+    add_to_payout_ledger,
+    add_commissions_to_payout_ledger,
+    add_bonus_changes_to_payout_ledger,
+    add_clawbacks_to_payout_ledger,
+    rebuild_payout_ledger,
+    find_payout_ledger_drift,
+    get_payout_statement,
+)
+from services.snapshot_service import (
+    encode_hierarchy_path,
+    decode_hierarchy_path,
+    resolve_hierarchy_path_ids,
+    get_sale_hierarchy_agent_ids,
+    count_legacy_snapshot_sales,
+    ensure_sale_path_column,
+    migrate_hierarchy_snapshots,
+)
+from services.sale_service import (
+    SALES_BATCH_MAX_SIZE,
+    validate_sale_fields,
+    parse_sale_date,
+    validate_sales_batch,
+    build_sale_records,
+    record_sales_bulk,
+)
+from services.sale_import import (
+    IMPORT_DEFAULT_CHUNK_SIZE,
+    parse_ndjson,
+    parse_csv,
+    import_sales,
+)
+from services.batching import chunked
+from services.pagination import (
+    PAGE_DEFAULT_LIMIT,
+    PAGE_MAX_LIMIT,
+    encode_cursor,
+    decode_cursor,
+)
+from services.streaming import STREAM_YIELD_PER, iter_json_array
+from services.cancellation_service import (
+    CANCEL_BATCH_MAX_SIZE,
+    BONUS_ADJUSTMENT_TOLERANCE,
+    cancel_sales,
+    mark_sales_cancelled,
+    create_cancellation_clawbacks,
+)
+from services.cancellation_jobs import (
+    enqueue_cancellation_job,
+    claim_cancellation_job,
+    run_cancellation_job,
+    retry_cancellation_job,
+    requeue_stale_cancellation_jobs,
+    init_cancellation_workers,
+    submit_cancellation_job,
+    resume_pending_cancellation_jobs,
 )
 
 __all__ = [
     "COMMISSION_RATES",
+    "HIERARCHY_STRATEGIES",
     "get_upline",
     "get_downline_agent_ids",
+    "HierarchyNode",
+    "get_hierarchy_cache",
+    "get_hierarchy_version",
+    "bump_hierarchy_version",
+    "clear_hierarchy_cache",
+    "TierTable",
+    "get_tier_table",
+    "get_tier_version",
+    "bump_tier_version",
+    "clear_tier_table",
+    "add_agent_to_closure",
+    "move_agent_in_closure",
+    "remove_agent_from_closure",
+    "rebuild_agent_closure",
+    "agent_closure_is_consistent",
+    "build_agent_tree",
+    "get_months_sales_volume",
     "get_monthly_sales_volume",
     "get_quarterly_sales_volume",
     "get_annual_sales_volume",
     "get_bonus_rate_for_volume",
+    "get_bonus_rates_for_volumes",
+    "get_sale_periods",
+    "get_period_sales_volume",
+    "get_period_months",
+    "BONUS_TYPES",
+    "parse_bonus_period",
+    "get_year_periods",
+    "BONUS_ENGINES",
+    "BONUS_VOLUME_SOURCES",
+    "resolve_bonus_engine",
+    "get_personal_volumes",
+    "rollup_downline_volumes",
+    "compute_period_bonuses",
+    "compute_period_bonuses_vectorized",
+    "get_monthly_volume_buckets",
+    "sum_monthly_buckets",
+    "partition_subtrees",
+    "compute_subtree_bonuses",
+    "compute_bonuses_in_parallel",
+    "get_bonus_process_pool",
+    "shutdown_bonus_process_pool",
+    "compute_bonuses_for_periods",
+    "compute_dirty_bonuses_for_periods",
+    "get_incremental_periods",
+    "compute_bonus_runs",
+    "calculate_bonuses_for_periods",
+    "preview_bonuses_for_periods",
+    "get_current_bonus_amounts",
+    "calculate_period_bonuses",
+    "upsert_bonuses",
+    "merge_duplicate_bonuses",
+    "add_sales_to_volume_aggregates",
+    "remove_sales_from_volume_aggregates",
+    "apply_sale_volume_deltas",
+    "move_downline_volumes",
+    "mark_bonus_agents_dirty",
+    "mark_agent_periods_dirty",
+    "get_dirty_bonus_agents",
+    "clear_dirty_bonus_agents",
+    "rebuild_agent_monthly_volume",
+    "rebuild_downline_period_volume",
+    "find_volume_aggregate_drift",
+    "ensure_agent_closure",
+    "get_periods_downline_volumes",
+    "get_downline_period_volumes",
+    "LEDGER_COLUMNS",
+    "get_payout_period",
+    "get_bonus_payout_period",
+    "add_to_payout_ledger",
+    "add_commissions_to_payout_ledger",
+    "add_bonus_changes_to_payout_ledger",
+    "add_clawbacks_to_payout_ledger",
+    "rebuild_payout_ledger",
+    "find_payout_ledger_drift",
+    "get_payout_statement",
+    "encode_hierarchy_path",
+    "decode_hierarchy_path",
+    "resolve_hierarchy_path_ids",
+    "get_sale_hierarchy_agent_ids",
+    "count_legacy_snapshot_sales",
+    "ensure_sale_path_column",
+    "migrate_hierarchy_snapshots",
+    "SALES_BATCH_MAX_SIZE",
+    "validate_sale_fields",
+    "parse_sale_date",
+    "validate_sales_batch",
+    "build_sale_records",
+    "record_sales_bulk",
+    "IMPORT_DEFAULT_CHUNK_SIZE",
+    "parse_ndjson",
+    "parse_csv",
+    "chunked",
+    "import_sales",
+    "PAGE_DEFAULT_LIMIT",
+    "PAGE_MAX_LIMIT",
+    "encode_cursor",
+    "decode_cursor",
+    "STREAM_YIELD_PER",
+    "iter_json_array",
+    "CANCEL_BATCH_MAX_SIZE",
+    "BONUS_ADJUSTMENT_TOLERANCE",
+    "cancel_sales",
+    "mark_sales_cancelled",
+    "create_cancellation_clawbacks",
+    "enqueue_cancellation_job",
+    "claim_cancellation_job",
+    "run_cancellation_job",
+    "retry_cancellation_job",
+    "requeue_stale_cancellation_jobs",
+    "init_cancellation_workers",
+    "submit_cancellation_job",
+    "resume_pending_cancellation_jobs",
 ]
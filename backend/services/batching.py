@@ -0,0 +1,14 @@
+"""
+Batching helpers - split long iterables into bounded chunks.
+"""
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """Yields lists of at most `size` items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,816 @@
+"""
+Bonus engine - one bonus run per period in a few set-based queries.
+
+Personal volumes come from one GROUP BY over the period's rows in the
+agent_monthly_volume aggregate. Downline volumes are read from the
+downline_period_volume rollup, one row per agent. Alternatively ("tree"
+source) the hierarchy cache rolls personal volumes up the tree in one
+post-order traversal. Tiers come from the in-memory tier cache and existing
+bonuses are loaded once.
+
+With NumPy installed, the tree source takes a vectorized path: the tree becomes a
+breadth-first parent-index array, downline sums accumulate one depth at a
+time from the leaves up, and tiers come from a searchsorted over each
+level's thresholds.
+
+With more than one worker, top-level agents' subtrees (which never share
+volume) are spread over a process pool and each worker computes its
+subtrees' bonuses; the main process does every read and the single write.
+The pool is created once per process and reused by every run. Its workers
+come from a forkserver (or spawn) context, never from forking the
+multi-threaded web process.
+
+Once a period has a run under the current tiers, later runs with the rollup
+source recompute only the agents whose volumes or level changed since
+(bonus_dirty_agent) and skip everyone else.
+"""
+import atexit
+import heapq
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from sqlalchemy import func, select, and_, update, delete, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import AgentMonthlyVolume, Bonus, BonusRun, Clawback
+from services.hierarchy_cache import HierarchyCache, get_hierarchy_cache
+from services.tier_cache import get_tier_table
+from services.bonus_service import get_period_months
+from services.volume_service import (
+    get_periods_downline_volumes,
+    get_downline_period_volumes,
+    get_dirty_bonus_agents,
+    clear_dirty_bonus_agents,
+)
+from services.batching import chunked
+from services.ledger_service import add_bonus_changes_to_payout_ledger
+
+try:
+    import numpy as np
+except ImportError:  # Optional: the pure-Python engine is used instead
+    np = None
+
+# "auto" picks "numpy" when it is installed
+BONUS_ENGINES = ("auto", "python", "numpy")
+# "rollup" reads downline_period_volume; "tree" rolls personal volumes up the cached tree
+BONUS_VOLUME_SOURCES = ("rollup", "tree")
+# Agents per existing-bonus lookup (keeps IN lists under SQLite's variable limit)
+BONUS_LOOKUP_CHUNK_SIZE = 500
+
+
+def get_personal_volumes(year, first_month, last_month, db_session):
+    """Returns {agent_id: non-cancelled sales volume} over an inclusive month range of one year."""
+    stmt = (
+        select(AgentMonthlyVolume.agent_id, func.sum(AgentMonthlyVolume.volume))
+        .where(
+            and_(
+                AgentMonthlyVolume.year == year,
+                AgentMonthlyVolume.month >= first_month,
+                AgentMonthlyVolume.month <= last_month,
+            )
+        )
+        .group_by(AgentMonthlyVolume.agent_id)
+    )
+    return {agent_id: volume for agent_id, volume in db_session.execute(stmt)}
+
+
+def rollup_downline_volumes(hierarchy, personal_volumes):
+    """
+    Returns {agent_id: own volume + every descendant's volume}.
+    Children are totalled before their parent (iterative post-order).
+    """
+    totals = {}
+    children = hierarchy.children
+    for root_id in hierarchy.roots():
+        stack = [(root_id, False)]
+        while stack:
+            agent_id, children_done = stack.pop()
+            if children_done:
+                total = personal_volumes.get(agent_id, 0.0)
+                for child_id in children.get(agent_id, ()):
+                    total += totals[child_id]
+                totals[agent_id] = total
+            else:
+                stack.append((agent_id, True))
+                stack.extend((child_id, False) for child_id in children.get(agent_id, ()))
+    return totals
+
+
+def resolve_bonus_engine(engine):
+    """Maps a BONUS_ENGINES name to the engine that will actually run."""
+    if engine not in BONUS_ENGINES:
+        raise ValueError(f"Unknown bonus engine: {engine}")
+    if engine == "auto":
+        return "numpy" if np is not None else "python"
+    if engine == "numpy" and np is None:
+        raise RuntimeError("The numpy bonus engine requires numpy to be installed")
+    return engine
+
+
+def compute_period_bonuses(
+    hierarchy,
+    personal_volumes,
+    tier_table,
+    engine="auto",
+    downline_volumes=None,
+    agent_ids=None,
+):
+    """
+    Returns {agent_id: (volume, bonus_amount)} for every agent that earns a bonus.
+    Level 1 agents are paid on personal volume, everyone else on downline volume.
+    Pass maintained downline_volumes (see get_periods_downline_volumes) to skip
+    the tree rollup altogether; with them, agent_ids limits the run to those agents.
+    """
+    if downline_volumes is None:
+        if resolve_bonus_engine(engine) == "numpy":
+            return compute_period_bonuses_vectorized(hierarchy, personal_volumes, tier_table)
+        downline_volumes = rollup_downline_volumes(hierarchy, personal_volumes)
+
+    agent_levels = hierarchy.level.items()
+    if agent_ids is not None:
+        agent_levels = [(agent_id, hierarchy.level[agent_id]) for agent_id in agent_ids]
+
+    candidates = []
+    for agent_id, agent_level in agent_levels:
+        if agent_level == 1:
+            volume = personal_volumes.get(agent_id, 0.0)
+        else:
+            volume = downline_volumes.get(agent_id, 0.0)
+        if volume > 0:
+            candidates.append((agent_id, agent_level, volume))
+
+    bonus_rates = tier_table.rates((agent_level, volume) for _, agent_level, volume in candidates)
+    return {
+        agent_id: (volume, volume * bonus_rate)
+        for (agent_id, _, volume), bonus_rate in zip(candidates, bonus_rates)
+        if bonus_rate > 0
+    }
+
+
+def get_tree_arrays(hierarchy):
+    """
+    NumPy view of the hierarchy, memoized per hierarchy version:
+    (ids, parent_positions, levels, depth_starts, id_order), where id_order sorts
+    ids for position lookups and depth_starts[d] is the first position at depth d.
+    """
+    arrays = hierarchy.derived.get("tree_arrays")
+    if arrays is None:
+        agent_ids, parent_positions, depths = hierarchy.topological_order()
+        ids = np.asarray(agent_ids, dtype=np.int64)
+        levels = np.fromiter(
+            (hierarchy.level[agent_id] for agent_id in agent_ids), dtype=np.int64, count=len(ids)
+        )
+        max_depth = depths[-1] if depths else 0
+        depth_starts = np.searchsorted(np.asarray(depths), np.arange(max_depth + 2))
+        arrays = (
+            ids,
+            np.asarray(parent_positions, dtype=np.int64),
+            levels,
+            depth_starts,
+            np.argsort(ids),
+        )
+        hierarchy.derived["tree_arrays"] = arrays
+    return arrays
+
+
+def compute_period_bonuses_vectorized(hierarchy, personal_volumes, tier_table):
+    """
+    NumPy implementation of compute_period_bonuses. Like TierTable.rate, it
+    expects each level's tiers to be non-overlapping [min, max) ranges.
+    """
+    ids, parents, levels, depth_starts, id_order = get_tree_arrays(hierarchy)
+    if not len(ids):
+        return {}
+
+    personal = np.zeros(len(ids))
+    if personal_volumes:
+        volume_ids = np.fromiter(personal_volumes.keys(), dtype=np.int64, count=len(personal_volumes))
+        volume_values = np.fromiter(
+            personal_volumes.values(), dtype=np.float64, count=len(personal_volumes)
+        )
+        sorted_ids = ids[id_order]
+        found = np.clip(np.searchsorted(sorted_ids, volume_ids), 0, len(ids) - 1)
+        known = sorted_ids[found] == volume_ids
+        personal[id_order[found[known]]] = volume_values[known]
+
+    # Depths are non-decreasing, so each depth is one contiguous slice;
+    # adding the deepest slice into its parents first leaves complete subtree totals
+    downline = personal.copy()
+    for depth in range(len(depth_starts) - 2, 0, -1):
+        rows = slice(depth_starts[depth], depth_starts[depth + 1])
+        downline += np.bincount(parents[rows], weights=downline[rows], minlength=len(ids))
+
+    volumes = np.where(levels == 1, personal, downline)
+    rates = np.zeros(len(ids))
+    for agent_level, tiers in tier_table.levels.items():
+        mask = levels == agent_level
+        min_volumes, max_volumes, bonus_rates = (np.asarray(column) for column in tiers)
+        level_volumes = volumes[mask]
+        tier_index = np.searchsorted(min_volumes, level_volumes, side="right") - 1
+        clipped = np.clip(tier_index, 0, None)
+        in_tier = (tier_index >= 0) & (level_volumes < max_volumes[clipped])
+        rates[mask] = np.where(in_tier, bonus_rates[clipped], 0.0)
+
+    earners = np.flatnonzero((volumes > 0) & (rates > 0))
+    return dict(
+        zip(
+            ids[earners].tolist(),
+            zip(volumes[earners].tolist(), (volumes[earners] * rates[earners]).tolist()),
+        )
+    )
+
+
+def get_monthly_volume_buckets(years, db_session, agent_ids=None):
+    """
+    Reads the years' monthly volumes: {(year, month): {agent_id: volume}}.
+    One query for every agent, or one per chunk of the given agent_ids.
+    """
+    stmt = select(
+        AgentMonthlyVolume.year,
+        AgentMonthlyVolume.month,
+        AgentMonthlyVolume.agent_id,
+        AgentMonthlyVolume.volume,
+    ).where(AgentMonthlyVolume.year.in_(years))
+    if agent_ids is None:
+        statements = [stmt]
+    else:
+        statements = [
+            stmt.where(AgentMonthlyVolume.agent_id.in_(agent_chunk))
+            for agent_chunk in chunked(sorted(agent_ids), BONUS_LOOKUP_CHUNK_SIZE)
+        ]
+    buckets = {}
+    for chunk_stmt in statements:
+        for year, month, agent_id, volume in db_session.execute(chunk_stmt):
+            buckets.setdefault((year, month), {})[agent_id] = volume
+    return buckets
+
+
+def sum_monthly_buckets(buckets, year, first_month, last_month):
+    """Derives {agent_id: volume} for a month range from the monthly buckets."""
+    totals = {}
+    for month in range(first_month, last_month + 1):
+        for agent_id, volume in buckets.get((year, month), {}).items():
+            totals[agent_id] = totals.get(agent_id, 0.0) + volume
+    return totals
+
+
+def partition_subtrees(hierarchy, workers):
+    """
+    Splits the tree into at most `workers` lists of (agent_id, parent_id, level)
+    rows, each holding whole top-level subtrees. Subtrees are dealt largest
+    first to the lightest list; rows keep the hierarchy's order, so a
+    HierarchyCache built from a list walks its subtrees exactly as the full one does.
+    """
+    agent_ids, parent_positions, _ = hierarchy.topological_order()
+    root_positions = []
+    subtree_sizes = {}
+    for position, parent_position in enumerate(parent_positions):
+        root_position = position if parent_position < 0 else root_positions[parent_position]
+        root_positions.append(root_position)
+        subtree_sizes[root_position] = subtree_sizes.get(root_position, 0) + 1
+
+    loads = [(0, partition) for partition in range(min(workers, len(subtree_sizes)))]
+    partition_of_root = {}
+    for root_position, size in sorted(subtree_sizes.items(), key=lambda item: -item[1]):
+        load, partition = heapq.heappop(loads)
+        partition_of_root[root_position] = partition
+        heapq.heappush(loads, (load + size, partition))
+
+    partition_of_agent = {
+        agent_id: partition_of_root[root_position]
+        for agent_id, root_position in zip(agent_ids, root_positions)
+    }
+    partitions = [[] for _ in loads]
+    for agent_id, parent_id in hierarchy.parent.items():
+        partitions[partition_of_agent[agent_id]].append(
+            (agent_id, parent_id, hierarchy.level[agent_id])
+        )
+    return partitions
+
+
+def compute_subtree_bonuses(rows, period_volumes, tier_table, engine="auto"):
+    """
+    Process pool task: bonuses for the subtrees in `rows`, one
+    {agent_id: (volume, bonus_amount)} per (personal, downline or None) pair.
+    """
+    hierarchy = HierarchyCache(None, rows)
+    return [
+        compute_period_bonuses(
+            hierarchy,
+            personal_volumes,
+            tier_table,
+            engine=engine,
+            downline_volumes=downline_volumes,
+        )
+        for personal_volumes, downline_volumes in period_volumes
+    ]
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_bonus_process_pool(workers):
+    """
+    Returns this process's long-lived bonus pool of `workers` processes,
+    creating it (or replacing one of another size) on first use. Worker
+    processes start on the first task and then stay up between runs.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool[0] != workers:
+            if _process_pool is not None:
+                _process_pool[1].shutdown(wait=False, cancel_futures=True)
+            start_method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            _process_pool = (
+                workers,
+                ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context(start_method),
+                ),
+            )
+        return _process_pool[1]
+
+
+@atexit.register
+def shutdown_bonus_process_pool():
+    """Stops this process's bonus pool, if one was started."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool[1].shutdown(cancel_futures=True)
+            _process_pool = None
+
+
+def compute_bonuses_in_parallel(hierarchy, period_volumes, tier_table, engine, workers):
+    """
+    Same result as compute_period_bonuses for each (personal, downline) pair,
+    computed per subtree partition on the shared pool of `workers` processes.
+    """
+    partitions = partition_subtrees(hierarchy, workers)
+    tasks = []
+    for rows in partitions:
+        agent_ids = {agent_id for agent_id, _, _ in rows}
+        # Ship each worker only its own agents' volumes
+        tasks.append(
+            [
+                (
+                    _select_agents(personal_volumes, agent_ids),
+                    None if downline_volumes is None else _select_agents(downline_volumes, agent_ids),
+                )
+                for personal_volumes, downline_volumes in period_volumes
+            ]
+        )
+
+    executor = get_bonus_process_pool(workers)
+    futures = [
+        executor.submit(compute_subtree_bonuses, rows, task, tier_table, engine)
+        for rows, task in zip(partitions, tasks)
+    ]
+    merged = [{} for _ in period_volumes]
+    for future in futures:
+        for bonuses, partition_bonuses in zip(merged, future.result()):
+            bonuses.update(partition_bonuses)
+    return merged
+
+
+def _select_agents(volumes, agent_ids):
+    return {agent_id: volume for agent_id, volume in volumes.items() if agent_id in agent_ids}
+
+
+def compute_bonuses_for_periods(
+    periods, db_session, engine="auto", volume_source="rollup", workers=1
+):
+    """
+    Computes, without writing, {agent_id: (volume, bonus_amount)} for each
+    (bonus_type, period_str, year, month, quarter) period, in input order.
+
+    Each year's monthly volumes are read once and bucketed by month;
+    quarters and years are summed from the buckets, and the rollup source
+    reads every period's downline rows in one query. With workers > 1 and
+    several top-level agents the bonuses are computed per subtree in a process
+    pool (see compute_bonuses_in_parallel).
+    """
+    if volume_source not in BONUS_VOLUME_SOURCES:
+        raise ValueError(f"Unknown bonus volume source: {volume_source}")
+    hierarchy = get_hierarchy_cache(db_session)
+    tier_table = get_tier_table(db_session)
+    buckets = get_monthly_volume_buckets({period[2] for period in periods}, db_session)
+    downline_by_period = None
+    if volume_source == "rollup":
+        downline_by_period = get_periods_downline_volumes(
+            {period[1] for period in periods}, db_session
+        )
+
+    period_volumes = []
+    for bonus_type, period_str, year, month, quarter in periods:
+        first_month, last_month = get_period_months(bonus_type, month, quarter)
+        period_volumes.append(
+            (
+                sum_monthly_buckets(buckets, year, first_month, last_month),
+                None if downline_by_period is None else downline_by_period.get(period_str, {}),
+            )
+        )
+
+    if workers > 1 and len(hierarchy.roots()) > 1:
+        return compute_bonuses_in_parallel(
+            hierarchy, period_volumes, tier_table, engine, workers
+        )
+    return [
+        compute_period_bonuses(
+            hierarchy,
+            personal_volumes,
+            tier_table,
+            engine=engine,
+            downline_volumes=downline_volumes,
+        )
+        for personal_volumes, downline_volumes in period_volumes
+    ]
+
+
+def compute_dirty_bonuses_for_periods(periods, db_session, dirty=None):
+    """
+    Incremental counterpart of compute_bonuses_for_periods for the rollup
+    source: computes only the agents marked in bonus_dirty_agent for each
+    period (or in dirty, marks already read by the caller).
+    Returns [(bonuses, agent_ids computed), ...] in input order.
+    """
+    hierarchy = get_hierarchy_cache(db_session)
+    tier_table = get_tier_table(db_session)
+    if dirty is None:
+        dirty = get_dirty_bonus_agents({period[1] for period in periods}, db_session)
+    dirty = {
+        period_key: sorted(agent_id for agent_id in agent_ids if agent_id in hierarchy.level)
+        for period_key, agent_ids in dirty.items()
+    }
+    all_dirty_ids = {agent_id for agent_ids in dirty.values() for agent_id in agent_ids}
+    if not all_dirty_ids:
+        return [({}, []) for _ in periods]
+
+    buckets = get_monthly_volume_buckets(
+        {period[2] for period in periods}, db_session, agent_ids=all_dirty_ids
+    )
+    downline_volumes = {}
+    for agent_chunk in chunked(sorted(all_dirty_ids), BONUS_LOOKUP_CHUNK_SIZE):
+        downline_volumes.update(
+            get_downline_period_volumes(agent_chunk, list(dirty), db_session)
+        )
+
+    results = []
+    for bonus_type, period_str, year, month, quarter in periods:
+        first_month, last_month = get_period_months(bonus_type, month, quarter)
+        agent_ids = dirty.get(period_str, [])
+        bonuses = compute_period_bonuses(
+            hierarchy,
+            sum_monthly_buckets(buckets, year, first_month, last_month),
+            tier_table,
+            downline_volumes={
+                agent_id: downline_volumes.get((agent_id, period_str), 0.0)
+                for agent_id in agent_ids
+            },
+            agent_ids=agent_ids,
+        )
+        results.append((bonuses, agent_ids))
+    return results
+
+
+def get_incremental_periods(periods, tier_table, db_session):
+    """
+    The periods whose latest bonus run used the current tiers, so only their
+    dirty agents can have a different bonus now (one query).
+    """
+    stmt = (
+        select(BonusRun.period, BonusRun.bonus_type, BonusRun.tier_signature)
+        .where(BonusRun.period.in_({period[1] for period in periods}))
+        .order_by(BonusRun.id)
+    )
+    # Later runs overwrite earlier ones
+    last_signatures = {
+        (period_str, bonus_type): tier_signature
+        for period_str, bonus_type, tier_signature in db_session.execute(stmt)
+    }
+    return [
+        period
+        for period in periods
+        if last_signatures.get((period[1], period[0])) == tier_table.signature
+    ]
+
+
+def compute_bonus_runs(
+    periods, db_session, engine="auto", volume_source="rollup", workers=1, incremental=True
+):
+    """
+    Computes each period fully or, with incremental and the rollup source,
+    only for its dirty agents when it already has a run under the current tiers.
+    The dirty marks are read before any volume, so every mark a run returns
+    is covered by the volumes it computed from.
+    Returns [{"bonuses", "mode", "agents_computed", "agents_skipped",
+    "marks"}, ...] in input order; marks is {agent_id: marked_at}.
+    """
+    hierarchy = get_hierarchy_cache(db_session)
+    marks = get_dirty_bonus_agents({period[1] for period in periods}, db_session)
+    incremental_periods = []
+    if incremental and volume_source == "rollup":
+        incremental_periods = get_incremental_periods(
+            periods, get_tier_table(db_session), db_session
+        )
+    full_periods = [period for period in periods if period not in incremental_periods]
+
+    runs = {}
+    if full_periods:
+        period_bonuses = compute_bonuses_for_periods(
+            full_periods,
+            db_session,
+            engine=engine,
+            volume_source=volume_source,
+            workers=workers,
+        )
+        for period, bonuses in zip(full_periods, period_bonuses):
+            runs[period] = {
+                "bonuses": bonuses,
+                "mode": "full",
+                "agents_computed": len(hierarchy.level),
+                "agents_skipped": 0,
+                "marks": marks.get(period[1], {}),
+            }
+    if incremental_periods:
+        period_bonuses = compute_dirty_bonuses_for_periods(
+            incremental_periods, db_session, dirty=marks
+        )
+        for period, (bonuses, agent_ids) in zip(incremental_periods, period_bonuses):
+            runs[period] = {
+                "bonuses": bonuses,
+                "mode": "incremental",
+                "agents_computed": len(agent_ids),
+                "agents_skipped": len(hierarchy.level) - len(agent_ids),
+                "marks": marks.get(period[1], {}),
+            }
+    return [runs[period] for period in periods]
+
+
+def calculate_bonuses_for_periods(
+    periods, db_session, engine="auto", volume_source="rollup", workers=1, incremental=True
+):
+    """
+    Calculates and saves the bonuses of each period (see compute_bonus_runs).
+    Each period's result set is written with one upsert; then the dirty marks
+    the run read are cleared and a BonusRun is recorded per period. The
+    caller owns the transaction.
+
+    Returns [{"period", "type", "created", "updated", "mode", "skipped"}, ...]
+    in input order.
+    """
+    runs = compute_bonus_runs(
+        periods,
+        db_session,
+        engine=engine,
+        volume_source=volume_source,
+        workers=workers,
+        incremental=incremental,
+    )
+    tier_signature = get_tier_table(db_session).signature
+    results = []
+    run_rows = []
+    read_marks = {}
+    for (bonus_type, period_str, _, _, _), run in zip(periods, runs):
+        counts = upsert_bonuses(bonus_type, period_str, run["bonuses"], db_session)
+        read_marks.update(
+            ((agent_id, period_str), marked_at) for agent_id, marked_at in run["marks"].items()
+        )
+        results.append(
+            {
+                "period": period_str,
+                "type": bonus_type,
+                **counts,
+                "mode": run["mode"],
+                "skipped": run["agents_skipped"],
+            }
+        )
+        run_rows.append(
+            {
+                "period": period_str,
+                "bonus_type": bonus_type,
+                "mode": run["mode"],
+                "tier_signature": tier_signature,
+                "agents_computed": run["agents_computed"],
+                "agents_skipped": run["agents_skipped"],
+                "created_count": counts["created"],
+                "updated_count": counts["updated"],
+            }
+        )
+
+    clear_dirty_bonus_agents(read_marks, db_session)
+    db_session.execute(insert(BonusRun), run_rows)
+    return results
+
+
+def preview_bonuses_for_periods(
+    periods, db_session, engine="auto", volume_source="rollup", workers=1, incremental=True
+):
+    """
+    Dry run of calculate_bonuses_for_periods: only reads (the volume
+    aggregates, dirty marks, tier cache and the bonus rows the run would
+    overwrite).
+
+    Returns [{"period", "type", "created", "updated", "mode", "skipped",
+    "bonuses"}, ...] where each bonus is {"agent_id", "agent_level", "volume",
+    "tier", "rate", "amount", "current_amount", "delta"}; current_amount is
+    None for a new bonus.
+    """
+    runs = compute_bonus_runs(
+        periods,
+        db_session,
+        engine=engine,
+        volume_source=volume_source,
+        workers=workers,
+        incremental=incremental,
+    )
+    hierarchy = get_hierarchy_cache(db_session)
+    tier_table = get_tier_table(db_session)
+    current_amounts = get_current_bonus_amounts(
+        {agent_id for run in runs for agent_id in run["bonuses"]},
+        {period[1] for period in periods},
+        db_session,
+    )
+
+    results = []
+    for (bonus_type, period_str, _, _, _), run in zip(periods, runs):
+        rows = []
+        for agent_id, (volume, amount) in sorted(run["bonuses"].items()):
+            agent_level = hierarchy.level[agent_id]
+            tier_name, bonus_rate = tier_table.tier(agent_level, volume)
+            current_amount = current_amounts.get((agent_id, period_str, bonus_type))
+            rows.append(
+                {
+                    "agent_id": agent_id,
+                    "agent_level": agent_level,
+                    "volume": volume,
+                    "tier": tier_name,
+                    "rate": bonus_rate,
+                    "amount": amount,
+                    "current_amount": current_amount,
+                    "delta": amount - (current_amount or 0.0),
+                }
+            )
+        created = sum(1 for row in rows if row["current_amount"] is None)
+        results.append(
+            {
+                "period": period_str,
+                "type": bonus_type,
+                "created": created,
+                "updated": len(rows) - created,
+                "mode": run["mode"],
+                "skipped": run["agents_skipped"],
+                "bonuses": rows,
+            }
+        )
+    return results
+
+
+def get_current_bonus_amounts(agent_ids, period_strs, db_session):
+    """
+    Returns {(agent_id, period, bonus_type): amount} of the agents' saved
+    bonuses in the given periods. Looks up by agent (the unique index's
+    leading column), a chunk of agents per query.
+    """
+    amounts = {}
+    for agent_chunk in chunked(sorted(agent_ids), BONUS_LOOKUP_CHUNK_SIZE):
+        stmt = select(Bonus.agent_id, Bonus.period, Bonus.bonus_type, Bonus.amount).where(
+            Bonus.agent_id.in_(agent_chunk), Bonus.period.in_(period_strs)
+        )
+        for agent_id, period_str, bonus_type, amount in db_session.execute(stmt):
+            amounts[(agent_id, period_str, bonus_type)] = amount
+    return amounts
+
+
+def calculate_period_bonuses(
+    bonus_type,
+    period_str,
+    year,
+    month,
+    quarter,
+    db_session,
+    engine="auto",
+    volume_source="rollup",
+    workers=1,
+    incremental=True,
+):
+    """
+    Calculates and saves the bonuses of one period.
+    The caller owns the transaction.
+
+    Returns a dict of created / updated / skipped counts.
+    """
+    (result,) = calculate_bonuses_for_periods(
+        [(bonus_type, period_str, year, month, quarter)],
+        db_session,
+        engine=engine,
+        volume_source=volume_source,
+        workers=workers,
+        incremental=incremental,
+    )
+    return {
+        "created": result["created"],
+        "updated": result["updated"],
+        "skipped": result["skipped"],
+    }
+
+
+def upsert_bonuses(bonus_type, period_str, bonuses, db_session):
+    """
+    Writes {agent_id: (volume, amount)} for one period with a single
+    INSERT ... ON CONFLICT (agent_id, period, bonus_type) DO UPDATE executemany.
+
+    Every row is sent with the same created_at; rows that come back with it
+    were inserted, the rest already existed and were updated. The change
+    against the previously saved amounts is booked in the payout ledger.
+    Returns a dict of created / updated counts.
+    """
+    if not bonuses:
+        return {"created": 0, "updated": 0}
+
+    saved_amounts = get_current_bonus_amounts(bonuses.keys(), [period_str], db_session)
+    add_bonus_changes_to_payout_ledger(
+        bonus_type,
+        period_str,
+        [
+            (agent_id, amount - saved_amounts.get((agent_id, period_str, bonus_type), 0.0))
+            for agent_id, (_, amount) in bonuses.items()
+        ],
+        db_session,
+    )
+
+    now = datetime.now(timezone.utc)
+    stmt = sqlite_insert(Bonus)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["agent_id", "period", "bonus_type"],
+        set_={"amount": stmt.excluded.amount, "updated_at": now},
+    ).returning(Bonus.created_at)
+    created_ats = db_session.scalars(
+        stmt,
+        [
+            {
+                "amount": amount,
+                "bonus_type": bonus_type,
+                "period": period_str,
+                "agent_id": agent_id,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for agent_id, (volume, amount) in bonuses.items()
+        ],
+    ).all()
+
+    # SQLite hands DateTime values back without a timezone
+    run_timestamp = now.replace(tzinfo=None)
+    created = sum(1 for created_at in created_ats if created_at.replace(tzinfo=None) == run_timestamp)
+    return {"created": created, "updated": len(created_ats) - created}
+
+
+def merge_duplicate_bonuses(db_session):
+    """
+    Collapses duplicate (agent_id, period, bonus_type) rows written before the
+    unique index existed, so it can be created. The lowest-ID row is kept (the
+    one older runs kept updating); clawbacks of the others are repointed to it.
+    Returns the number of rows removed. The caller owns the transaction.
+    """
+    key_columns = (Bonus.agent_id, Bonus.period, Bonus.bonus_type)
+    kept_ids = {
+        (agent_id, period, bonus_type): kept_id
+        for agent_id, period, bonus_type, kept_id in db_session.execute(
+            select(*key_columns, func.min(Bonus.id))
+            .group_by(*key_columns)
+            .having(func.count(Bonus.id) > 1)
+        )
+    }
+    if not kept_ids:
+        return 0
+
+    rows = db_session.execute(
+        select(Bonus.id, *key_columns).where(
+            Bonus.agent_id.in_({agent_id for agent_id, _, _ in kept_ids})
+        )
+    ).all()
+    replaced_by = {}
+    for bonus_id, agent_id, period, bonus_type in rows:
+        kept_id = kept_ids.get((agent_id, period, bonus_type))
+        if kept_id is not None and bonus_id != kept_id:
+            replaced_by[bonus_id] = kept_id
+
+    for bonus_id, kept_id in replaced_by.items():
+        db_session.execute(
+            update(Clawback)
+            .where(Clawback.original_bonus_id == bonus_id)
+            .values(original_bonus_id=kept_id)
+            .execution_options(synchronize_session=False)
+        )
+    db_session.execute(
+        delete(Bonus)
+        .where(Bonus.id.in_(replaced_by))
+        .execution_options(synchronize_session=False)
+    )
+    return len(replaced_by)
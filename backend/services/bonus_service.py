@@ -1,92 +1,137 @@
 """
 Bonus calculation services - volume calculations and tier lookups.
+
+Volumes are read from the agent_monthly_volume aggregate (see volume_service).
 """
-from datetime import datetime, timezone
 from sqlalchemy import func, select, and_
-from models import Sale, PerformanceTier
+from models import AgentMonthlyVolume
+from services.tier_cache import get_tier_table
 
+BONUS_TYPES = ("Monthly", "Quarterly", "Annual")
 
-def get_monthly_sales_volume(agent_ids_list, year, month, db_session):
-    """Calculates total sales volume for a list of agents in a given month."""
-    start_date = datetime(year, month, 1, tzinfo=timezone.utc)
-    if month == 12:
-        end_date = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
-    else:
-        end_date = datetime(year, month + 1, 1, tzinfo=timezone.utc)
 
-    stmt = select(func.sum(Sale.policy_value)).where(
+def get_months_sales_volume(agent_ids_list, year, first_month, last_month, db_session):
+    """
+    Sums the agents' pre-aggregated monthly volumes over an inclusive month
+    range of one year (at most 12 agent_monthly_volume rows per agent).
+    """
+    stmt = select(func.sum(AgentMonthlyVolume.volume)).where(
         and_(
-            Sale.agent_id.in_(agent_ids_list),
-            Sale.sale_date >= start_date,
-            Sale.sale_date < end_date,
-            Sale.is_cancelled == False,
+            AgentMonthlyVolume.agent_id.in_(agent_ids_list),
+            AgentMonthlyVolume.year == year,
+            AgentMonthlyVolume.month >= first_month,
+            AgentMonthlyVolume.month <= last_month,
         )
     )
     total_volume = db_session.scalar(stmt)
     return total_volume or 0.0
 
 
+def get_monthly_sales_volume(agent_ids_list, year, month, db_session):
+    """Calculates total sales volume for a list of agents in a given month."""
+    return get_months_sales_volume(agent_ids_list, year, month, month, db_session)
+
+
 def get_quarterly_sales_volume(agent_ids_list, year, quarter, db_session):
     """Calculates total sales volume for a list of agents in a given quarter."""
-    if quarter == 1:
-        start_month, end_month = 1, 3
-    elif quarter == 2:
-        start_month, end_month = 4, 6
-    elif quarter == 3:
-        start_month, end_month = 7, 9
-    elif quarter == 4:
-        start_month, end_month = 10, 12
-    else:
+    if quarter not in (1, 2, 3, 4):
         return 0.0  # Invalid quarter
-
-    start_date = datetime(year, start_month, 1, tzinfo=timezone.utc)
-    # End date is the start of the next quarter
-    if end_month == 12:
-        end_date = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
-    else:
-        end_date = datetime(year, end_month + 1, 1, tzinfo=timezone.utc)
-
-    stmt = select(func.sum(Sale.policy_value)).where(
-        and_(
-            Sale.agent_id.in_(agent_ids_list),
-            Sale.sale_date >= start_date,
-            Sale.sale_date < end_date,
-            Sale.is_cancelled == False,
-        )
-    )
-    total_volume = db_session.scalar(stmt)
-    return total_volume or 0.0
+    first_month, last_month = get_period_months("Quarterly", None, quarter)
+    return get_months_sales_volume(agent_ids_list, year, first_month, last_month, db_session)
 
 
 def get_annual_sales_volume(agent_ids_list, year, db_session):
     """Calculates total sales volume for a list of agents in a given year."""
-    start_date = datetime(year, 1, 1, tzinfo=timezone.utc)
-    end_date = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
-
-    stmt = select(func.sum(Sale.policy_value)).where(
-        and_(
-            Sale.agent_id.in_(agent_ids_list),
-            Sale.sale_date >= start_date,
-            Sale.sale_date < end_date,
-            Sale.is_cancelled == False,
-        )
-    )
-    total_volume = db_session.scalar(stmt)
-    return total_volume or 0.0
+    return get_months_sales_volume(agent_ids_list, year, 1, 12, db_session)
 
 
 def get_bonus_rate_for_volume(agent_level, volume, db_session):
-    """Finds the bonus rate based on agent level and sales volume."""
-    stmt = (
-        select(PerformanceTier.bonus_rate)
-        .where(
-            and_(
-                PerformanceTier.agent_level == agent_level,
-                PerformanceTier.min_volume <= volume,
-                PerformanceTier.max_volume > volume,
-            )
+    """Finds the bonus rate based on agent level and sales volume (cached tiers)."""
+    return get_tier_table(db_session).rate(agent_level, volume)
+
+
+def get_bonus_rates_for_volumes(pairs, db_session):
+    """Rates a list of (agent_level, volume) pairs in one call (cached tiers)."""
+    return get_tier_table(db_session).rates(pairs)
+
+
+def get_sale_periods(sale_date):
+    """
+    Returns the bonus periods a sale date falls into as
+    (bonus_type, period_str, year, month, quarter) tuples.
+    """
+    year, month = sale_date.year, sale_date.month
+    quarter = (month - 1) // 3 + 1
+    return [
+        ("Monthly", f"{year}-{month:02d}", year, month, None),
+        ("Quarterly", f"{year}-Q{quarter}", year, None, quarter),
+        ("Annual", f"{year}", year, None, None),
+    ]
+
+
+def get_period_sales_volume(agent_ids_list, bonus_type, year, month, quarter, db_session):
+    """Dispatches to the monthly, quarterly or annual volume calculation."""
+    if bonus_type == "Monthly":
+        return get_monthly_sales_volume(agent_ids_list, year, month, db_session)
+    elif bonus_type == "Quarterly":
+        return get_quarterly_sales_volume(agent_ids_list, year, quarter, db_session)
+    elif bonus_type == "Annual":
+        return get_annual_sales_volume(agent_ids_list, year, db_session)
+    return 0.0
+
+
+def get_period_months(bonus_type, month, quarter):
+    """Returns the inclusive (first_month, last_month) of a Monthly, Quarterly or Annual period."""
+    if bonus_type == "Monthly":
+        return month, month
+    if bonus_type == "Quarterly":
+        return (quarter - 1) * 3 + 1, quarter * 3
+    return 1, 12
+
+
+def parse_bonus_period(bonus_type, period_str):
+    """
+    Parses "YYYY-MM" (Monthly), "YYYY-Q#" (Quarterly) or "YYYY" (Annual) into
+    (canonical period_str, year, month, quarter). Raises ValueError if invalid.
+    """
+    try:
+        if bonus_type == "Monthly":
+            year, month = map(int, period_str.split("-"))
+            if not (1 <= month <= 12):
+                raise ValueError("Invalid month")
+            # Same period keys as get_sale_periods, so rollups and clawbacks line up
+            return f"{year}-{month:02d}", year, month, None
+        elif bonus_type == "Quarterly":
+            year_str, q_str = period_str.split("-")
+            year = int(year_str)
+            quarter = int(q_str[1:])  # Extract number from Q1, Q2 etc.
+            if not (1 <= quarter <= 4):
+                raise ValueError("Invalid quarter")
+            return f"{year}-Q{quarter}", year, None, quarter
+        elif bonus_type == "Annual":
+            year = int(period_str)
+            return f"{year}", year, None, None
+    except (AttributeError, IndexError) as e:
+        raise ValueError(str(e))
+    raise ValueError("Invalid bonus type")
+
+
+def get_year_periods(year, bonus_types=BONUS_TYPES):
+    """
+    Every (bonus_type, period_str, year, month, quarter) period of a year for
+    the given types: 12 monthly, 4 quarterly and 1 annual.
+    """
+    periods = []
+    if "Monthly" in bonus_types:
+        periods.extend(
+            ("Monthly", f"{year}-{month:02d}", year, month, None)
+            for month in range(1, 13)
         )
-        .limit(1)
-    )
-    rate = db_session.scalar(stmt)
-    return rate if rate is not None else 0.0
+    if "Quarterly" in bonus_types:
+        periods.extend(
+            ("Quarterly", f"{year}-Q{quarter}", year, None, quarter)
+            for quarter in range(1, 5)
+        )
+    if "Annual" in bonus_types:
+        periods.append(("Annual", f"{year}", year, None, None))
+    return periods
@@ -0,0 +1,180 @@
+"""
+Cancellation job queue - DB-backed jobs processed by an in-process worker pool.
+
+The cancel request only flips is_cancelled and inserts a pending job, so its
+latency no longer depends on the size of the hierarchy or the number of
+bonuses to recompute. Worker threads claim jobs atomically (pending -> running)
+and write the clawbacks and the job's completion in one transaction, so a job
+is applied exactly once even when several processes share the queue.
+
+A job left running by a process that died is re-queued at startup once its
+lease (CANCELLATION_JOB_LEASE_SECONDS) has expired; its clawbacks were rolled
+back with the dead transaction. Each claim stamps started_at, and a worker
+only completes the job while that stamp is still its own, so a re-queued job
+is never applied twice. Failed jobs go back to pending through
+retry_cancellation_job.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update
+from models import db, CancellationJob
+from services.cancellation_service import create_cancellation_clawbacks
+
+
+def enqueue_cancellation_job(sale_ids, db_session):
+    """Adds a pending job for already-cancelled sales. The caller commits."""
+    sale_ids = sorted(set(sale_ids))
+    job = CancellationJob(
+        sale_ids=json.dumps(sale_ids), status="pending", total_sales=len(sale_ids)
+    )
+    db_session.add(job)
+    db_session.flush()
+    return job
+
+
+def claim_cancellation_job(job_id, db_session):
+    """
+    Atomically moves a job from pending to running. Returns the claim's
+    started_at, or None if the job was already taken.
+    """
+    started_at = datetime.now(timezone.utc)
+    result = db_session.execute(
+        update(CancellationJob)
+        .where(CancellationJob.id == job_id, CancellationJob.status == "pending")
+        .values(status="running", started_at=started_at)
+        .execution_options(synchronize_session=False)
+    )
+    db_session.commit()
+    return started_at if result.rowcount == 1 else None
+
+
+def _finish_claimed_job(job_id, started_at, values, db_session):
+    """Ends a running job if the claim stamped started_at is still current."""
+    result = db_session.execute(
+        update(CancellationJob)
+        .where(
+            CancellationJob.id == job_id,
+            CancellationJob.status == "running",
+            CancellationJob.started_at == started_at,
+        )
+        .values(**values, completed_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def run_cancellation_job(job_id, db_session):
+    """Claims and processes one job. Returns the job, or None if it was not claimable."""
+    started_at = claim_cancellation_job(job_id, db_session)
+    if started_at is None:
+        return None
+
+    job = db_session.get(CancellationJob, job_id)
+    db_session.refresh(job)
+    try:
+        sale_ids = json.loads(job.sale_ids)
+        commission_count, bonus_count = create_cancellation_clawbacks(
+            sale_ids, db_session
+        )
+        finished = _finish_claimed_job(
+            job_id,
+            started_at,
+            {
+                "status": "completed",
+                "processed_sales": len(sale_ids),
+                "commission_clawbacks": commission_count,
+                "bonus_clawbacks": bonus_count,
+            },
+            db_session,
+        )
+        if finished:
+            db_session.commit()
+        else:
+            # The lease expired and the job was re-queued; its new claim applies it
+            db_session.rollback()
+    except Exception as e:
+        db_session.rollback()
+        _finish_claimed_job(
+            job_id, started_at, {"status": "failed", "error": str(e)}, db_session
+        )
+        db_session.commit()
+    db_session.refresh(job)
+    return job
+
+
+def retry_cancellation_job(job_id, db_session):
+    """Moves a failed job back to pending. Returns False if it is not failed. The caller commits."""
+    result = db_session.execute(
+        update(CancellationJob)
+        .where(CancellationJob.id == job_id, CancellationJob.status == "failed")
+        .values(status="pending", error=None, started_at=None, completed_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def requeue_stale_cancellation_jobs(lease_seconds, db_session):
+    """
+    Moves running jobs claimed more than lease_seconds ago (their process
+    died) back to pending. Returns their ids. The caller commits.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=lease_seconds)
+    return db_session.scalars(
+        update(CancellationJob)
+        .where(CancellationJob.status == "running", CancellationJob.started_at < cutoff)
+        .values(status="pending", started_at=None)
+        .returning(CancellationJob.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+
+def _run_job_in_app_context(app, job_id):
+    with app.app_context():
+        try:
+            run_cancellation_job(job_id, db.session)
+        except Exception as e:
+            app.logger.error(f"Cancellation job {job_id} crashed: {e}", exc_info=True)
+        finally:
+            db.session.remove()
+
+
+def init_cancellation_workers(app):
+    """Creates the worker thread pool (threads start lazily on first job)."""
+    app.extensions["cancellation_executor"] = ThreadPoolExecutor(
+        max_workers=app.config["CANCELLATION_WORKERS"],
+        thread_name_prefix="cancellation-worker",
+    )
+
+
+def submit_cancellation_job(app, job_id):
+    """
+    Hands a committed job to the worker pool and returns its Future.
+    With CANCELLATION_JOBS_EAGER the job runs inline instead (returns None).
+    """
+    if app.config.get("CANCELLATION_JOBS_EAGER"):
+        run_cancellation_job(job_id, db.session)
+        return None
+    return app.extensions["cancellation_executor"].submit(
+        _run_job_in_app_context, app, job_id
+    )
+
+
+def resume_pending_cancellation_jobs(app):
+    """
+    Re-submits jobs left pending by a previous process (e.g. after a restart),
+    after re-queueing running jobs whose lease has expired.
+    """
+    with app.app_context():
+        stale_ids = requeue_stale_cancellation_jobs(
+            app.config["CANCELLATION_JOB_LEASE_SECONDS"], db.session
+        )
+        db.session.commit()
+        if stale_ids:
+            app.logger.warning(f"Re-queued stale cancellation jobs: {stale_ids}")
+        pending_ids = db.session.scalars(
+            select(CancellationJob.id).where(CancellationJob.status == "pending")
+        ).all()
+    for job_id in pending_ids:
+        submit_cancellation_job(app, job_id)
+    return len(pending_ids)
@@ -0,0 +1,235 @@
+"""
+Cancellation services - commission clawbacks and bonus recalculation for cancelled sales.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import select, update, insert
+from models import Sale, Commission, Clawback, Bonus
+from services.hierarchy_cache import get_hierarchy_cache
+from services.snapshot_service import get_sale_hierarchy_agent_ids
+from services.volume_service import (
+    remove_sales_from_volume_aggregates,
+    get_downline_period_volumes,
+)
+from services.bonus_service import (
+    get_sale_periods,
+    get_period_months,
+    get_bonus_rates_for_volumes,
+)
+from services.bonus_engine import get_monthly_volume_buckets
+from services.ledger_service import add_clawbacks_to_payout_ledger
+
+CANCEL_BATCH_MAX_SIZE = 5000
+# Bonus adjustments smaller than this are treated as float noise
+BONUS_ADJUSTMENT_TOLERANCE = 0.001
+
+
+def cancel_sales(sale_ids, db_session):
+    """
+    Cancels a set of sales in one pass and processes their clawbacks.
+    The caller owns the transaction.
+
+    Returns a summary dict of cancelled / already_cancelled / not_found IDs and
+    clawback counts.
+    """
+    summary = mark_sales_cancelled(sale_ids, db_session)
+    commission_count, bonus_count = create_cancellation_clawbacks(
+        summary["cancelled"], db_session
+    )
+    summary["commission_clawbacks"] = commission_count
+    summary["bonus_clawbacks"] = bonus_count
+    return summary
+
+
+def mark_sales_cancelled(sale_ids, db_session):
+    """
+    Flips is_cancelled for every sale not already cancelled (one UPDATE) and
+    takes them out of the volume aggregates.
+
+    The UPDATE itself skips cancelled rows and returns the ids it flipped, so
+    when two requests cancel the same sale at once only one of them reports
+    it as cancelled and goes on to write its clawbacks.
+    Returns a summary dict of cancelled / already_cancelled / not_found IDs.
+    """
+    sale_ids = sorted(set(sale_ids))
+    sales = db_session.execute(
+        select(Sale.id, Sale.agent_id, Sale.sale_date, Sale.policy_value).where(
+            Sale.id.in_(sale_ids)
+        )
+    ).all()
+    found_ids = {sale.id for sale in sales}
+
+    flipped_ids = set()
+    if found_ids:
+        flipped_ids = set(
+            db_session.scalars(
+                update(Sale)
+                .where(Sale.id.in_(found_ids), Sale.is_cancelled == False)
+                .values(is_cancelled=True)
+                .returning(Sale.id)
+                .execution_options(synchronize_session="fetch")
+            ).all()
+        )
+    if flipped_ids:
+        remove_sales_from_volume_aggregates(
+            [
+                (sale.agent_id, sale.sale_date, sale.policy_value)
+                for sale in sales
+                if sale.id in flipped_ids
+            ],
+            db_session,
+        )
+
+    return {
+        "cancelled": sorted(flipped_ids),
+        "already_cancelled": sorted(found_ids - flipped_ids),
+        "not_found": [sale_id for sale_id in sale_ids if sale_id not in found_ids],
+        "commission_clawbacks": 0,
+        "bonus_clawbacks": 0,
+    }
+
+
+def create_cancellation_clawbacks(sale_ids, db_session):
+    """
+    Writes clawbacks for sales that have been marked cancelled:
+
+    - a negative clawback for every related commission (one executemany);
+    - for the union of affected (agent, bonus type, period) triples from the
+      sales' hierarchy path snapshots, each affected bonus is recomputed once and gets one
+      adjustment clawback, linked to the lowest triggering sale ID.
+
+    The bonus side is a fixed handful of queries however many agents and
+    periods are affected: one load of the original bonuses, one read of the
+    level 1 agents' monthly volumes, one of the downline rollup rows, and
+    tiers are rated in memory.
+
+    Returns (commission_clawback_count, bonus_clawback_count).
+    """
+    if not sale_ids:
+        return 0, 0
+    to_cancel = sorted(set(sale_ids))
+    processed_date = datetime.now(timezone.utc)
+    sale_dates = dict(
+        db_session.execute(
+            select(Sale.id, Sale.sale_date).where(Sale.id.in_(to_cancel))
+        ).all()
+    )
+
+    # --- Commission Clawbacks ---
+    commissions = db_session.execute(
+        select(
+            Commission.id, Commission.amount, Commission.sale_id, Commission.agent_id
+        ).where(Commission.sale_id.in_(to_cancel))
+    ).all()
+    if commissions:
+        db_session.execute(
+            insert(Clawback),
+            [
+                {
+                    "amount": -commission.amount,
+                    "original_commission_id": commission.id,
+                    "sale_id": commission.sale_id,
+                    "processed_date": processed_date,
+                }
+                for commission in commissions
+            ],
+        )
+        add_clawbacks_to_payout_ledger(
+            [(commission.agent_id, -commission.amount) for commission in commissions],
+            processed_date,
+            db_session,
+        )
+
+    # --- Bonus Clawback/Recalculation (Monthly, Quarterly, Annual) ---
+    # Union of affected (agent, bonus type, period) triples across all sales,
+    # remembering the lowest sale ID that triggered each one
+    hierarchy_by_sale = get_sale_hierarchy_agent_ids(to_cancel, db_session)
+    affected = {}
+    for sale_id, agent_ids in hierarchy_by_sale.items():
+        periods = get_sale_periods(sale_dates[sale_id])
+        for agent_id in agent_ids:
+            for bonus_type, period_str, year, month, quarter in periods:
+                key = (agent_id, bonus_type, period_str)
+                if key not in affected or sale_id < affected[key][0]:
+                    affected[key] = (sale_id, year, month, quarter)
+
+    if not affected:
+        return len(commissions), 0
+
+    affected_agent_ids = {agent_id for agent_id, _, _ in affected}
+    affected_periods = {period_str for _, _, period_str in affected}
+    original_bonuses = db_session.scalars(
+        select(Bonus).where(
+            Bonus.agent_id.in_(affected_agent_ids), Bonus.period.in_(affected_periods)
+        )
+    ).all()
+
+    hierarchy = get_hierarchy_cache(db_session)
+    # Post-cancellation volumes: level 1 agents are paid on their own monthly
+    # volumes (one grouped read), everyone else on one rollup row per bonus
+    level_one_ids = {
+        original_bonus.agent_id
+        for original_bonus in original_bonuses
+        if hierarchy.level.get(original_bonus.agent_id) == 1
+    }
+    personal_buckets = {}
+    if level_one_ids:
+        personal_buckets = get_monthly_volume_buckets(
+            {year for _, year, _, _ in affected.values()},
+            db_session,
+            agent_ids=level_one_ids,
+        )
+    downline_volumes = get_downline_period_volumes(
+        affected_agent_ids - level_one_ids, affected_periods, db_session
+    )
+    recalculated = []
+    for original_bonus in original_bonuses:
+        key = (original_bonus.agent_id, original_bonus.bonus_type, original_bonus.period)
+        agent_level = hierarchy.level.get(original_bonus.agent_id)
+        if key not in affected or agent_level is None:
+            continue
+
+        sale_id, year, month, quarter = affected[key]
+        # Recalculate the volume *after* cancellation, once per affected bonus
+        if agent_level == 1:
+            first_month, last_month = get_period_months(
+                original_bonus.bonus_type, month, quarter
+            )
+            new_volume = sum(
+                personal_buckets.get((year, period_month), {}).get(
+                    original_bonus.agent_id, 0.0
+                )
+                for period_month in range(first_month, last_month + 1)
+            )
+        else:
+            new_volume = downline_volumes.get(
+                (original_bonus.agent_id, original_bonus.period), 0.0
+            )
+        recalculated.append((original_bonus, sale_id, agent_level, new_volume))
+
+    # Rate every recalculated volume in one call against the cached tiers
+    new_bonus_rates = get_bonus_rates_for_volumes(
+        [(agent_level, new_volume) for _, _, agent_level, new_volume in recalculated],
+        db_session,
+    )
+    bonus_clawback_rows = []
+    bonus_clawback_agents = []
+    for (original_bonus, sale_id, _, new_volume), new_bonus_rate in zip(
+        recalculated, new_bonus_rates
+    ):
+        bonus_adjustment = new_volume * new_bonus_rate - original_bonus.amount
+
+        if abs(bonus_adjustment) > BONUS_ADJUSTMENT_TOLERANCE:
+            bonus_clawback_rows.append(
+                {
+                    "amount": bonus_adjustment,  # Can be negative
+                    "original_bonus_id": original_bonus.id,
+                    "sale_id": sale_id,
+                    "processed_date": processed_date,
+                }
+            )
+            bonus_clawback_agents.append((original_bonus.agent_id, bonus_adjustment))
+
+    if bonus_clawback_rows:
+        db_session.execute(insert(Clawback), bonus_clawback_rows)
+        add_clawbacks_to_payout_ledger(bonus_clawback_agents, processed_date, db_session)
+    return len(commissions), len(bonus_clawback_rows)
@@ -1,8 +1,10 @@
 """
 Commission calculation services - upline traversal and commission rates.
 """
-from sqlalchemy import select
-from models import Agent
+from sqlalchemy import select, literal
+from sqlalchemy.orm import aliased
+from models import Agent, AgentClosure
+from services.hierarchy_cache import HierarchyNode, get_hierarchy_cache
 
 
 COMMISSION_RATES = {
@@ -15,32 +17,76 @@ COMMISSION_RATES = {
 }
 
 
-def get_upline(agent_id, db_session):
-    """
-    Finds all managers in the agent's upline.
-    Returns a list of Agent objects.
-    """
-    upline = []
-    current_agent = db_session.get(Agent, agent_id)
+HIERARCHY_STRATEGIES = ("cache", "closure", "cte")
+
 
-    while current_agent and current_agent.parent_id:
-        parent = db_session.get(Agent, current_agent.parent_id)
-        if parent:
-            upline.append(parent)
-            current_agent = parent
-        else:
-            break
-    return upline
+def _check_strategy(strategy):
+    if strategy not in HIERARCHY_STRATEGIES:
+        raise ValueError(f"Unknown hierarchy strategy: {strategy}")
 
 
-def get_downline_agent_ids(agent_id, db_session):
-    """Recursively finds all agent IDs in the downline, including the starting agent."""
-    agent_ids = {agent_id}
+def get_upline(agent_id, db_session, strategy="cache"):
+    """
+    Finds all managers in the agent's upline, nearest first, as
+    HierarchyNode records (id, parent_id, level) whatever the strategy:
+    in memory ("cache"), or in a single query from the closure table
+    ("closure") or a recursive CTE over parent_id ("cte").
+    """
+    _check_strategy(strategy)
+
+    if strategy == "cache":
+        hierarchy = get_hierarchy_cache(db_session)
+        return [hierarchy.node(upline_id) for upline_id in hierarchy.upline_ids(agent_id)]
+    elif strategy == "cte":
+        upline = (
+            select(Agent.id, Agent.parent_id, literal(0).label("depth"))
+            .where(Agent.id == agent_id)
+            .cte("upline", recursive=True)
+        )
+        parent = aliased(Agent)
+        upline = upline.union_all(
+            select(parent.id, parent.parent_id, upline.c.depth + 1).join(
+                upline, parent.id == upline.c.parent_id
+            )
+        )
+        stmt = (
+            select(Agent.id, Agent.parent_id, Agent.level)
+            .join(upline, Agent.id == upline.c.id)
+            .where(upline.c.depth > 0)
+            .order_by(upline.c.depth)
+        )
+    else:
+        stmt = (
+            select(Agent.id, Agent.parent_id, Agent.level)
+            .join(AgentClosure, AgentClosure.ancestor_id == Agent.id)
+            .where(AgentClosure.descendant_id == agent_id, AgentClosure.depth > 0)
+            .order_by(AgentClosure.depth)
+        )
+    return [HierarchyNode(*row) for row in db_session.execute(stmt)]
 
-    children_stmt = select(Agent.id).where(Agent.parent_id == agent_id)
-    children_ids = db_session.scalars(children_stmt).all()
 
-    for child_id in children_ids:
-        agent_ids.update(get_downline_agent_ids(child_id, db_session))
+def get_downline_agent_ids(agent_id, db_session, strategy="cache"):
+    """Finds all agent IDs in the downline, including the starting agent."""
+    _check_strategy(strategy)
 
+    if strategy == "cache":
+        hierarchy = get_hierarchy_cache(db_session)
+        if agent_id not in hierarchy.parent:
+            return [agent_id]
+        return hierarchy.downline_ids(agent_id)
+    elif strategy == "cte":
+        downline = (
+            select(Agent.id).where(Agent.id == agent_id).cte("downline", recursive=True)
+        )
+        child = aliased(Agent)
+        downline = downline.union_all(
+            select(child.id).join(downline, child.parent_id == downline.c.id)
+        )
+        stmt = select(downline.c.id)
+    else:
+        stmt = select(AgentClosure.descendant_id).where(
+            AgentClosure.ancestor_id == agent_id
+        )
+    agent_ids = set(db_session.scalars(stmt).all())
+    agent_ids.add(agent_id)
     return list(agent_ids)
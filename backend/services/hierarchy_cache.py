@@ -0,0 +1,156 @@
+"""
+Hierarchy cache - process-wide in-memory parent/children/level maps.
+
+Each worker loads the agent tree once and keeps it until the hierarchy
+version counter in the database moves on. Agent routes bump the counter in
+the same transaction as the change, so every worker sees the new tree on its
+next lookup at the cost of one primary-key read. A transaction that has
+written agents (or bumped the counter) gets a private tree that is never
+cached, so flushed but uncommitted changes cannot leak to other requests.
+"""
+import threading
+from collections import deque, namedtuple
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.engine import Engine
+from models import Agent, HierarchyVersion
+
+HIERARCHY_VERSION_ROW_ID = 1
+# Set on a connection whose open transaction has written agents
+_HIERARCHY_CHANGED_KEY = "hierarchy_changed"
+
+HierarchyNode = namedtuple("HierarchyNode", ["id", "parent_id", "level"])
+
+
+class HierarchyCache:
+    """Immutable snapshot of the agent tree at one hierarchy version."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.parent = {}
+        self.level = {}
+        self.children = {}
+        self._topological_order = None
+        # Per-version memo for structures derived from the tree (e.g. engine arrays)
+        self.derived = {}
+        for agent_id, parent_id, level in rows:
+            self.parent[agent_id] = parent_id
+            self.level[agent_id] = level
+            self.children.setdefault(agent_id, [])
+        for agent_id, parent_id in self.parent.items():
+            if parent_id is not None:
+                self.children.setdefault(parent_id, []).append(agent_id)
+
+    def node(self, agent_id):
+        return HierarchyNode(agent_id, self.parent[agent_id], self.level[agent_id])
+
+    def roots(self):
+        return [agent_id for agent_id, parent_id in self.parent.items() if parent_id is None]
+
+    def upline_ids(self, agent_id):
+        """Ancestor IDs, nearest manager first."""
+        upline = []
+        parent_id = self.parent.get(agent_id)
+        while parent_id is not None and len(upline) <= len(self.parent):
+            upline.append(parent_id)
+            parent_id = self.parent.get(parent_id)
+        return upline
+
+    def topological_order(self):
+        """
+        Breadth-first (agent_ids, parent_positions, depths): every parent comes
+        before its children and depths never decrease. Roots have parent position -1.
+        """
+        if self._topological_order is None:
+            agent_ids, parent_positions, depths = [], [], []
+            position = {}
+            queue = deque((root_id, -1, 0) for root_id in self.roots())
+            while queue:
+                agent_id, parent_position, depth = queue.popleft()
+                position[agent_id] = len(agent_ids)
+                agent_ids.append(agent_id)
+                parent_positions.append(parent_position)
+                depths.append(depth)
+                for child_id in self.children.get(agent_id, ()):
+                    queue.append((child_id, position[agent_id], depth + 1))
+            self._topological_order = (agent_ids, parent_positions, depths)
+        return self._topological_order
+
+    def downline_ids(self, agent_id):
+        """Subtree IDs including the starting agent."""
+        agent_ids = [agent_id]
+        stack = list(self.children.get(agent_id, ()))
+        while stack:
+            child_id = stack.pop()
+            agent_ids.append(child_id)
+            stack.extend(self.children.get(child_id, ()))
+        return agent_ids
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_hierarchy_version(db_session):
+    """Reads the current hierarchy version (0 if the hierarchy was never changed)."""
+    version = db_session.scalar(
+        select(HierarchyVersion.version).where(
+            HierarchyVersion.id == HIERARCHY_VERSION_ROW_ID
+        )
+    )
+    return version or 0
+
+
+def bump_hierarchy_version(db_session):
+    """Invalidates every worker's cache. Call in the same transaction as the change."""
+    result = db_session.execute(
+        update(HierarchyVersion)
+        .where(HierarchyVersion.id == HIERARCHY_VERSION_ROW_ID)
+        .values(version=HierarchyVersion.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db_session.execute(
+            insert(HierarchyVersion).values(id=HIERARCHY_VERSION_ROW_ID, version=1)
+        )
+    db_session.connection().info[_HIERARCHY_CHANGED_KEY] = True
+
+
+def get_hierarchy_cache(db_session):
+    """Returns the cached tree, reloading it if the hierarchy version has changed."""
+    global _cache
+    # Reading the version autoflushes pending agent changes, which sets the flag
+    version = get_hierarchy_version(db_session)
+    if db_session.connection().info.get(_HIERARCHY_CHANGED_KEY):
+        # Uncommitted agent writes: only this transaction may see them
+        rows = db_session.execute(select(Agent.id, Agent.parent_id, Agent.level)).all()
+        return HierarchyCache(None, rows)
+
+    cache = _cache
+    if cache is not None and cache.version == version:
+        return cache
+
+    with _cache_lock:
+        if _cache is None or _cache.version != version:
+            rows = db_session.execute(select(Agent.id, Agent.parent_id, Agent.level)).all()
+            _cache = HierarchyCache(version, rows)
+        return _cache
+
+
+def clear_hierarchy_cache():
+    """Drops this worker's cache (e.g. after the database itself is recreated)."""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+@event.listens_for(Agent, "after_insert")
+@event.listens_for(Agent, "after_update")
+@event.listens_for(Agent, "after_delete")
+def _flag_agent_write(mapper, connection, target):
+    connection.info[_HIERARCHY_CHANGED_KEY] = True
+
+
+@event.listens_for(Engine, "commit")
+@event.listens_for(Engine, "rollback")
+def _end_hierarchy_transaction(connection):
+    connection.info.pop(_HIERARCHY_CHANGED_KEY, None)
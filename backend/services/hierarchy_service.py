@@ -0,0 +1,171 @@
+"""
+Hierarchy services - maintenance of the agent closure table.
+"""
+from sqlalchemy import select, insert, delete, literal, true, func, and_
+from models import Agent, AgentClosure
+from services.hierarchy_cache import bump_hierarchy_version
+
+
+def add_agent_to_closure(agent_id, parent_id, db_session):
+    """Adds closure rows for a newly created agent (itself plus every ancestor)."""
+    db_session.execute(
+        insert(AgentClosure).values(ancestor_id=agent_id, descendant_id=agent_id, depth=0)
+    )
+    if parent_id is not None:
+        ancestors_stmt = select(
+            AgentClosure.ancestor_id, literal(agent_id), AgentClosure.depth + 1
+        ).where(AgentClosure.descendant_id == parent_id)
+        db_session.execute(
+            insert(AgentClosure).from_select(
+                ["ancestor_id", "descendant_id", "depth"], ancestors_stmt
+            )
+        )
+
+
+def move_agent_in_closure(agent_id, new_parent_id, db_session):
+    """
+    Re-links an agent's whole subtree under a new parent (or makes it top-level).
+    Paths inside the subtree are kept; paths entering it from outside are replaced.
+    """
+    subtree_ids = select(AgentClosure.descendant_id).where(
+        AgentClosure.ancestor_id == agent_id
+    )
+    db_session.execute(
+        delete(AgentClosure)
+        .where(
+            AgentClosure.descendant_id.in_(subtree_ids),
+            AgentClosure.ancestor_id.not_in(subtree_ids),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    if new_parent_id is not None:
+        parent_paths = (
+            select(AgentClosure.ancestor_id, AgentClosure.depth)
+            .where(AgentClosure.descendant_id == new_parent_id)
+            .subquery()
+        )
+        subtree_paths = (
+            select(AgentClosure.descendant_id, AgentClosure.depth)
+            .where(AgentClosure.ancestor_id == agent_id)
+            .subquery()
+        )
+        new_paths_stmt = select(
+            parent_paths.c.ancestor_id,
+            subtree_paths.c.descendant_id,
+            parent_paths.c.depth + subtree_paths.c.depth + 1,
+        ).select_from(parent_paths.join(subtree_paths, true()))
+        db_session.execute(
+            insert(AgentClosure).from_select(
+                ["ancestor_id", "descendant_id", "depth"], new_paths_stmt
+            )
+        )
+
+
+def remove_agent_from_closure(agent_id, db_session):
+    """Removes every closure row referencing an agent (leaf agents only)."""
+    db_session.execute(
+        delete(AgentClosure)
+        .where(
+            (AgentClosure.descendant_id == agent_id)
+            | (AgentClosure.ancestor_id == agent_id)
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def build_agent_tree(db_session):
+    """
+    Builds the nested agent hierarchy (same shape as Agent.to_dict(include_children=True))
+    from one flat SELECT, linking each row to its parent in a single pass.
+    """
+    rows = db_session.execute(
+        select(Agent.id, Agent.name, Agent.level, Agent.parent_id).order_by(Agent.id)
+    ).all()
+
+    nodes = {}
+    children_by_parent = {}
+    top_level = []
+    for agent_id, name, level, parent_id in rows:
+        children = children_by_parent.setdefault(agent_id, [])
+        nodes[agent_id] = {
+            "id": agent_id,
+            "name": name,
+            "level": level,
+            "parent_id": parent_id,
+            "children": children,
+        }
+        if parent_id is None:
+            top_level.append(nodes[agent_id])
+        else:
+            children_by_parent.setdefault(parent_id, []).append(nodes[agent_id])
+
+    return top_level
+
+
+def agent_closure_is_consistent(db_session):
+    """
+    Cheap drift check of the closure table against Agent.parent_id: every
+    agent has its depth-0 self row, and the depth-1 rows are exactly the
+    (parent_id, id) links. An agent written without add_agent_to_closure,
+    or re-parented outside move_agent_in_closure, fails it.
+    """
+    agent_count = select(func.count(Agent.id)).scalar_subquery()
+    child_count = (
+        select(func.count(Agent.id)).where(Agent.parent_id.is_not(None)).scalar_subquery()
+    )
+    self_rows = (
+        select(func.count())
+        .select_from(AgentClosure)
+        .where(AgentClosure.depth == 0, AgentClosure.ancestor_id == AgentClosure.descendant_id)
+        .scalar_subquery()
+    )
+    parent_rows = (
+        select(func.count())
+        .select_from(AgentClosure)
+        .where(AgentClosure.depth == 1)
+        .scalar_subquery()
+    )
+    matching_parent_rows = (
+        select(func.count())
+        .select_from(AgentClosure)
+        .join(
+            Agent,
+            and_(
+                Agent.id == AgentClosure.descendant_id,
+                Agent.parent_id == AgentClosure.ancestor_id,
+            ),
+        )
+        .where(AgentClosure.depth == 1)
+        .scalar_subquery()
+    )
+    counts = db_session.execute(
+        select(agent_count, child_count, self_rows, parent_rows, matching_parent_rows)
+    ).one()
+    agents, children, selves, parents, matching = counts
+    return selves == agents and parents == matching == children
+
+
+def rebuild_agent_closure(db_session):
+    """
+    Rebuilds the closure table from Agent.parent_id in one pass.
+    Used to backfill existing databases and after agents are written outside the API.
+    """
+    db_session.execute(delete(AgentClosure).execution_options(synchronize_session=False))
+
+    parent_by_id = dict(db_session.execute(select(Agent.id, Agent.parent_id)).all())
+    rows = []
+    for agent_id in parent_by_id:
+        ancestor_id, depth = agent_id, 0
+        # depth guard protects against corrupted (cyclic) parent links
+        while ancestor_id is not None and depth <= len(parent_by_id):
+            rows.append(
+                {"ancestor_id": ancestor_id, "descendant_id": agent_id, "depth": depth}
+            )
+            ancestor_id = parent_by_id.get(ancestor_id)
+            depth += 1
+
+    if rows:
+        db_session.execute(insert(AgentClosure), rows)
+    bump_hierarchy_version(db_session)
+    return len(rows)
@@ -0,0 +1,195 @@
+"""
+Payout ledger services - incremental upkeep of agent_payout_ledger.
+
+Every write that moves an agent's money adds it to the agent's row for the
+payout month, in the same transaction:
+
+- commissions (sale creation) under their payout_date month;
+- bonuses (bonus runs) as the change against the saved amount, under the
+  last month of the bonus period;
+- clawbacks (cancellations) under their processed_date month, attributed to
+  the agent of the original commission or bonus.
+
+An agent's statement for a month is then one primary-key read.
+"""
+import math
+from datetime import datetime, timezone
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import AgentPayoutLedger, Bonus, Clawback, Commission
+
+LEDGER_COLUMNS = ("commissions", "bonuses", "clawbacks")
+# Ledger amounts closer than this to the source totals are float noise
+LEDGER_TOLERANCE = 0.01
+
+
+def get_payout_period(moment):
+    """Payout month key ("2025-05") of a datetime."""
+    return f"{moment.year}-{moment.month:02d}"
+
+
+def get_bonus_payout_period(bonus_type, period_str):
+    """Payout month of a bonus: the last month of its "2025-05", "2025-Q2" or "2025" period."""
+    if bonus_type == "Quarterly":
+        year, quarter = period_str.split("-Q")
+        return f"{year}-{int(quarter) * 3:02d}"
+    if bonus_type == "Annual":
+        return f"{period_str}-12"
+    return period_str
+
+
+def add_to_payout_ledger(entries, db_session):
+    """
+    Adds (agent_id, period, column, amount) entries to the ledger, folded into
+    one delta per (agent, period) and upserted in a single executemany.
+    The caller owns the transaction.
+    """
+    deltas = {}
+    for agent_id, period, column, amount in entries:
+        amounts = deltas.setdefault((agent_id, period), dict.fromkeys(LEDGER_COLUMNS, 0.0))
+        amounts[column] += amount
+    if not deltas:
+        return
+
+    stmt = sqlite_insert(AgentPayoutLedger)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["agent_id", "period"],
+        set_={
+            **{
+                column: getattr(AgentPayoutLedger, column) + stmt.excluded[column]
+                for column in LEDGER_COLUMNS
+            },
+            "net": AgentPayoutLedger.net + stmt.excluded.net,
+            "updated_at": datetime.now(timezone.utc),
+        },
+    )
+    db_session.execute(
+        stmt,
+        [
+            {
+                "agent_id": agent_id,
+                "period": period,
+                **amounts,
+                "net": sum(amounts.values()),
+            }
+            for (agent_id, period), amounts in deltas.items()
+        ],
+    )
+
+
+def add_commissions_to_payout_ledger(commission_rows, payout_date, db_session):
+    """Books commission rows (dicts with agent_id and amount) paid out on payout_date."""
+    period = get_payout_period(payout_date)
+    add_to_payout_ledger(
+        [(row["agent_id"], period, "commissions", row["amount"]) for row in commission_rows],
+        db_session,
+    )
+
+
+def add_bonus_changes_to_payout_ledger(bonus_type, period_str, changes, db_session):
+    """Books (agent_id, amount change) pairs from a bonus run of one period."""
+    period = get_bonus_payout_period(bonus_type, period_str)
+    add_to_payout_ledger(
+        [(agent_id, period, "bonuses", change) for agent_id, change in changes if change],
+        db_session,
+    )
+
+
+def add_clawbacks_to_payout_ledger(clawbacks, processed_date, db_session):
+    """Books (agent_id, amount) clawbacks processed on processed_date."""
+    period = get_payout_period(processed_date)
+    add_to_payout_ledger(
+        [(agent_id, period, "clawbacks", amount) for agent_id, amount in clawbacks],
+        db_session,
+    )
+
+
+def _source_ledger_entries(db_session):
+    """(agent_id, period, column, amount) totals from the commission, bonus and clawback tables."""
+    entries = []
+    commission_month = func.strftime("%Y-%m", Commission.payout_date)
+    for agent_id, period, amount in db_session.execute(
+        select(Commission.agent_id, commission_month, func.sum(Commission.amount))
+        .where(Commission.payout_date.is_not(None))
+        .group_by(Commission.agent_id, commission_month)
+    ):
+        entries.append((agent_id, period, "commissions", amount))
+
+    for agent_id, bonus_type, period_str, amount in db_session.execute(
+        select(Bonus.agent_id, Bonus.bonus_type, Bonus.period, func.sum(Bonus.amount)).group_by(
+            Bonus.agent_id, Bonus.bonus_type, Bonus.period
+        )
+    ):
+        entries.append(
+            (agent_id, get_bonus_payout_period(bonus_type, period_str), "bonuses", amount)
+        )
+
+    clawback_agent = func.coalesce(Commission.agent_id, Bonus.agent_id)
+    clawback_month = func.strftime("%Y-%m", Clawback.processed_date)
+    for agent_id, period, amount in db_session.execute(
+        select(clawback_agent, clawback_month, func.sum(Clawback.amount))
+        .outerjoin(Commission, Commission.id == Clawback.original_commission_id)
+        .outerjoin(Bonus, Bonus.id == Clawback.original_bonus_id)
+        .where(Clawback.processed_date.is_not(None), clawback_agent.is_not(None))
+        .group_by(clawback_agent, clawback_month)
+    ):
+        entries.append((agent_id, period, "clawbacks", amount))
+    return entries
+
+
+def rebuild_payout_ledger(db_session):
+    """
+    Recomputes agent_payout_ledger from the commission, bonus and clawback
+    tables (one grouped query each). Returns the number of rows written.
+    The caller owns the transaction.
+    """
+    entries = _source_ledger_entries(db_session)
+    db_session.execute(delete(AgentPayoutLedger))
+    add_to_payout_ledger(entries, db_session)
+    return db_session.scalar(select(func.count()).select_from(AgentPayoutLedger))
+
+
+def find_payout_ledger_drift(db_session):
+    """
+    Compares every ledger row with what a rebuild would write (commissions,
+    bonuses, clawbacks and net, within float noise), so writes made around
+    the hooks are noticed. Returns the sorted (agent_id, period) keys that
+    differ, including rows missing on either side.
+    """
+    expected = {}
+    for agent_id, period, column, amount in _source_ledger_entries(db_session):
+        amounts = expected.setdefault((agent_id, period), dict.fromkeys(LEDGER_COLUMNS, 0.0))
+        amounts[column] += amount
+    actual = {
+        (row.agent_id, row.period): row
+        for row in db_session.execute(
+            select(
+                AgentPayoutLedger.agent_id,
+                AgentPayoutLedger.period,
+                *(getattr(AgentPayoutLedger, column) for column in LEDGER_COLUMNS),
+                AgentPayoutLedger.net,
+            )
+        )
+    }
+
+    drifted = []
+    for key in expected.keys() | actual.keys():
+        amounts = expected.get(key, dict.fromkeys(LEDGER_COLUMNS, 0.0))
+        row = actual.get(key)
+        expected_values = [*amounts.values(), sum(amounts.values())]
+        actual_values = (
+            [0.0] * len(expected_values)
+            if row is None
+            else [*(getattr(row, column) for column in LEDGER_COLUMNS), row.net]
+        )
+        if not all(
+            math.isclose(want, have, abs_tol=LEDGER_TOLERANCE)
+            for want, have in zip(expected_values, actual_values)
+        ):
+            drifted.append(key)
+    return sorted(drifted)
+
+
+def get_payout_statement(agent_id, period, db_session):
+    """The agent's ledger row for one payout month (primary-key read), or None."""
+    return db_session.get(AgentPayoutLedger, (agent_id, period), populate_existing=True)
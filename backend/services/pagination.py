@@ -0,0 +1,28 @@
+"""
+Keyset pagination helpers - opaque cursors over (sort key, id) pairs.
+"""
+import base64
+import json
+from datetime import datetime
+
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 500
+
+
+def encode_cursor(sort_key, row_id):
+    """Encodes the sort key (a timestamp or an int) of the last row on a page."""
+    if isinstance(sort_key, datetime):
+        sort_key = sort_key.isoformat()
+    payload = json.dumps([sort_key, row_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, key_type=datetime):
+    """Decodes a cursor into (sort key, id). Raises ValueError if malformed."""
+    try:
+        sort_key, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if key_type is datetime:
+            return datetime.fromisoformat(sort_key), int(row_id)
+        return key_type(sort_key), int(row_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
@@ -0,0 +1,80 @@
+"""
+Streaming sale import - generator pipeline from NDJSON/CSV files to bulk writes.
+
+Every stage consumes and yields lazily, so only one chunk of rows is held in
+memory at a time regardless of file size.
+"""
+import csv
+import json
+import time
+from services.batching import chunked
+from services.sale_service import validate_sales_batch, record_sales_bulk
+
+IMPORT_DEFAULT_CHUNK_SIZE = 1000
+
+
+def parse_ndjson(lines):
+    """Yields (row_number, payload, parse_error) for each non-blank NDJSON line."""
+    for row_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield row_number, json.loads(line), None
+        except json.JSONDecodeError as e:
+            yield row_number, None, f"Invalid JSON: {e.msg}"
+
+
+def _coerce(value, cast):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return value  # Left as-is so validation reports the field
+
+
+def parse_csv(lines):
+    """Yields (row_number, payload, parse_error) for each CSV data row."""
+    reader = csv.DictReader(lines)
+    for row_number, row in enumerate(reader, start=1):
+        payload = {
+            "policy_number": row.get("policy_number"),
+            "policy_value": _coerce(row.get("policy_value"), float),
+            "agent_id": _coerce(row.get("agent_id"), int),
+        }
+        if row.get("sale_date"):
+            payload["sale_date"] = row["sale_date"]
+        yield row_number, payload, None
+
+
+def import_sales(parsed_rows, db_session, chunk_size=IMPORT_DEFAULT_CHUNK_SIZE):
+    """
+    Validates, resolves uplines and writes commissions chunk by chunk,
+    committing after each chunk. Yields a progress dict per chunk containing
+    the chunk's errors as (row_number, message) pairs.
+    """
+    started = time.perf_counter()
+    total_created = 0
+    total_failed = 0
+
+    for chunk in chunked(parsed_rows, chunk_size):
+        errors = [(row_number, error) for row_number, _, error in chunk if error]
+        rows = [(row_number, payload) for row_number, payload, error in chunk if not error]
+
+        valid_rows, row_errors = validate_sales_batch(
+            [payload for _, payload in rows], db_session
+        )
+        record_sales_bulk(valid_rows, db_session)
+        db_session.commit()
+
+        errors.extend((rows[e["index"]][0], e["error"]) for e in row_errors)
+        total_created += len(valid_rows)
+        total_failed += len(errors)
+        elapsed = time.perf_counter() - started
+
+        yield {
+            "created": total_created,
+            "failed": total_failed,
+            "errors": sorted(errors),
+            "elapsed": elapsed,
+            "rows_per_second": (total_created + total_failed) / elapsed if elapsed else 0.0,
+        }
@@ -0,0 +1,211 @@
+"""
+Sale recording services - validation, hierarchy path/commission rows and bulk ingestion.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import select, insert
+from models import Sale, Commission
+from services.commission_service import COMMISSION_RATES
+from services.hierarchy_cache import get_hierarchy_cache
+from services.snapshot_service import encode_hierarchy_path, resolve_hierarchy_path_ids
+from services.volume_service import add_sales_to_volume_aggregates
+from services.ledger_service import add_commissions_to_payout_ledger
+
+SALES_BATCH_MAX_SIZE = 10000
+# Keeps IN (...) lists well below SQLite's bound-parameter limit
+POLICY_LOOKUP_CHUNK_SIZE = 500
+
+
+def validate_sale_fields(data):
+    """Checks the fields of one sale payload. Returns an error message or None."""
+    if not data or not isinstance(data, dict):
+        return "Request body is required"
+
+    if not data.get("policy_number") or not isinstance(data.get("policy_number"), str):
+        return "Policy number is required and must be a string"
+
+    # Check if policy_value exists in data (allowing 0 as a value)
+    if "policy_value" not in data or data.get("policy_value") is None:
+        return "Policy value is required and must be a number"
+
+    if not isinstance(data.get("policy_value"), (int, float)):
+        return "Policy value is required and must be a number"
+
+    if data.get("policy_value") <= 0:
+        return "Policy value must be greater than zero"
+
+    if not data.get("agent_id") or not isinstance(data.get("agent_id"), int):
+        return "Agent ID is required and must be an integer"
+
+    return None
+
+
+def parse_sale_date(value):
+    """Parses an ISO 8601 sale date; naive values are taken as UTC."""
+    sale_date = datetime.fromisoformat(value)
+    if sale_date.tzinfo is None:
+        return sale_date.replace(tzinfo=timezone.utc)
+    return sale_date.astimezone(timezone.utc)
+
+
+def build_sale_records(policy_value, agent_id, upline):
+    """
+    Builds the compact hierarchy path and the commission rows for one sale.
+    `upline` is the seller's managers, nearest first, as objects with id and level.
+    Returns (path, commission_rows); the caller adds sale_id to the commission rows.
+    """
+    path = encode_hierarchy_path([agent_id] + [manager.id for manager in upline])
+
+    commission_rows = [
+        {
+            "amount": policy_value * COMMISSION_RATES["FYC"],
+            "commission_type": "FYC",
+            "agent_id": agent_id,
+        }
+    ]
+    for manager in upline:
+        rate = COMMISSION_RATES["Override"].get(manager.level)
+        if rate:
+            commission_rows.append(
+                {
+                    "amount": policy_value * rate,
+                    "commission_type": "Override",
+                    "agent_id": manager.id,
+                }
+            )
+
+    return path, commission_rows
+
+
+def _find_existing_policy_numbers(policy_numbers, db_session):
+    existing = set()
+    policy_numbers = list(policy_numbers)
+    for start in range(0, len(policy_numbers), POLICY_LOOKUP_CHUNK_SIZE):
+        chunk = policy_numbers[start : start + POLICY_LOOKUP_CHUNK_SIZE]
+        stmt = select(Sale.policy_number).where(Sale.policy_number.in_(chunk))
+        existing.update(db_session.scalars(stmt).all())
+    return existing
+
+
+def validate_sales_batch(payloads, db_session):
+    """
+    Validates a list of sale payloads together.
+    Returns (valid_rows, errors); each valid row carries its original index.
+    """
+    hierarchy = get_hierarchy_cache(db_session)
+    errors = []
+    candidates = []
+    seen_policy_numbers = set()
+
+    for index, data in enumerate(payloads):
+        error = validate_sale_fields(data)
+        sale_date = None
+        if error is None and data.get("sale_date") is not None:
+            try:
+                sale_date = parse_sale_date(data["sale_date"])
+            except (TypeError, ValueError):
+                error = "Sale date must be an ISO 8601 date string"
+        if error is None and data["agent_id"] not in hierarchy.level:
+            error = f"Agent with ID {data['agent_id']} not found"
+        if error is None and data["policy_number"] in seen_policy_numbers:
+            error = f"Policy number {data['policy_number']} is duplicated in the batch"
+
+        if error:
+            errors.append(
+                {
+                    "index": index,
+                    "policy_number": data.get("policy_number") if isinstance(data, dict) else None,
+                    "error": error,
+                }
+            )
+            continue
+
+        seen_policy_numbers.add(data["policy_number"])
+        candidates.append(
+            {
+                "index": index,
+                "policy_number": data["policy_number"],
+                "policy_value": data["policy_value"],
+                "agent_id": data["agent_id"],
+                "sale_date": sale_date or datetime.now(timezone.utc),
+            }
+        )
+
+    existing = _find_existing_policy_numbers(seen_policy_numbers, db_session)
+    valid_rows = []
+    for row in candidates:
+        if row["policy_number"] in existing:
+            errors.append(
+                {
+                    "index": row["index"],
+                    "policy_number": row["policy_number"],
+                    "error": f"Policy number {row['policy_number']} already exists",
+                }
+            )
+        else:
+            valid_rows.append(row)
+
+    errors.sort(key=lambda e: e["index"])
+    return valid_rows, errors
+
+
+def record_sales_bulk(rows, db_session):
+    """
+    Writes validated sales with set-based inserts: distinct hierarchy paths are
+    resolved once, then one executemany each for sales, commissions, the
+    volume aggregates and the payout ledger.
+    Uplines are resolved in memory. Returns {policy_number: sale_id}.
+    The caller owns the transaction.
+    """
+    if not rows:
+        return {}
+
+    hierarchy = get_hierarchy_cache(db_session)
+
+    upline_by_agent = {}
+    records = []
+    for row in rows:
+        agent_id = row["agent_id"]
+        if agent_id not in upline_by_agent:
+            upline_by_agent[agent_id] = [
+                hierarchy.node(upline_id) for upline_id in hierarchy.upline_ids(agent_id)
+            ]
+        path, commissions = build_sale_records(
+            row["policy_value"], agent_id, upline_by_agent[agent_id]
+        )
+        records.append((row, path, commissions))
+
+    path_ids = resolve_hierarchy_path_ids({path for _, path, _ in records}, db_session)
+
+    sale_results = db_session.execute(
+        insert(Sale).returning(
+            Sale.id, Sale.policy_number, sort_by_parameter_order=True
+        ),
+        [
+            {
+                "policy_number": row["policy_number"],
+                "policy_value": row["policy_value"],
+                "agent_id": row["agent_id"],
+                "sale_date": row["sale_date"],
+                "is_cancelled": False,
+                "hierarchy_path_id": path_ids[path],
+            }
+            for row, path, _ in records
+        ],
+    ).all()
+    sale_ids = {policy_number: sale_id for sale_id, policy_number in sale_results}
+
+    payout_date = datetime.now(timezone.utc)
+    commission_rows = []
+    for row, _, commissions in records:
+        for commission in commissions:
+            commission["sale_id"] = sale_ids[row["policy_number"]]
+            commission["payout_date"] = payout_date
+            commission_rows.append(commission)
+
+    db_session.execute(insert(Commission), commission_rows)
+    add_commissions_to_payout_ledger(commission_rows, payout_date, db_session)
+    add_sales_to_volume_aggregates(
+        [(row["agent_id"], row["sale_date"], row["policy_value"]) for row in rows],
+        db_session,
+    )
+    return sale_ids
@@ -0,0 +1,140 @@
+"""
+Hierarchy snapshot services - compact upline paths stored once per distinct chain.
+
+A sale references one HierarchyPath row ("seller/manager/.../top") instead of
+writing a HierarchySnapshot row per level. Sales by the same agent under the
+same managers share a path, so storage and snapshot reads no longer grow with
+the depth of the hierarchy.
+"""
+from sqlalchemy import select, insert, update, delete, func, inspect, text
+from models import Sale, HierarchyPath, HierarchySnapshot
+
+PATH_SEPARATOR = "/"
+# Keeps IN (...) lists well below SQLite's bound-parameter limit
+PATH_LOOKUP_CHUNK_SIZE = 500
+SNAPSHOT_MIGRATION_CHUNK_SIZE = 1000
+
+
+def encode_hierarchy_path(agent_ids):
+    """Encodes seller + upline agent IDs (seller first) as one string."""
+    return PATH_SEPARATOR.join(str(agent_id) for agent_id in agent_ids)
+
+
+def decode_hierarchy_path(path):
+    """Returns the agent IDs of an encoded path, seller first (index = upline level)."""
+    return [int(agent_id) for agent_id in path.split(PATH_SEPARATOR)] if path else []
+
+
+def resolve_hierarchy_path_ids(paths, db_session):
+    """Returns {path: id}, inserting any path not stored yet."""
+    paths = list(set(paths))
+    path_ids = {}
+    for start in range(0, len(paths), PATH_LOOKUP_CHUNK_SIZE):
+        chunk = paths[start : start + PATH_LOOKUP_CHUNK_SIZE]
+        stmt = select(HierarchyPath.path, HierarchyPath.id).where(
+            HierarchyPath.path.in_(chunk)
+        )
+        path_ids.update(db_session.execute(stmt).all())
+
+    missing = [path for path in paths if path not in path_ids]
+    if missing:
+        inserted = db_session.execute(
+            insert(HierarchyPath).returning(HierarchyPath.path, HierarchyPath.id),
+            [{"path": path} for path in missing],
+        ).all()
+        path_ids.update(inserted)
+    return path_ids
+
+
+def get_sale_hierarchy_agent_ids(sale_ids, db_session):
+    """
+    Returns {sale_id: [seller_id, manager_id, ...]} from the compact snapshots.
+    Legacy sales not converted yet (flask migrate-snapshots) are read from
+    their per-level HierarchySnapshot rows.
+    """
+    rows = db_session.execute(
+        select(Sale.id, HierarchyPath.path)
+        .join(HierarchyPath, Sale.hierarchy_path_id == HierarchyPath.id)
+        .where(Sale.id.in_(sale_ids))
+    ).all()
+    agent_ids_by_sale = {sale_id: decode_hierarchy_path(path) for sale_id, path in rows}
+
+    legacy_sale_ids = [sale_id for sale_id in sale_ids if sale_id not in agent_ids_by_sale]
+    if legacy_sale_ids:
+        legacy_rows = db_session.execute(
+            select(HierarchySnapshot.sale_id, HierarchySnapshot.agent_id)
+            .where(HierarchySnapshot.sale_id.in_(legacy_sale_ids))
+            .order_by(HierarchySnapshot.sale_id, HierarchySnapshot.upline_level)
+        ).all()
+        for sale_id, agent_id in legacy_rows:
+            agent_ids_by_sale.setdefault(sale_id, []).append(agent_id)
+    return agent_ids_by_sale
+
+
+def count_legacy_snapshot_sales(db_session):
+    """Number of sales still stored as per-level HierarchySnapshot rows."""
+    return db_session.scalar(
+        select(func.count(HierarchySnapshot.sale_id.distinct()))
+    )
+
+
+def ensure_sale_path_column(db_session):
+    """Adds sale.hierarchy_path_id to databases created before it existed."""
+    columns = {column["name"] for column in inspect(db_session.connection()).get_columns("sale")}
+    if "hierarchy_path_id" not in columns:
+        db_session.execute(
+            text(
+                "ALTER TABLE sale ADD COLUMN hierarchy_path_id INTEGER "
+                "REFERENCES hierarchy_path (id)"
+            )
+        )
+        db_session.commit()
+
+
+def migrate_hierarchy_snapshots(db_session, chunk_size=SNAPSHOT_MIGRATION_CHUNK_SIZE):
+    """
+    Converts legacy per-level HierarchySnapshot rows into compact paths,
+    one chunk of sales per transaction. Safe to re-run; returns the number
+    of sales converted.
+    """
+    ensure_sale_path_column(db_session)
+
+    converted = 0
+    while True:
+        sale_ids = db_session.scalars(
+            select(HierarchySnapshot.sale_id)
+            .distinct()
+            .order_by(HierarchySnapshot.sale_id)
+            .limit(chunk_size)
+        ).all()
+        if not sale_ids:
+            return converted
+
+        rows = db_session.execute(
+            select(HierarchySnapshot.sale_id, HierarchySnapshot.agent_id)
+            .where(HierarchySnapshot.sale_id.in_(sale_ids))
+            .order_by(HierarchySnapshot.sale_id, HierarchySnapshot.upline_level)
+        ).all()
+        agent_ids_by_sale = {}
+        for sale_id, agent_id in rows:
+            agent_ids_by_sale.setdefault(sale_id, []).append(agent_id)
+
+        paths_by_sale = {
+            sale_id: encode_hierarchy_path(agent_ids)
+            for sale_id, agent_ids in agent_ids_by_sale.items()
+        }
+        path_ids = resolve_hierarchy_path_ids(paths_by_sale.values(), db_session)
+        db_session.execute(
+            update(Sale),
+            [
+                {"id": sale_id, "hierarchy_path_id": path_ids[path]}
+                for sale_id, path in paths_by_sale.items()
+            ],
+        )
+        db_session.execute(
+            delete(HierarchySnapshot)
+            .where(HierarchySnapshot.sale_id.in_(sale_ids))
+            .execution_options(synchronize_session=False)
+        )
+        db_session.commit()
+        converted += len(sale_ids)
@@ -0,0 +1,26 @@
+"""
+Streaming JSON helpers - write large result sets as a JSON array piece by piece.
+"""
+import json
+
+STREAM_YIELD_PER = 1000
+
+
+def iter_json_array(rows, serialize, chunk_size=STREAM_YIELD_PER):
+    """
+    Yields a JSON array as text chunks of up to `chunk_size` elements.
+    `rows` should be a lazily fetched result (e.g. executed with yield_per),
+    so only one chunk of rows is ever held in memory.
+    """
+    yield "["
+    buffer = []
+    first = True
+    for row in rows:
+        buffer.append(json.dumps(serialize(row)))
+        if len(buffer) >= chunk_size:
+            yield ("" if first else ",") + ",".join(buffer)
+            first = False
+            buffer = []
+    if buffer:
+        yield ("" if first else ",") + ",".join(buffer)
+    yield "]"
@@ -0,0 +1,147 @@
+"""
+Tier cache - process-wide in-memory PerformanceTier table with bisect lookups.
+
+There are only a handful of tier rows, so each worker loads them once and
+answers every rate lookup from sorted per-level min_volume lists. Like the
+hierarchy cache, the table is kept until the tier version counter in the
+database moves on: ORM writes to PerformanceTier bump the counter in the same
+transaction, so every worker reloads after the commit (and a rollback undoes
+the bump). A lookup costs one primary-key read of the counter.
+"""
+import hashlib
+import threading
+from bisect import bisect_right
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.engine import Engine
+from models import PerformanceTier, TierVersion
+
+TIER_VERSION_ROW_ID = 1
+# Set on a connection whose open transaction has bumped the tier version
+_TIERS_CHANGED_KEY = "tiers_changed"
+
+
+class TierTable:
+    """Immutable snapshot of the performance tiers, keyed by agent level."""
+
+    def __init__(self, rows):
+        # {agent_level: ([min_volume, ...], [max_volume, ...], [bonus_rate, ...])}
+        self.levels = {}
+        # {agent_level: [tier_name, ...]}, in the same order
+        self.tier_names = {}
+        rows = sorted((tuple(row) for row in rows), key=lambda row: (row[0], row[1]))
+        # Identifies this set of tiers; bonus runs record it to detect tier changes
+        self.signature = hashlib.sha256(repr(rows).encode()).hexdigest()
+        for agent_level, min_volume, max_volume, bonus_rate, tier_name in rows:
+            min_volumes, max_volumes, bonus_rates = self.levels.setdefault(
+                agent_level, ([], [], [])
+            )
+            min_volumes.append(min_volume)
+            max_volumes.append(max_volume)
+            bonus_rates.append(bonus_rate)
+            self.tier_names.setdefault(agent_level, []).append(tier_name)
+
+    def _tier_index(self, agent_level, volume):
+        tiers = self.levels.get(agent_level)
+        if tiers is None:
+            return None
+        min_volumes, max_volumes, _ = tiers
+        index = bisect_right(min_volumes, volume) - 1
+        if index < 0 or volume >= max_volumes[index]:
+            return None
+        return index
+
+    def rate(self, agent_level, volume):
+        """Bonus rate of the tier whose [min_volume, max_volume) contains volume (0.0 if none)."""
+        index = self._tier_index(agent_level, volume)
+        return 0.0 if index is None else self.levels[agent_level][2][index]
+
+    def tier(self, agent_level, volume):
+        """(tier_name, bonus_rate) of the tier containing volume, or (None, 0.0)."""
+        index = self._tier_index(agent_level, volume)
+        if index is None:
+            return None, 0.0
+        return self.tier_names[agent_level][index], self.levels[agent_level][2][index]
+
+    def rates(self, pairs):
+        """Rates a list of (agent_level, volume) pairs in one call."""
+        rate = self.rate
+        return [rate(agent_level, volume) for agent_level, volume in pairs]
+
+
+# (tier version, TierTable)
+_tier_table = None
+_tier_lock = threading.Lock()
+
+
+def get_tier_version(db_session):
+    """Reads the current tier version (0 if the tiers were never changed)."""
+    version = db_session.scalar(
+        select(TierVersion.version).where(TierVersion.id == TIER_VERSION_ROW_ID)
+    )
+    return version or 0
+
+
+def bump_tier_version(connection):
+    """
+    Invalidates every worker's tier table. Call in the same transaction as the
+    change (ORM writes to PerformanceTier do this themselves).
+    """
+    result = connection.execute(
+        update(TierVersion)
+        .where(TierVersion.id == TIER_VERSION_ROW_ID)
+        .values(version=TierVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(TierVersion).values(id=TIER_VERSION_ROW_ID, version=1))
+    connection.info[_TIERS_CHANGED_KEY] = True
+
+
+def _load_tier_table(db_session):
+    rows = db_session.execute(
+        select(
+            PerformanceTier.agent_level,
+            PerformanceTier.min_volume,
+            PerformanceTier.max_volume,
+            PerformanceTier.bonus_rate,
+            PerformanceTier.tier_name,
+        )
+    ).all()
+    return TierTable(rows)
+
+
+def get_tier_table(db_session):
+    """Returns the cached tier table, reloading it if the tier version has changed."""
+    global _tier_table
+    version = get_tier_version(db_session)
+    cached = _tier_table
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    if db_session.connection().info.get(_TIERS_CHANGED_KEY):
+        # Uncommitted tiers: only this transaction may see them
+        return _load_tier_table(db_session)
+
+    with _tier_lock:
+        if _tier_table is None or _tier_table[0] != version:
+            _tier_table = (version, _load_tier_table(db_session))
+        return _tier_table[1]
+
+
+def clear_tier_table():
+    """Drops this worker's tier cache (e.g. after the database itself is recreated)."""
+    global _tier_table
+    with _tier_lock:
+        _tier_table = None
+
+
+@event.listens_for(PerformanceTier, "after_insert")
+@event.listens_for(PerformanceTier, "after_update")
+@event.listens_for(PerformanceTier, "after_delete")
+def _bump_tier_version_on_write(mapper, connection, target):
+    bump_tier_version(connection)
+
+
+@event.listens_for(Engine, "commit")
+@event.listens_for(Engine, "rollback")
+def _end_tier_transaction(connection):
+    connection.info.pop(_TIERS_CHANGED_KEY, None)
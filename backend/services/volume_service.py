@@ -0,0 +1,413 @@
+"""
+Volume aggregate services - incremental upkeep of the bonus volume tables.
+
+- agent_monthly_volume: each agent's own sales volume per calendar month.
+- downline_period_volume: each agent's whole-downline volume (own sales
+  included) per Monthly/Quarterly/Annual period key.
+
+Every path that records or cancels sales adjusts both tables in the same
+transaction, walking the seller's current upline from the hierarchy cache.
+Moving an agent shifts its subtree totals from the old ancestors to the new
+ones, so the rollup always matches the current tree. Bonus runs read one
+rollup row per agent instead of summing subtrees. The rebuild and the drift
+check first make sure the closure table they join agrees with
+Agent.parent_id, the same tree the cache is loaded from.
+"""
+import math
+from datetime import datetime, timezone
+from sqlalchemy import select, delete, func, extract, insert, case, literal, bindparam, DateTime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Sale, AgentClosure, AgentMonthlyVolume, BonusDirtyAgent, DownlinePeriodVolume
+from services.hierarchy_cache import get_hierarchy_cache
+from services.hierarchy_service import agent_closure_is_consistent, rebuild_agent_closure
+from services.bonus_service import get_sale_periods
+
+
+def add_sales_to_volume_aggregates(sales, db_session):
+    """Adds (agent_id, sale_date, policy_value) rows to the monthly and downline totals."""
+    apply_sale_volume_deltas(sales, 1, db_session)
+
+
+def remove_sales_from_volume_aggregates(sales, db_session):
+    """Subtracts cancelled (agent_id, sale_date, policy_value) rows from both aggregates."""
+    apply_sale_volume_deltas(sales, -1, db_session)
+
+
+def apply_sale_volume_deltas(sales, sign, db_session):
+    """
+    Folds the sales into one delta per (agent, year, month) and one per
+    (ancestor, period key), and upserts each set in a single executemany.
+    The caller owns the transaction.
+    """
+    hierarchy = get_hierarchy_cache(db_session)
+    monthly_deltas = {}
+    downline_deltas = {}
+    for agent_id, sale_date, policy_value in sales:
+        volume = sign * policy_value
+        _add_delta(monthly_deltas, (agent_id, sale_date.year, sale_date.month), volume, sign)
+
+        ancestor_ids = [agent_id] + hierarchy.upline_ids(agent_id)
+        for _, period_key, _, _, _ in get_sale_periods(sale_date):
+            for ancestor_id in ancestor_ids:
+                _add_delta(downline_deltas, (ancestor_id, period_key), volume, sign)
+
+    _upsert_deltas(
+        AgentMonthlyVolume,
+        ["agent_id", "year", "month"],
+        monthly_deltas,
+        db_session,
+    )
+    _upsert_deltas(
+        DownlinePeriodVolume,
+        ["ancestor_id", "period_key"],
+        downline_deltas,
+        db_session,
+    )
+    mark_bonus_agents_dirty(downline_deltas.keys(), db_session)
+
+
+def move_downline_volumes(agent_id, old_parent_id, new_parent_id, db_session):
+    """
+    Shifts an agent's subtree totals from ancestors it is leaving to ancestors
+    it is joining. Call before the hierarchy version is bumped for the move.
+    """
+    hierarchy = get_hierarchy_cache(db_session)
+
+    def ancestors(parent_id):
+        return set() if parent_id is None else {parent_id, *hierarchy.upline_ids(parent_id)}
+
+    old_ancestors = ancestors(old_parent_id)
+    new_ancestors = ancestors(new_parent_id)
+    subtree_rows = db_session.execute(
+        select(
+            DownlinePeriodVolume.period_key,
+            DownlinePeriodVolume.volume,
+            DownlinePeriodVolume.sale_count,
+        ).where(DownlinePeriodVolume.ancestor_id == agent_id)
+    ).all()
+
+    deltas = {}
+    for period_key, volume, sale_count in subtree_rows:
+        for ancestor_id in old_ancestors - new_ancestors:
+            deltas[(ancestor_id, period_key)] = (-volume, -sale_count)
+        for ancestor_id in new_ancestors - old_ancestors:
+            deltas[(ancestor_id, period_key)] = (volume, sale_count)
+
+    _upsert_deltas(
+        DownlinePeriodVolume, ["ancestor_id", "period_key"], deltas, db_session
+    )
+    mark_bonus_agents_dirty(deltas.keys(), db_session)
+
+
+def mark_bonus_agents_dirty(keys, db_session):
+    """
+    Marks (agent_id, period_key) pairs for recomputation by the next bonus run.
+    Re-marking moves marked_at forward, so a run that read the older mark
+    leaves the new one in place (see clear_dirty_bonus_agents).
+    """
+    if not keys:
+        return
+    marked_at = datetime.now(timezone.utc)
+    db_session.execute(
+        _upsert_dirty_marks(sqlite_insert(BonusDirtyAgent)),
+        [
+            {"agent_id": agent_id, "period_key": period_key, "marked_at": marked_at}
+            for agent_id, period_key in keys
+        ],
+    )
+
+
+def mark_agent_periods_dirty(agent_id, db_session):
+    """
+    Marks every period the agent has downline volume in (e.g. after a level
+    change alters its rate or volume basis) with one INSERT ... SELECT.
+    """
+    db_session.execute(
+        _upsert_dirty_marks(
+            sqlite_insert(BonusDirtyAgent).from_select(
+                ["agent_id", "period_key", "marked_at"],
+                select(
+                    DownlinePeriodVolume.ancestor_id,
+                    DownlinePeriodVolume.period_key,
+                    literal(datetime.now(timezone.utc), DateTime),
+                ).where(DownlinePeriodVolume.ancestor_id == agent_id),
+            )
+        )
+    )
+
+
+def _upsert_dirty_marks(stmt):
+    return stmt.on_conflict_do_update(
+        index_elements=["agent_id", "period_key"],
+        set_={"marked_at": stmt.excluded.marked_at},
+    )
+
+
+def get_dirty_bonus_agents(period_keys, db_session):
+    """Returns {period_key: {agent_id: marked_at}} of the agents marked in the given periods."""
+    stmt = select(
+        BonusDirtyAgent.period_key, BonusDirtyAgent.agent_id, BonusDirtyAgent.marked_at
+    ).where(BonusDirtyAgent.period_key.in_(period_keys))
+    dirty = {}
+    for period_key, agent_id, marked_at in db_session.execute(stmt):
+        dirty.setdefault(period_key, {})[agent_id] = marked_at
+    return dirty
+
+
+def clear_dirty_bonus_agents(marks, db_session):
+    """
+    Unmarks the {(agent_id, period_key): marked_at} marks a bonus run read.
+    A mark written or moved forward since the read (a sale or cancellation
+    that landed during the run) is newer than the read value and is kept
+    for the next run.
+    """
+    if not marks:
+        return
+    table = BonusDirtyAgent.__table__
+    db_session.execute(
+        table.delete().where(
+            table.c.agent_id == bindparam("b_agent_id"),
+            table.c.period_key == bindparam("b_period_key"),
+            table.c.marked_at <= bindparam("b_marked_at", type_=DateTime),
+        ),
+        [
+            {"b_agent_id": agent_id, "b_period_key": period_key, "b_marked_at": marked_at}
+            for (agent_id, period_key), marked_at in marks.items()
+        ],
+    )
+
+
+def _add_delta(deltas, key, volume, sale_count):
+    current_volume, current_count = deltas.get(key, (0.0, 0))
+    deltas[key] = (current_volume + volume, current_count + sale_count)
+
+
+def _upsert_deltas(model, key_columns, deltas, db_session):
+    """INSERT ... ON CONFLICT DO UPDATE adding (volume, sale_count) deltas to keyed rows."""
+    if not deltas:
+        return
+
+    stmt = sqlite_insert(model)
+    new_count = model.sale_count + stmt.excluded.sale_count
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={
+            "sale_count": new_count,
+            # Snap to exactly zero once no sales are left (no float residue)
+            "volume": case((new_count == 0, 0.0), else_=model.volume + stmt.excluded.volume),
+            "updated_at": datetime.now(timezone.utc),
+        },
+    )
+    db_session.execute(
+        stmt,
+        [
+            {
+                **dict(zip(key_columns, key)),
+                "volume": volume,
+                "sale_count": sale_count,
+            }
+            for key, (volume, sale_count) in deltas.items()
+        ],
+    )
+
+
+def rebuild_agent_monthly_volume(db_session):
+    """
+    Recomputes agent_monthly_volume from the non-cancelled sales with one
+    INSERT ... SELECT ... GROUP BY. Returns the number of rows written.
+    The caller owns the transaction.
+    """
+    sale_year = extract("year", Sale.sale_date)
+    sale_month = extract("month", Sale.sale_date)
+    db_session.execute(delete(AgentMonthlyVolume))
+    db_session.execute(
+        insert(AgentMonthlyVolume).from_select(
+            ["agent_id", "year", "month", "volume", "sale_count", "updated_at"],
+            select(
+                Sale.agent_id,
+                sale_year,
+                sale_month,
+                func.sum(Sale.policy_value),
+                func.count(Sale.id),
+                func.current_timestamp(),
+            )
+            .where(Sale.is_cancelled == False)
+            .group_by(Sale.agent_id, sale_year, sale_month),
+        )
+    )
+    return db_session.scalar(select(func.count()).select_from(AgentMonthlyVolume))
+
+
+def ensure_agent_closure(db_session):
+    """
+    The incremental paths walk the hierarchy cache, the rebuild and drift
+    check join the closure table; both must describe Agent.parent_id. If the
+    closure table has drifted, it is rebuilt, and the rebuild bumps the
+    hierarchy version, so every cache reloads from parent_id too.
+    Returns True if a rebuild was needed.
+    """
+    if agent_closure_is_consistent(db_session):
+        return False
+    rebuild_agent_closure(db_session)
+    return True
+
+
+def _period_key_expressions():
+    """SQL period keys of an agent_monthly_volume row, in get_sale_periods' formats."""
+    return [
+        # "2025-03", "2025-Q1", "2025"
+        func.printf("%d-%02d", AgentMonthlyVolume.year, AgentMonthlyVolume.month),
+        func.printf("%d-Q%d", AgentMonthlyVolume.year, (AgentMonthlyVolume.month + 2) // 3),
+        func.printf("%d", AgentMonthlyVolume.year),
+    ]
+
+
+def rebuild_downline_period_volume(db_session):
+    """
+    Recomputes downline_period_volume from agent_monthly_volume and the
+    closure table: one INSERT ... SELECT per period granularity, summing each
+    ancestor's descendants (itself included). Returns the number of rows written.
+    The caller owns the transaction.
+    """
+    ensure_agent_closure(db_session)
+    db_session.execute(delete(DownlinePeriodVolume))
+    for period_key in _period_key_expressions():
+        db_session.execute(
+            insert(DownlinePeriodVolume).from_select(
+                ["ancestor_id", "period_key", "volume", "sale_count", "updated_at"],
+                select(
+                    AgentClosure.ancestor_id,
+                    period_key,
+                    func.sum(AgentMonthlyVolume.volume),
+                    func.sum(AgentMonthlyVolume.sale_count),
+                    func.current_timestamp(),
+                )
+                .join(
+                    AgentMonthlyVolume,
+                    AgentMonthlyVolume.agent_id == AgentClosure.descendant_id,
+                )
+                .where(AgentMonthlyVolume.sale_count > 0)
+                .group_by(AgentClosure.ancestor_id, period_key),
+            )
+        )
+    # Rebuilt totals may differ from what past bonus runs saw
+    db_session.execute(
+        _upsert_dirty_marks(
+            sqlite_insert(BonusDirtyAgent).from_select(
+                ["agent_id", "period_key", "marked_at"],
+                select(
+                    DownlinePeriodVolume.ancestor_id,
+                    DownlinePeriodVolume.period_key,
+                    literal(datetime.now(timezone.utc), DateTime),
+                ).where(DownlinePeriodVolume.sale_count > 0),
+            )
+        )
+    )
+    return db_session.scalar(select(func.count()).select_from(DownlinePeriodVolume))
+
+
+def _totals_match(expected, actual):
+    """Compares {key: (sale_count, volume)} totals; volumes within float noise."""
+    keys = {key for key, (count, _) in expected.items() if count} | {
+        key for key, (count, _) in actual.items() if count
+    }
+    for key in keys:
+        expected_count, expected_volume = expected.get(key, (0, 0.0))
+        actual_count, actual_volume = actual.get(key, (0, 0.0))
+        if expected_count != actual_count or not math.isclose(
+            expected_volume or 0.0, actual_volume or 0.0, rel_tol=1e-9, abs_tol=0.01
+        ):
+            return False
+    return True
+
+
+def find_volume_aggregate_drift(db_session):
+    """
+    Compares the aggregates with what a rebuild would write, as per-period
+    sale counts and volume sums, so sales written around the hooks (direct
+    ORM or SQL inserts) are noticed. Returns the names of the tables that
+    drifted: "agent_monthly_volume", "downline_period_volume" or both.
+    """
+    drifted = []
+    sale_year = extract("year", Sale.sale_date)
+    sale_month = extract("month", Sale.sale_date)
+    expected_monthly = {
+        (year, month): (count, volume)
+        for year, month, count, volume in db_session.execute(
+            select(sale_year, sale_month, func.count(Sale.id), func.sum(Sale.policy_value))
+            .where(Sale.is_cancelled == False)
+            .group_by(sale_year, sale_month)
+        )
+    }
+    actual_monthly = {
+        (year, month): (count, volume)
+        for year, month, count, volume in db_session.execute(
+            select(
+                AgentMonthlyVolume.year,
+                AgentMonthlyVolume.month,
+                func.sum(AgentMonthlyVolume.sale_count),
+                func.sum(AgentMonthlyVolume.volume),
+            ).group_by(AgentMonthlyVolume.year, AgentMonthlyVolume.month)
+        )
+    }
+    if not _totals_match(expected_monthly, actual_monthly):
+        # The downline rollup is rebuilt from the monthly table, so both go
+        return ["agent_monthly_volume", "downline_period_volume"]
+
+    # Each monthly row counts once for every ancestor of its agent (itself included)
+    ensure_agent_closure(db_session)
+    expected_downline = {}
+    for period_key in _period_key_expressions():
+        for key, count, volume in db_session.execute(
+            select(
+                period_key,
+                func.sum(AgentMonthlyVolume.sale_count),
+                func.sum(AgentMonthlyVolume.volume),
+            )
+            .join(AgentClosure, AgentClosure.descendant_id == AgentMonthlyVolume.agent_id)
+            .where(AgentMonthlyVolume.sale_count > 0)
+            .group_by(period_key)
+        ):
+            expected_downline[key] = (count, volume)
+    actual_downline = {
+        key: (count, volume)
+        for key, count, volume in db_session.execute(
+            select(
+                DownlinePeriodVolume.period_key,
+                func.sum(DownlinePeriodVolume.sale_count),
+                func.sum(DownlinePeriodVolume.volume),
+            ).group_by(DownlinePeriodVolume.period_key)
+        )
+    }
+    if not _totals_match(expected_downline, actual_downline):
+        drifted.append("downline_period_volume")
+    return drifted
+
+
+def get_periods_downline_volumes(period_keys, db_session):
+    """Returns {period_key: {agent_id: downline volume}} for whole bonus periods (one query)."""
+    stmt = select(
+        DownlinePeriodVolume.period_key,
+        DownlinePeriodVolume.ancestor_id,
+        DownlinePeriodVolume.volume,
+    ).where(DownlinePeriodVolume.period_key.in_(period_keys))
+    volumes = {}
+    for period_key, agent_id, volume in db_session.execute(stmt):
+        volumes.setdefault(period_key, {})[agent_id] = volume
+    return volumes
+
+
+def get_downline_period_volumes(agent_ids, period_keys, db_session):
+    """Returns {(agent_id, period_key): downline volume} for the given agents and periods."""
+    stmt = select(
+        DownlinePeriodVolume.ancestor_id,
+        DownlinePeriodVolume.period_key,
+        DownlinePeriodVolume.volume,
+    ).where(
+        DownlinePeriodVolume.ancestor_id.in_(agent_ids),
+        DownlinePeriodVolume.period_key.in_(period_keys),
+    )
+    return {
+        (agent_id, period_key): volume
+        for agent_id, period_key, volume in db_session.execute(stmt)
+    }
@@ -1,3 +1,4 @@
+import pytest
 import json
 from models import Agent, db
 
@@ -44,3 +45,279 @@ def test_add_and_get_agents(client, db):
     assert data[0]["name"] == "Mike (Director)"
     assert len(data[0]["children"]) == 1  # Mike has one child
     assert data[0]["children"][0]["name"] == "Lisa (Manager)"
+
+
+def test_closure_table_follows_hierarchy_changes(client, db):
+    """
+    The closure table should answer upline/downline lookups correctly
+    after agents are added, reparented and deleted through the API.
+    """
+    from services import get_upline, get_downline_agent_ids
+
+    # === 1. ARRANGE: Director -> Manager A -> Team Lead -> Agent, plus Manager B ===
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+    mgr_a_id = client.post(
+        "/api/agents", json={"name": "MgrA", "level": 3, "parent_id": dir_id}
+    ).json["id"]
+    mgr_b_id = client.post(
+        "/api/agents", json={"name": "MgrB", "level": 3, "parent_id": dir_id}
+    ).json["id"]
+    tl_id = client.post(
+        "/api/agents", json={"name": "TL", "level": 2, "parent_id": mgr_a_id}
+    ).json["id"]
+    agent_id = client.post(
+        "/api/agents", json={"name": "Agent", "level": 1, "parent_id": tl_id}
+    ).json["id"]
+
+    assert [a.id for a in get_upline(agent_id, db.session)] == [tl_id, mgr_a_id, dir_id]
+    assert sorted(get_downline_agent_ids(mgr_a_id, db.session)) == sorted(
+        [mgr_a_id, tl_id, agent_id]
+    )
+
+    # === 2. ACT: Move the team lead (and its agent) under Manager B ===
+    response = client.put(f"/api/agents/{tl_id}", json={"parent_id": mgr_b_id})
+    assert response.status_code == 200
+
+    # === 3. ASSERT ===
+    assert [a.id for a in get_upline(agent_id, db.session)] == [tl_id, mgr_b_id, dir_id]
+    assert sorted(get_downline_agent_ids(mgr_a_id, db.session)) == [mgr_a_id]
+    assert sorted(get_downline_agent_ids(mgr_b_id, db.session)) == sorted(
+        [mgr_b_id, tl_id, agent_id]
+    )
+
+    # Deleting the leaf agent removes it from every ancestor's downline
+    assert client.delete(f"/api/agents/{agent_id}").status_code == 200
+    assert agent_id not in get_downline_agent_ids(dir_id, db.session)
+    assert get_upline(agent_id, db.session) == []
+
+
+@pytest.mark.parametrize("strategy", ["closure", "cte"])
+def test_hierarchy_lookups_run_in_one_query(client, db, sql_statements, strategy):
+    """Both SQL hierarchy strategies return the same chain/subtree in a single SELECT."""
+    from services import get_upline, get_downline_agent_ids, HierarchyNode
+
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+    mgr_id = client.post(
+        "/api/agents", json={"name": "Mgr", "level": 3, "parent_id": dir_id}
+    ).json["id"]
+    tl_ids = [
+        client.post(
+            "/api/agents", json={"name": f"TL{i}", "level": 2, "parent_id": mgr_id}
+        ).json["id"]
+        for i in range(3)
+    ]
+    agent_ids = [
+        client.post(
+            "/api/agents", json={"name": f"A{i}", "level": 1, "parent_id": tl_id}
+        ).json["id"]
+        for i, tl_id in enumerate(tl_ids)
+    ]
+
+    sql_statements.clear()
+    upline = get_upline(agent_ids[0], db.session, strategy=strategy)
+    upline_queries = len(sql_statements)
+    downline = get_downline_agent_ids(dir_id, db.session, strategy=strategy)
+
+    assert [a.id for a in upline] == [tl_ids[0], mgr_id, dir_id]
+    assert sorted(downline) == sorted([dir_id, mgr_id] + tl_ids + agent_ids)
+    assert upline_queries == 1
+    assert len(sql_statements) == 2
+    # Every strategy returns the same records as the in-memory cache
+    assert all(isinstance(node, HierarchyNode) for node in upline)
+    assert upline[0] == HierarchyNode(tl_ids[0], mgr_id, 2)
+    assert upline == get_upline(agent_ids[0], db.session, strategy="cache")
+
+
+def test_unknown_hierarchy_strategy_is_rejected(db):
+    from services import get_upline
+
+    with pytest.raises(ValueError):
+        get_upline(1, db.session, strategy="recursive-python")
+
+
+def test_hierarchy_cache_is_reused_until_version_bump(client, db):
+    """The cache is loaded once and only reloaded when the hierarchy version moves."""
+    from services import get_hierarchy_cache, get_hierarchy_version, bump_hierarchy_version
+
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+    mgr_id = client.post(
+        "/api/agents", json={"name": "Mgr", "level": 3, "parent_id": dir_id}
+    ).json["id"]
+    assert get_hierarchy_version(db.session) == 2  # One bump per agent route change
+
+    cache = get_hierarchy_cache(db.session)
+    assert cache.upline_ids(mgr_id) == [dir_id]
+    assert get_hierarchy_cache(db.session) is cache  # No reload without a change
+
+    # Simulate another worker changing the tree directly in the database
+    other_dir = Agent(name="Other Dir", level=4)
+    db.session.add(other_dir)
+    db.session.flush()
+    db.session.get(Agent, mgr_id).parent_id = other_dir.id
+    bump_hierarchy_version(db.session)
+    db.session.commit()
+
+    reloaded = get_hierarchy_cache(db.session)
+    assert reloaded is not cache
+    assert reloaded.upline_ids(mgr_id) == [other_dir.id]
+    assert reloaded.level[other_dir.id] == 4
+    assert sorted(reloaded.downline_ids(other_dir.id)) == sorted([other_dir.id, mgr_id])
+
+
+def test_get_agents_tree_uses_constant_queries(client, db, sql_statements):
+    """GET /api/agents builds the nested tree without per-node queries."""
+
+    def add_team(director_id, size):
+        mgr_id = client.post(
+            "/api/agents", json={"name": "Mgr", "level": 3, "parent_id": director_id}
+        ).json["id"]
+        for i in range(size):
+            client.post(
+                "/api/agents", json={"name": f"A{i}", "level": 1, "parent_id": mgr_id}
+            )
+        return mgr_id
+
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+    mgr_id = add_team(dir_id, 2)
+
+    sql_statements.clear()
+    response = client.get("/api/agents")
+    small_tree_queries = len(sql_statements)
+
+    assert response.status_code == 200
+    # Same JSON shape as the recursive ORM serialization
+    director = db.session.get(Agent, dir_id)
+    assert response.json == [director.to_dict(include_children=True)]
+    assert len(response.json[0]["children"][0]["children"]) == 2
+
+    # Grow the org tenfold: the query count must not change
+    for _ in range(5):
+        add_team(dir_id, 4)
+    sql_statements.clear()
+    response = client.get("/api/agents")
+    assert response.status_code == 200
+    assert len(response.json[0]["children"]) == 6
+    assert len(sql_statements) == small_tree_queries
+
+
+def test_get_agent_subtree_is_depth_limited_and_paginated(client, db):
+    """The subtree endpoint returns a bounded slice with child counts for lazy expansion."""
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+    mgr_ids = [
+        client.post(
+            "/api/agents", json={"name": f"Mgr{i}", "level": 3, "parent_id": dir_id}
+        ).json["id"]
+        for i in range(3)
+    ]
+    for mgr_id in mgr_ids:
+        for i in range(2):
+            client.post(
+                "/api/agents", json={"name": f"TL{i}", "level": 2, "parent_id": mgr_id}
+            )
+
+    # Depth 1: only the managers, each reporting its two team leads
+    response = client.get(f"/api/agents/{dir_id}/subtree?depth=1")
+    assert response.status_code == 200
+    assert response.json["agent"]["child_count"] == 3
+    assert [n["id"] for n in response.json["nodes"]] == mgr_ids
+    assert all(n["child_count"] == 2 and n["depth"] == 1 for n in response.json["nodes"])
+    assert response.json["next_cursor"] is None
+
+    # Depth 2 in pages of 4: managers first, then team leads
+    seen = []
+    cursor = None
+    while True:
+        url = f"/api/agents/{dir_id}/subtree?depth=2&limit=4"
+        if cursor:
+            url += f"&cursor={cursor}"
+        page = client.get(url).json
+        assert len(page["nodes"]) <= 4
+        seen.extend(page["nodes"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 9
+    assert [n["depth"] for n in seen] == [1] * 3 + [2] * 6
+    assert all(n["child_count"] == 0 for n in seen if n["depth"] == 2)
+
+
+def test_get_agent_subtree_validation(client, db):
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+
+    assert client.get("/api/agents/999/subtree").status_code == 404
+    assert client.get(f"/api/agents/{dir_id}/subtree?depth=0").status_code == 400
+    assert client.get(f"/api/agents/{dir_id}/subtree?limit=100000").status_code == 400
+    assert client.get(f"/api/agents/{dir_id}/subtree?cursor=abc").status_code == 400
+
+
+def test_check_closure_repairs_drift(app, client, db, sql_statements):
+    """Agents written around the closure hooks are indexed again by check-closure."""
+    from app import sync_agent_closure
+    from services import agent_closure_is_consistent, get_upline
+
+    # === 1. ARRANGE: a tree built through the API, plus out-of-band writes ===
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+    mgr_a_id = client.post("/api/agents", json={"name": "MgrA", "level": 3, "parent_id": dir_id}).json["id"]
+    mgr_b_id = client.post("/api/agents", json={"name": "MgrB", "level": 3, "parent_id": dir_id}).json["id"]
+    tl_id = client.post("/api/agents", json={"name": "TL", "level": 2, "parent_id": mgr_a_id}).json["id"]
+    assert agent_closure_is_consistent(db.session)
+
+    orphan = Agent(name="Imported", level=1, parent_id=tl_id)  # No closure rows
+    db.session.add(orphan)
+    db.session.get(Agent, tl_id).parent_id = mgr_b_id  # Moved without the closure update
+    db.session.commit()
+    assert not agent_closure_is_consistent(db.session)
+
+    # === 2. ACT ===
+    sql_statements.clear()
+    sync_agent_closure(app)
+    startup_statements = list(sql_statements)
+    check = app.test_cli_runner().invoke(args=["check-closure"])
+    repair = app.test_cli_runner().invoke(args=["check-closure", "--repair"])
+
+    # === 3. ASSERT ===
+    # Startup only probes for an empty table
+    assert len(startup_statements) == 2
+    assert check.exit_code == 1
+    assert repair.exit_code == 0, repair.output
+    assert agent_closure_is_consistent(db.session)
+    assert [a.id for a in get_upline(orphan.id, db.session, strategy="closure")] == [tl_id, mgr_b_id, dir_id]
+
+
+def test_rejected_update_does_not_leak_into_the_hierarchy_cache(client, db):
+    """A rejected level/parent change never reaches the process-wide tree."""
+    from models import Commission
+    from services import clear_hierarchy_cache, get_hierarchy_cache
+
+    # === 1. ARRANGE: D(4) -> T(2) -> A(1), plus O(3), with a cold cache ===
+    d_id = client.post("/api/agents", json={"name": "D", "level": 4}).json["id"]
+    t_id = client.post("/api/agents", json={"name": "T", "level": 2, "parent_id": d_id}).json["id"]
+    a_id = client.post("/api/agents", json={"name": "A", "level": 1, "parent_id": t_id}).json["id"]
+    o_id = client.post("/api/agents", json={"name": "O", "level": 3}).json["id"]
+    clear_hierarchy_cache()
+
+    # === 2. ACT: O is not above level 3, so the update is rejected ===
+    response = client.put(f"/api/agents/{t_id}", json={"level": 3, "parent_id": o_id})
+    sale = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-LEAK-1", "policy_value": 100000, "agent_id": a_id},
+    )
+
+    # === 3. ASSERT ===
+    assert response.status_code == 400
+    assert get_hierarchy_cache(db.session).level[t_id] == 2
+    override = (
+        db.session.query(Commission)
+        .filter_by(sale_id=sale.json["sale_id"], agent_id=t_id)
+        .one()
+    )
+    assert override.amount == pytest.approx(2000)
+
+    # --- Flushed but rolled-back agent writes are not cached either, even
+    # when the version was never bumped and the cache starts cold
+    clear_hierarchy_cache()
+    db.session.get(Agent, t_id).level = 3
+    assert get_hierarchy_cache(db.session).level[t_id] == 3  # Visible to this transaction
+    db.session.rollback()
+    assert get_hierarchy_cache(db.session).level[t_id] == 2
@@ -1,7 +1,41 @@
 import pytest
 import json
+import random
+from sqlalchemy import text, update
 from datetime import datetime, timezone
-from models import PerformanceTier, Bonus, Sale, Agent
+from models import (
+    PerformanceTier,
+    Bonus,
+    Sale,
+    Agent,
+    AgentMonthlyVolume,
+    BonusDirtyAgent,
+    BonusRun,
+    Clawback,
+    DownlinePeriodVolume,
+)
+from services import (
+    get_downline_agent_ids,
+    get_monthly_sales_volume,
+    get_quarterly_sales_volume,
+    get_annual_sales_volume,
+    get_bonus_rate_for_volume,
+    get_bonus_rates_for_volumes,
+    get_period_months,
+    get_personal_volumes,
+    rollup_downline_volumes,
+    get_hierarchy_cache,
+    get_tier_table,
+    compute_period_bonuses,
+    merge_duplicate_bonuses,
+    get_year_periods,
+    partition_subtrees,
+    calculate_bonuses_for_periods,
+    mark_bonus_agents_dirty,
+    bump_tier_version,
+    get_bonus_process_pool,
+)
+from services.hierarchy_cache import HierarchyCache
 
 
 def test_calculate_monthly_bonus_for_agent(client, db):  # Use client and db_session
@@ -169,19 +203,12 @@ def test_calculate_quarterly_bonus_for_manager(client, db):
             "sale_date": datetime(2026, 3, 10, tzinfo=timezone.utc),
         },
     ]
-    for payload in q1_sales:
-        # Need to override sale_date when posting via API, or mock datetime
-        # For simplicity, let's assume the API will be updated to accept sale_date
-        # OR we update the test later to mock dates correctly.
-        # For now, we'll manually create Sale objects.
-        sale = Sale(
-            policy_number=payload["policy_number"],
-            policy_value=payload["policy_value"],
-            agent_id=payload["agent_id"],
-            sale_date=payload["sale_date"],
-        )
-        db.session.add(sale)
-    db.session.commit()  # Commit sales for calculation
+    # Backdated sales go through the batch API so the volume aggregate sees them
+    batch_resp = client.post(
+        "/api/sales/batch",
+        json=[{**payload, "sale_date": payload["sale_date"].isoformat()} for payload in q1_sales],
+    )
+    assert batch_resp.status_code == 201
 
     # --- ACT ---
     # Trigger quarterly calculation for Q1 2026
@@ -236,15 +263,11 @@ def test_calculate_annual_bonus_for_director(client, db):
             "sale_date": datetime(2027, 9, 20, tzinfo=timezone.utc),
         },
     ]
-    for payload in year_sales:
-        sale = Sale(
-            policy_number=payload["policy_number"],
-            policy_value=payload["policy_value"],
-            agent_id=payload["agent_id"],
-            sale_date=payload["sale_date"],
-        )
-        db.session.add(sale)
-    db.session.commit()
+    batch_resp = client.post(
+        "/api/sales/batch",
+        json=[{**payload, "sale_date": payload["sale_date"].isoformat()} for payload in year_sales],
+    )
+    assert batch_resp.status_code == 201
 
     # --- ACT ---
     # Trigger annual calculation for 2027
@@ -266,3 +289,816 @@ def test_calculate_annual_bonus_for_director(client, db):
     assert dir_bonus is not None
     # Expected: $4M volume -> Level 4 Gold Tier (7%) -> Bonus = $4M * 7% = $280,000
     assert dir_bonus.amount == pytest.approx(280000.00)
+
+
+def test_bonus_run_matches_per_agent_queries_in_constant_queries(client, db, sql_statements):
+    """The single-pass engine pays what per-agent downline queries would, in O(1) queries."""
+    # --- ARRANGE ---
+    # Two directors, each with managers, team leads and agents selling this month
+    now = datetime.now(timezone.utc)
+    period_str = f"{now.year}-{now.month:02d}"
+    policy_counter = iter(range(1000))
+
+    def add_agent(name, level, parent_id=None):
+        return client.post(
+            "/api/agents", json={"name": name, "level": level, "parent_id": parent_id}
+        ).json["id"]
+
+    def add_org(director_name, managers):
+        dir_id = add_agent(director_name, 4)
+        for m in range(managers):
+            mgr_id = add_agent(f"{director_name}-M{m}", 3, dir_id)
+            tl_id = add_agent(f"{director_name}-TL{m}", 2, mgr_id)
+            for a in range(3):
+                agent_id = add_agent(f"{director_name}-A{m}{a}", 1, tl_id)
+                client.post(
+                    "/api/sales/batch",
+                    json=[
+                        {
+                            "policy_number": f"POL-ENGINE-{next(policy_counter)}",
+                            "policy_value": 20000 * (a + 1) + 5000 * m,
+                            "agent_id": agent_id,
+                        }
+                        for _ in range(a + 1)
+                    ],
+                )
+        return dir_id
+
+    def recalculate():
+        # Second full run of the period, so every bonus takes the update path
+        payload = {"period": period_str, "type": "Monthly", "full": True}
+        client.post("/api/bonuses/calculate", json=payload)
+        sql_statements.clear()
+        return client.post("/api/bonuses/calculate", json=payload)
+
+    add_org("D1", 1)
+    response = recalculate()
+    small_org_queries = len(sql_statements)
+    assert response.status_code == 200
+
+    add_org("D2", 4)
+
+    # --- ACT ---
+    response = recalculate()
+
+    # --- ASSERT ---
+    assert response.status_code == 200
+    assert len(sql_statements) == small_org_queries
+
+    # Reference: the per-agent downline/volume/tier queries the engine replaced
+    expected = {}
+    for agent in db.session.query(Agent).all():
+        agent_ids = [agent.id] if agent.level == 1 else get_downline_agent_ids(agent.id, db.session)
+        volume = get_monthly_sales_volume(agent_ids, now.year, now.month, db.session)
+        rate = get_bonus_rate_for_volume(agent.level, volume, db.session) if volume > 0 else 0
+        if rate > 0:
+            expected[agent.id] = volume * rate
+
+    bonuses = db.session.query(Bonus).filter_by(period=period_str, bonus_type="Monthly").all()
+    assert {b.agent_id: b.amount for b in bonuses} == pytest.approx(expected)
+    assert len(expected) > 10
+
+
+def test_vectorized_engine_matches_python_engine(db):
+    """The NumPy engine produces the same bonuses as the pure-Python rollup."""
+    pytest.importorskip("numpy")
+    # --- ARRANGE ---
+    # Random multi-root org; every level sells, and some volumes sit exactly on tier edges
+    rng = random.Random(7)
+    rows, parents, next_id = [], [None], 1
+    for level, size in [(4, 3), (3, 12), (2, 40), (1, 250)]:
+        layer = list(range(next_id, next_id + size))
+        rows.extend((agent_id, rng.choice(parents), level) for agent_id in layer)
+        parents, next_id = layer, next_id + size
+    hierarchy = HierarchyCache(0, rows)
+    tier_table = get_tier_table(db.session)
+    tier_edges = [edge for min_volumes, _, _ in tier_table.levels.values() for edge in min_volumes]
+    personal_volumes = {
+        agent_id: rng.choice(tier_edges + [rng.uniform(0, 200000)])
+        for agent_id, _, _ in rows
+        if rng.random() < 0.8
+    }
+
+    # --- ACT ---
+    python_bonuses = compute_period_bonuses(
+        hierarchy, personal_volumes, tier_table, engine="python"
+    )
+    numpy_bonuses = compute_period_bonuses(
+        hierarchy, personal_volumes, tier_table, engine="numpy"
+    )
+
+    # --- ASSERT ---
+    assert len(python_bonuses) > 100
+    assert numpy_bonuses.keys() == python_bonuses.keys()
+    for agent_id, (volume, amount) in python_bonuses.items():
+        assert numpy_bonuses[agent_id] == pytest.approx((volume, amount))
+
+
+def test_monthly_volume_aggregate_tracks_sales_and_cancellations(app, client, db):
+    """Every write path keeps agent_monthly_volume equal to a rebuild from Sale."""
+    # --- ARRANGE ---
+    tl_id = client.post("/api/agents", json={"name": "TL", "level": 2}).json["id"]
+    agent_id = client.post(
+        "/api/agents", json={"name": "Agent", "level": 1, "parent_id": tl_id}
+    ).json["id"]
+
+    def aggregate_rows():
+        return sorted(
+            (row.agent_id, row.year, row.month, round(row.volume, 6), row.sale_count)
+            for row in db.session.query(AgentMonthlyVolume).all()
+        )
+
+    # --- ACT ---
+    single_id = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-AGG-1", "policy_value": 30000, "agent_id": agent_id},
+    ).json["sale_id"]
+    batch_resp = client.post(
+        "/api/sales/batch",
+        json=[
+            {"policy_number": "POL-AGG-2", "policy_value": 10000, "agent_id": agent_id, "sale_date": "2025-03-05"},
+            {"policy_number": "POL-AGG-3", "policy_value": 2500.25, "agent_id": agent_id, "sale_date": "2025-03-20"},
+            {"policy_number": "POL-AGG-4", "policy_value": 7000, "agent_id": tl_id, "sale_date": "2025-04-01"},
+        ],
+    )
+    april_sale = db.session.query(Sale).filter_by(policy_number="POL-AGG-4").one()
+    client.put(f"/api/sales/{single_id}/cancel")
+    client.put("/api/sales/cancel", json={"sale_ids": [april_sale.id]})
+
+    # --- ASSERT ---
+    assert batch_resp.status_code == 201
+    now = datetime.now(timezone.utc)
+    assert aggregate_rows() == sorted(
+        [
+            (agent_id, 2025, 3, 12500.25, 2),
+            (tl_id, 2025, 4, 0.0, 0),  # Emptied months snap back to exactly zero
+            (agent_id, now.year, now.month, 0.0, 0),
+        ]
+    )
+    assert get_quarterly_sales_volume([agent_id, tl_id], 2025, 1, db.session) == pytest.approx(12500.25)
+    assert get_annual_sales_volume([agent_id, tl_id], 2025, db.session) == pytest.approx(12500.25)
+
+    # The rebuild command reproduces the live aggregate (minus emptied months)
+    live_rows = [row for row in aggregate_rows() if row[4] > 0]
+    result = app.test_cli_runner().invoke(args=["rebuild-volumes"])
+    assert result.exit_code == 0, result.output
+    assert "Rebuilt 1 agent monthly volume rows." in result.output
+    assert aggregate_rows() == live_rows
+
+
+def test_downline_rollup_follows_sales_cancellations_and_moves(app, client, db):
+    """downline_period_volume always equals the current tree's subtree sums."""
+    # --- ARRANGE ---
+    def add_agent(name, level, parent_id=None):
+        return client.post(
+            "/api/agents", json={"name": name, "level": level, "parent_id": parent_id}
+        ).json["id"]
+
+    d1 = add_agent("D1", 4)
+    m1 = add_agent("M1", 3, d1)
+    tl1 = add_agent("TL1", 2, m1)
+    a1 = add_agent("A1", 1, tl1)
+    a2 = add_agent("A2", 1, tl1)
+    d2 = add_agent("D2", 4)
+    m2 = add_agent("M2", 3, d2)
+    tl2 = add_agent("TL2", 2, m2)
+    a3 = add_agent("A3", 1, tl2)
+
+    sales = [
+        (a1, 10000, "2025-01-10"),
+        (a1, 20000, "2025-02-10"),
+        (a2, 30000, "2025-02-20"),
+        (a2, 5000, "2025-05-01"),
+        (tl1, 7000, "2025-03-15"),
+        (a3, 40000, "2025-01-05"),
+    ]
+    client.post(
+        "/api/sales/batch",
+        json=[
+            {"policy_number": f"POL-ROLL-{i}", "policy_value": value, "agent_id": agent_id, "sale_date": date}
+            for i, (agent_id, value, date) in enumerate(sales)
+        ],
+    )
+    cancelled = db.session.query(Sale).filter_by(policy_number="POL-ROLL-1").one()
+
+    # --- ACT ---
+    client.put("/api/sales/cancel", json={"sale_ids": [cancelled.id]})
+    move_resp = client.put(f"/api/agents/{tl1}", json={"parent_id": m2})
+
+    # --- ASSERT ---
+    assert move_resp.status_code == 200
+
+    def rollup_rows():
+        return {
+            (row.ancestor_id, row.period_key): round(row.volume, 6)
+            for row in db.session.query(DownlinePeriodVolume).all()
+            if row.sale_count > 0
+        }
+
+    hierarchy = get_hierarchy_cache(db.session)
+    expected = {}
+    for bonus_type, period_key, month, quarter in [
+        ("Monthly", "2025-01", 1, None),
+        ("Monthly", "2025-02", 2, None),
+        ("Monthly", "2025-03", 3, None),
+        ("Monthly", "2025-05", 5, None),
+        ("Quarterly", "2025-Q1", None, 1),
+        ("Quarterly", "2025-Q2", None, 2),
+        ("Annual", "2025", None, None),
+    ]:
+        first_month, last_month = get_period_months(bonus_type, month, quarter)
+        personal = get_personal_volumes(2025, first_month, last_month, db.session)
+        for agent_id, volume in rollup_downline_volumes(hierarchy, personal).items():
+            if volume > 0:
+                expected[(agent_id, period_key)] = round(volume, 6)
+
+    assert rollup_rows() == expected
+    # TL1's team moved from M1/D1 to M2/D2 with it
+    assert (m1, "2025") not in expected
+    assert expected[(d2, "2025")] == 40000 + 10000 + 30000 + 5000 + 7000
+    assert expected[(tl1, "2025-Q1")] == 10000 + 30000 + 7000
+
+    result = app.test_cli_runner().invoke(args=["rebuild-volumes"])
+    assert result.exit_code == 0, result.output
+    assert rollup_rows() == expected
+
+
+def test_tier_cache_rates_without_queries_and_reloads_on_change(db, sql_statements):
+    """Tier lookups bisect the cached table; ORM writes to tiers invalidate it."""
+    # --- ARRANGE ---
+    pairs = [
+        (1, 0),  # Bronze lower edge
+        (1, 24999.99),
+        (1, 25000),  # Silver lower edge
+        (1, 100000),  # Platinum (open-ended)
+        (3, 1500000),
+        (4, 5000000),
+        (2, -1),  # Below every tier
+        (9, 50000),  # Unknown level
+    ]
+    get_tier_table(db.session)  # Warm the cache
+
+    # --- ACT ---
+    sql_statements.clear()
+    single_rates = [get_bonus_rate_for_volume(level, volume, db.session) for level, volume in pairs]
+    batch_rates = get_bonus_rates_for_volumes(pairs, db.session)
+
+    # --- ASSERT ---
+    # Each lookup only checks the tier version; the tier rows are not re-read
+    assert sql_statements and all("performance_tier" not in s for s in sql_statements)
+    assert single_rates == batch_rates == [0.0, 0.0, 0.02, 0.05, 0.06, 0.10, 0.0, 0.0]
+
+    # Raising the Level 1 Silver rate bumps the version; the next lookup sees it
+    silver = db.session.query(PerformanceTier).filter_by(agent_level=1, tier_name="SILVER").one()
+    silver.bonus_rate = 0.025
+    db.session.commit()
+    assert get_bonus_rate_for_volume(1, 30000, db.session) == 0.025
+
+
+def test_tier_cache_follows_the_committed_tier_version(db):
+    """Changes committed elsewhere are picked up; rolled-back ones never reach the cache."""
+    # --- ARRANGE ---
+    silver = db.session.query(PerformanceTier).filter_by(agent_level=1, tier_name="SILVER").one()
+    get_tier_table(db.session)  # Warm the cache
+    db.session.commit()
+
+    # --- ACT / ASSERT ---
+    # Another worker's write: no mapper event fires here, only the version moves
+    db.session.execute(
+        update(PerformanceTier).where(PerformanceTier.id == silver.id).values(bonus_rate=0.021)
+    )
+    bump_tier_version(db.session.connection())
+    db.session.commit()
+    assert get_bonus_rate_for_volume(1, 30000, db.session) == 0.021
+
+    # A flushed but rolled-back change is visible only inside its transaction
+    silver = db.session.get(PerformanceTier, silver.id)
+    silver.bonus_rate = 0.5
+    db.session.flush()
+    assert get_bonus_rate_for_volume(1, 30000, db.session) == 0.5
+    db.session.rollback()
+
+    # The next committed change reuses the rolled-back version number
+    gold = db.session.query(PerformanceTier).filter_by(agent_level=1, tier_name="GOLD").one()
+    gold.bonus_rate = 0.031
+    db.session.commit()
+    assert get_bonus_rate_for_volume(1, 30000, db.session) == 0.021
+    assert get_bonus_rate_for_volume(1, 60000, db.session) == 0.031
+
+
+def test_bonus_run_upserts_in_one_statement_and_counts_from_it(client, db, sql_statements):
+    """Results are written with one INSERT ... ON CONFLICT; counts come back from it."""
+    # --- ARRANGE ---
+    tl_id = client.post("/api/agents", json={"name": "TL", "level": 2}).json["id"]
+    agent_ids = [
+        client.post(
+            "/api/agents", json={"name": f"A{i}", "level": 1, "parent_id": tl_id}
+        ).json["id"]
+        for i in range(3)
+    ]
+    client.post(
+        "/api/sales/batch",
+        json=[
+            {"policy_number": f"POL-UPSERT-{i}", "policy_value": 60000, "agent_id": agent_id}
+            for i, agent_id in enumerate(agent_ids)
+        ],
+    )
+    now = datetime.now(timezone.utc)
+    payload = {"period": f"{now.year}-{now.month:02d}", "type": "Monthly"}
+
+    # --- ACT ---
+    sql_statements.clear()
+    first = client.post("/api/bonuses/calculate", json=payload)
+    writes = [
+        s for s in sql_statements if s.lstrip().upper().startswith(("INSERT INTO BONUS ", "UPDATE BONUS "))
+    ]
+    second = client.post("/api/bonuses/calculate", json={**payload, "full": True})
+
+    # --- ASSERT ---
+    # 3 agents at 60k (Gold) + the team lead at 180k (Silver)
+    assert first.json["message"].endswith("Created: 4, Updated: 0")
+    assert second.json["message"].endswith("Created: 0, Updated: 4")
+    assert len(writes) == 1
+    assert "ON CONFLICT" in writes[0].upper()
+    assert db.session.query(Bonus).count() == 4
+
+
+def test_merge_duplicate_bonuses_keeps_lowest_id_and_repoints_clawbacks(db):
+    """Startup cleanup for rows written before the unique index existed."""
+    # --- ARRANGE ---
+    agent = Agent(name="Dup", level=1)
+    db.session.add(agent)
+    db.session.flush()
+    sale = Sale(policy_number="POL-DUP", policy_value=1000, agent_id=agent.id)
+    db.session.add(sale)
+    db.session.commit()
+    db.session.execute(text("DROP INDEX uq_bonus_agent_period_type"))
+    bonuses = [
+        Bonus(amount=amount, bonus_type="Monthly", period="2025-01", agent_id=agent.id)
+        for amount in (100.0, 90.0, 80.0)
+    ] + [Bonus(amount=50.0, bonus_type="Annual", period="2025", agent_id=agent.id)]
+    db.session.add_all(bonuses)
+    db.session.flush()
+    db.session.add(Clawback(amount=-10.0, original_bonus_id=bonuses[2].id, sale_id=sale.id))
+    db.session.commit()
+
+    # --- ACT ---
+    removed = merge_duplicate_bonuses(db.session)
+    db.session.commit()
+    db.session.execute(
+        text(
+            "CREATE UNIQUE INDEX uq_bonus_agent_period_type "
+            "ON bonus (agent_id, period, bonus_type)"
+        )
+    )
+
+    # --- ASSERT ---
+    assert removed == 2
+    remaining = db.session.query(Bonus).order_by(Bonus.id).all()
+    assert [b.id for b in remaining] == [bonuses[0].id, bonuses[3].id]
+    assert db.session.query(Clawback).one().original_bonus_id == bonuses[0].id
+
+
+def test_year_close_calculates_every_period_from_one_volume_read(client, db, sql_statements):
+    """{"year": ...} pays what 17 single-period calls would, reading volumes once."""
+    # --- ARRANGE ---
+    mgr_id = client.post("/api/agents", json={"name": "Mgr", "level": 3}).json["id"]
+    tl_id = client.post("/api/agents", json={"name": "TL", "level": 2, "parent_id": mgr_id}).json["id"]
+    agent_ids = [
+        client.post("/api/agents", json={"name": f"A{i}", "level": 1, "parent_id": tl_id}).json["id"]
+        for i in range(3)
+    ]
+    rng = random.Random(20)
+    client.post(
+        "/api/sales/batch",
+        json=[
+            {
+                "policy_number": f"POL-YEAR-{i}",
+                "policy_value": rng.choice([8000, 30000, 60000]),
+                "agent_id": rng.choice(agent_ids + [tl_id]),
+                "sale_date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            }
+            for i in range(40)
+        ],
+    )
+
+    # --- ACT ---
+    sql_statements.clear()
+    year_resp = client.post("/api/bonuses/calculate", json={"year": 2025})
+    volume_reads = [
+        s for s in sql_statements if "FROM agent_monthly_volume" in s or "FROM downline_period_volume" in s
+    ]
+    year_bonuses = {
+        (b.agent_id, b.period, b.bonus_type): b.amount for b in db.session.query(Bonus).all()
+    }
+    db.session.query(Bonus).delete()
+    db.session.commit()
+
+    single_results = []
+    for period in [
+        *({"period": f"2025-{m:02d}", "type": "Monthly"} for m in range(1, 13)),
+        *({"period": f"2025-Q{q}", "type": "Quarterly"} for q in range(1, 5)),
+        {"period": "2025", "type": "Annual"},
+    ]:
+        single_results.append(client.post("/api/bonuses/calculate", json={**period, "full": True}))
+    single_bonuses = {
+        (b.agent_id, b.period, b.bonus_type): b.amount for b in db.session.query(Bonus).all()
+    }
+
+    # --- ASSERT ---
+    assert year_resp.status_code == 200
+    assert all(resp.status_code == 200 for resp in single_results)
+    results = year_resp.json["results"]
+    assert len(results) == 17
+    assert [r["type"] for r in results] == ["Monthly"] * 12 + ["Quarterly"] * 4 + ["Annual"]
+    assert sum(r["created"] for r in results) == len(year_bonuses) > 0
+    assert year_bonuses == pytest.approx(single_bonuses)
+    # One monthly bucket read and one downline rollup read for the whole year
+    assert len(volume_reads) == 2
+
+
+def test_calculate_periods_list_validates_and_dedupes(client, db):
+    """Explicit period lists are canonicalised, deduplicated and validated up front."""
+    # --- ACT ---
+    ok = client.post(
+        "/api/bonuses/calculate",
+        json={
+            "periods": [
+                {"period": "2025-3", "type": "Monthly"},
+                {"period": "2025-03", "type": "Monthly"},
+                {"period": "2025-Q1", "type": "Quarterly"},
+            ]
+        },
+    )
+    bad_period = client.post(
+        "/api/bonuses/calculate",
+        json={"periods": [{"period": "2025-Q1", "type": "Quarterly"}, {"period": "2025-13", "type": "Monthly"}]},
+    )
+    bad_types = client.post("/api/bonuses/calculate", json={"year": 2025, "types": ["Weekly"]})
+    bad_year = client.post("/api/bonuses/calculate", json={"year": "2025"})
+
+    # --- ASSERT ---
+    assert ok.status_code == 200
+    assert [(r["period"], r["type"]) for r in ok.json["results"]] == [
+        ("2025-03", "Monthly"),
+        ("2025-Q1", "Quarterly"),
+    ]
+    assert bad_period.status_code == 400
+    assert bad_types.status_code == 400
+    assert bad_year.status_code == 400
+
+
+@pytest.mark.parametrize("engine", ["python", "auto"])
+@pytest.mark.parametrize("volume_source", ["rollup", "tree"])
+def test_parallel_bonus_run_matches_serial_exactly(client, db, engine, volume_source):
+    """Subtrees computed in a process pool give bit-for-bit the serial results."""
+    # --- ARRANGE ---
+    rng = random.Random(21)
+    agent_ids = []
+    for d in range(5):
+        parents = [client.post("/api/agents", json={"name": f"D{d}", "level": 4}).json["id"]]
+        for level in (3, 2, 1):
+            layer = [
+                client.post(
+                    "/api/agents",
+                    json={"name": f"D{d}-L{level}-{i}", "level": level, "parent_id": rng.choice(parents)},
+                ).json["id"]
+                for i in range(rng.randint(1, 4) * (4 - level))
+            ]
+            agent_ids.extend(layer)
+            parents = layer
+    client.post(
+        "/api/sales/batch",
+        json=[
+            {
+                "policy_number": f"POL-PAR-{i}",
+                "policy_value": round(rng.uniform(1000, 90000), 2),
+                "agent_id": rng.choice(agent_ids),
+                "sale_date": f"2025-{rng.randint(1, 12):02d}-15",
+            }
+            for i in range(150)
+        ],
+    )
+    hierarchy = get_hierarchy_cache(db.session)
+    periods = get_year_periods(2025)
+
+    def run(workers):
+        calculate_bonuses_for_periods(
+            periods, db.session, engine=engine, volume_source=volume_source, workers=workers
+        )
+        bonuses = {
+            (b.agent_id, b.period, b.bonus_type): b.amount
+            for b in db.session.query(Bonus).all()
+        }
+        db.session.rollback()
+        return bonuses
+
+    # --- ACT ---
+    serial = run(1)
+    parallel = run(3)
+    pool = get_bonus_process_pool(3)
+    parallel_again = run(3)
+    partitions = partition_subtrees(hierarchy, 3)
+
+    # --- ASSERT ---
+    assert len(serial) > 20
+    assert parallel == parallel_again == serial
+    # One long-lived pool, never forked from this (multi-threaded) process
+    assert get_bonus_process_pool(3) is pool
+    assert pool._mp_context.get_start_method() != "fork"
+    # Whole subtrees per partition, every agent exactly once
+    assert len(partitions) == 3
+    assert sorted(a for rows in partitions for a, _, _ in rows) == sorted(hierarchy.parent)
+    for rows in partitions:
+        ids = {a for a, _, _ in rows}
+        assert all(parent_id is None or parent_id in ids for _, parent_id, _ in rows)
+
+
+def test_dry_run_previews_the_run_without_writing(client, db, sql_statements):
+    """?dry_run=true reports what the next run would save and leaves the bonus table alone."""
+    # --- ARRANGE ---
+    tl_id = client.post("/api/agents", json={"name": "TL", "level": 2}).json["id"]
+    a1 = client.post("/api/agents", json={"name": "A1", "level": 1, "parent_id": tl_id}).json["id"]
+    a2 = client.post("/api/agents", json={"name": "A2", "level": 1, "parent_id": tl_id}).json["id"]
+
+    def sell(policy_number, value, agent_id):
+        client.post(
+            "/api/sales/batch",
+            json=[{"policy_number": policy_number, "policy_value": value, "agent_id": agent_id, "sale_date": "2025-05-10"}],
+        )
+
+    sell("POL-DRY-1", 30000, a1)  # Silver, 2%
+    payload = {"period": "2025-05", "type": "Monthly"}
+    client.post("/api/bonuses/calculate", json=payload)
+    sell("POL-DRY-2", 30000, a1)  # A1 moves up to Gold, 3%
+    sell("POL-DRY-3", 60000, a2)  # A2 earns for the first time
+    saved_before = {b.agent_id: b.amount for b in db.session.query(Bonus).all()}
+
+    # --- ACT ---
+    sql_statements.clear()
+    preview = client.post("/api/bonuses/calculate?dry_run=true", json=payload)
+    writes = [s for s in sql_statements if s.lstrip().upper().startswith(("INSERT", "UPDATE", "DELETE"))]
+    saved_after_preview = {b.agent_id: b.amount for b in db.session.query(Bonus).all()}
+    client.post("/api/bonuses/calculate", json=payload)
+    saved_after_run = {b.agent_id: b.amount for b in db.session.query(Bonus).all()}
+
+    # --- ASSERT ---
+    assert preview.status_code == 200
+    assert preview.json["dry_run"] is True
+    assert writes == []
+    assert saved_after_preview == saved_before
+    (result,) = preview.json["results"]
+    assert (result["period"], result["type"], result["created"], result["updated"]) == ("2025-05", "Monthly", 2, 1)
+    rows = {row["agent_id"]: row for row in result["bonuses"]}
+    assert rows[a1]["tier"] == "GOLD"
+    assert rows[a1]["rate"] == 0.03
+    assert rows[a1]["volume"] == pytest.approx(60000)
+    assert rows[a1]["current_amount"] == pytest.approx(600)
+    assert rows[a1]["delta"] == pytest.approx(1800 - 600)
+    assert rows[a2]["current_amount"] is None
+    assert rows[a2]["delta"] == pytest.approx(rows[a2]["amount"])
+    # The preview is exactly what the real run then saved
+    assert {agent_id: row["amount"] for agent_id, row in rows.items()} == saved_after_run
+
+
+def test_rerun_recomputes_only_agents_touched_since_the_last_run(client, db):
+    """Sales, cancellations and level changes mark agents dirty; re-runs skip the rest."""
+    # --- ARRANGE ---
+    def add_agent(name, level, parent_id=None):
+        return client.post(
+            "/api/agents", json={"name": name, "level": level, "parent_id": parent_id}
+        ).json["id"]
+
+    mgr_id = add_agent("Mgr", 3)
+    tl1_id = add_agent("TL1", 2, mgr_id)
+    tl2_id = add_agent("TL2", 2, mgr_id)
+    a1, a2 = add_agent("A1", 1, tl1_id), add_agent("A2", 1, tl1_id)
+    a3 = add_agent("A3", 1, tl2_id)
+    agent_count = 6
+
+    def sell(policy_number, value, agent_id):
+        client.post(
+            "/api/sales/batch",
+            json=[{"policy_number": policy_number, "policy_value": value, "agent_id": agent_id, "sale_date": "2025-05-10"}],
+        )
+        return db.session.query(Sale).filter_by(policy_number=policy_number).one().id
+
+    for i, agent_id in enumerate([a1, a2, a3, a3]):
+        sell(f"POL-DIRTY-{i}", 60000, agent_id)
+    payload = {"period": "2025-05", "type": "Monthly"}
+
+    def run():
+        response = client.post("/api/bonuses/calculate", json=payload)
+        assert response.status_code == 200
+        return response.json
+
+    def saved():
+        return {b.agent_id: b.amount for b in db.session.query(Bonus).filter_by(period="2025-05").all()}
+
+    def full_preview():
+        (result,) = client.post("/api/bonuses/calculate?dry_run=true", json={**payload, "full": True}).json["results"]
+        return {row["agent_id"]: row["amount"] for row in result["bonuses"]}
+
+    # --- ACT ---
+    first = run()
+    untouched = run()
+    sell("POL-DIRTY-9", 30000, a1)
+    after_sale = run()
+    after_sale_saved, after_sale_expected = saved(), full_preview()
+    client.put(f"/api/sales/{db.session.query(Sale).filter_by(policy_number='POL-DIRTY-3').one().id}/cancel")
+    after_cancel = run()
+    after_cancel_saved, after_cancel_expected = saved(), full_preview()
+    client.put(f"/api/agents/{tl2_id}", json={"level": 2})  # Unchanged level: nothing marked
+    client.put(f"/api/agents/{mgr_id}", json={"level": 4})
+    after_level = run()
+    gold = db.session.query(PerformanceTier).filter_by(agent_level=1, tier_name="GOLD").one()
+    gold.bonus_rate = 0.035
+    db.session.commit()
+    after_tiers = run()
+
+    # --- ASSERT ---
+    assert (first["mode"], first["skipped"]) == ("full", 0)
+    assert untouched["mode"] == "incremental"
+    assert untouched["skipped"] == agent_count
+    assert untouched["message"].endswith("Created: 0, Updated: 0")
+    # A1's sale reaches A1, TL1 and the manager
+    assert after_sale["skipped"] == agent_count - 3
+    assert after_sale_saved == pytest.approx(after_sale_expected)
+    # Cancelling one of A3's sales reaches A3, TL2 and the manager
+    assert after_cancel["skipped"] == agent_count - 3
+    # TL2 fell below its first tier; like a full run, the stale row is left to the clawback
+    assert {a: after_cancel_saved[a] for a in after_cancel_expected} == pytest.approx(after_cancel_expected)
+    assert after_cancel_saved[a3] == pytest.approx(60000 * 0.03)
+    assert (after_level["mode"], after_level["skipped"]) == ("incremental", agent_count - 1)
+    # New tiers invalidate every earlier run
+    assert (after_tiers["mode"], after_tiers["skipped"]) == ("full", 0)
+    expected = full_preview()
+    assert {a: amount for a, amount in saved().items() if a in expected} == pytest.approx(expected)
+    assert saved()[a1] == pytest.approx(90000 * 0.035)
+    # Only the monthly run's marks are cleared; the quarter and year stay dirty
+    assert db.session.query(BonusDirtyAgent).filter_by(period_key="2025-05").count() == 0
+    assert {d.period_key for d in db.session.query(BonusDirtyAgent)} == {"2025-Q2", "2025"}
+    assert [r.mode for r in db.session.query(BonusRun).order_by(BonusRun.id)] == [
+        "full",
+        "incremental",
+        "incremental",
+        "incremental",
+        "incremental",
+        "full",
+    ]
+
+
+@pytest.mark.parametrize("full", [False, True])
+def test_marks_written_during_a_run_survive_it(client, db, monkeypatch, full):
+    """A sale landing between a run's read and its clear stays dirty for the next run."""
+    # --- ARRANGE ---
+    import services.bonus_engine as bonus_engine
+
+    tl_id = client.post("/api/agents", json={"name": "TL", "level": 2}).json["id"]
+    a1 = client.post("/api/agents", json={"name": "A1", "level": 1, "parent_id": tl_id}).json["id"]
+    a2 = client.post("/api/agents", json={"name": "A2", "level": 1, "parent_id": tl_id}).json["id"]
+
+    def sell(policy_number, agent_id):
+        client.post(
+            "/api/sales/batch",
+            json=[{"policy_number": policy_number, "policy_value": 60000, "agent_id": agent_id, "sale_date": "2025-05-10"}],
+        )
+
+    sell("POL-RACE-1", a1)
+    payload = {"period": "2025-05", "type": "Monthly", "full": full}
+    client.post("/api/bonuses/calculate", json={**payload, "full": True})
+    sell("POL-RACE-2", a1)
+
+    compute_bonus_runs = bonus_engine.compute_bonus_runs
+
+    def compute_then_sell(*args, **kwargs):
+        runs = compute_bonus_runs(*args, **kwargs)
+        # Concurrent writer: re-marks A1 and marks A2 after the read
+        mark_bonus_agents_dirty([(a1, "2025-05"), (a2, "2025-05")], db.session)
+        return runs
+
+    monkeypatch.setattr(bonus_engine, "compute_bonus_runs", compute_then_sell)
+
+    # --- ACT ---
+    response = client.post("/api/bonuses/calculate", json=payload)
+
+    # --- ASSERT ---
+    assert response.status_code == 200
+    remaining = {
+        d.agent_id for d in db.session.query(BonusDirtyAgent).filter_by(period_key="2025-05")
+    }
+    # The run read A1 and TL's marks; only TL's is unchanged since, so only it is cleared
+    assert remaining == {a1, a2}
+
+
+def test_calculate_bonuses_command_runs_a_year_in_parallel(app, client, db):
+    """The CLI batch run saves the same bonuses with or without worker processes."""
+    # --- ARRANGE ---
+    sellers = []
+    for d in range(2):
+        tl_id = client.post("/api/agents", json={"name": f"TL{d}", "level": 2}).json["id"]
+        sellers += [
+            client.post("/api/agents", json={"name": f"A{d}-{i}", "level": 1, "parent_id": tl_id}).json["id"]
+            for i in range(2)
+        ]
+    client.post(
+        "/api/sales/batch",
+        json=[
+            {"policy_number": f"POL-CLI-{i}", "policy_value": 30000 + 10000 * i, "agent_id": agent_id, "sale_date": "2025-02-10"}
+            for i, agent_id in enumerate(sellers)
+        ],
+    )
+    runner = app.test_cli_runner()
+
+    def saved():
+        return {(b.agent_id, b.period, b.bonus_type): b.amount for b in db.session.query(Bonus).all()}
+
+    # --- ACT ---
+    serial = runner.invoke(args=["calculate-bonuses", "--year", "2025", "--full"])
+    serial_bonuses = saved()
+    db.session.query(Bonus).delete()
+    db.session.commit()
+    parallel = runner.invoke(args=["calculate-bonuses", "--year", "2025", "--workers", "2", "--full"])
+
+    # --- ASSERT ---
+    assert serial.exit_code == 0, serial.output
+    assert parallel.exit_code == 0, parallel.output
+    assert "Calculated 17 periods" in parallel.output
+    assert serial_bonuses and saved() == serial_bonuses
+
+
+def test_check_volumes_repairs_aggregates_after_out_of_band_sales(app, client, db, sql_statements):
+    """Sales inserted around the hooks are left to check-volumes; startup stays cheap."""
+    # --- ARRANGE ---
+    from app import sync_volume_aggregates
+    from services import find_volume_aggregate_drift
+
+    tl_id = client.post("/api/agents", json={"name": "TL", "level": 2}).json["id"]
+    agent_id = client.post("/api/agents", json={"name": "A", "level": 1, "parent_id": tl_id}).json["id"]
+    client.post(
+        "/api/sales/batch",
+        json=[{"policy_number": "POL-DRIFT-1", "policy_value": 20000, "agent_id": agent_id, "sale_date": "2025-06-10"}],
+    )
+    assert find_volume_aggregate_drift(db.session) == []
+    db.session.add(
+        Sale(policy_number="POL-DRIFT-2", policy_value=40000, agent_id=agent_id, sale_date=datetime(2025, 6, 12, tzinfo=timezone.utc))
+    )
+    db.session.commit()
+    assert find_volume_aggregate_drift(db.session) == ["agent_monthly_volume", "downline_period_volume"]
+
+    # --- ACT ---
+    sql_statements.clear()
+    sync_volume_aggregates(app)
+    startup_statements = list(sql_statements)
+    check = app.test_cli_runner().invoke(args=["check-volumes"])
+    repair = app.test_cli_runner().invoke(args=["check-volumes", "--repair"])
+    recheck = app.test_cli_runner().invoke(args=["check-volumes"])
+
+    # --- ASSERT ---
+    # Startup only probes for empty tables: no aggregation over the sales
+    assert not any("GROUP BY" in statement for statement in startup_statements)
+    assert check.exit_code == 1 and "Drifted" in check.output
+    assert repair.exit_code == 0, repair.output
+    assert recheck.exit_code == 0, recheck.output
+    assert find_volume_aggregate_drift(db.session) == []
+    assert get_monthly_sales_volume([agent_id], 2025, 6, db.session) == pytest.approx(60000)
+    result = client.post("/api/bonuses/calculate", json={"period": "2025-06", "type": "Monthly"})
+    assert result.status_code == 200
+    # 60k personal volume reaches Level 1 GOLD (3%)
+    assert db.session.query(Bonus).filter_by(agent_id=agent_id).one().amount == pytest.approx(1800)
+
+
+def test_volume_rebuild_and_incremental_updates_share_one_tree(app, client, db):
+    """An out-of-band move is repaired in the closure table before the rollup is rebuilt from it."""
+    # --- ARRANGE ---
+    from services import find_volume_aggregate_drift, agent_closure_is_consistent
+
+    mgr_a = client.post("/api/agents", json={"name": "MgrA", "level": 3}).json["id"]
+    mgr_b = client.post("/api/agents", json={"name": "MgrB", "level": 3}).json["id"]
+    tl_id = client.post("/api/agents", json={"name": "TL", "level": 2, "parent_id": mgr_a}).json["id"]
+    agent_id = client.post("/api/agents", json={"name": "A", "level": 1, "parent_id": tl_id}).json["id"]
+
+    def sell(policy_number, value):
+        client.post(
+            "/api/sales/batch",
+            json=[{"policy_number": policy_number, "policy_value": value, "agent_id": agent_id, "sale_date": "2025-07-10"}],
+        )
+
+    def downline(ancestor_id):
+        row = db.session.get(DownlinePeriodVolume, (ancestor_id, "2025-07"))
+        return row.volume if row else 0.0
+
+    sell("POL-TREE-1", 10000)
+    db.session.get(Agent, tl_id).parent_id = mgr_b  # Moved without the closure or cache updates
+    db.session.commit()
+
+    # --- ACT ---
+    result = app.test_cli_runner().invoke(args=["rebuild-volumes"])
+    sell("POL-TREE-2", 5000)  # Incremental path, walking the hierarchy cache
+
+    # --- ASSERT ---
+    assert result.exit_code == 0, result.output
+    assert agent_closure_is_consistent(db.session)
+    assert downline(mgr_a) == 0.0
+    assert downline(mgr_b) == pytest.approx(15000)
+    assert find_volume_aggregate_drift(db.session) == []
@@ -1,6 +1,6 @@
 import pytest
 import json
-from models import db, Agent, Sale, Commission, Clawback, HierarchySnapshot
+from models import db, Agent, Sale, Commission, Clawback, HierarchySnapshot, CancellationJob
 
 # Re-use the hierarchy setup fixture from commissions test
 from tests.test_commissions import setup_hierarchy
@@ -164,3 +164,350 @@ def test_cancel_policy_and_create_bonus_clawback(client, db, setup_hierarchy):
     # Bonus Clawback Amount = $1800 - $5500 = -$3700
     # The clawback record should store the negative adjustment needed.
     assert bonus_clawback.amount == pytest.approx(-3700.00)
+
+
+def test_batch_cancel_recomputes_each_bonus_once(client, db, setup_hierarchy):
+    """
+    Cancelling several sales in one call creates one clawback per commission
+    and a single adjustment per affected bonus (not one per cancelled sale).
+    """
+    # === 1. ARRANGE ===
+    agent_id = setup_hierarchy["agent_id"]  # Sarah (Level 1)
+    sale_ids = []
+    for i, value in enumerate([60000.00, 30000.00, 20000.00]):
+        resp = client.post(
+            "/api/sales",
+            json={"policy_number": f"POL-BATCH-CXL-{i}", "policy_value": value, "agent_id": agent_id},
+        )
+        sale_ids.append(resp.json["sale_id"])
+
+    now = datetime.now(timezone.utc)
+    period_str = f"{now.year}-{now.month:02d}"
+    client.post("/api/bonuses/calculate", json={"period": period_str, "type": "Monthly"})
+    sarah_bonus = db.session.query(Bonus).filter_by(agent_id=agent_id, period=period_str).one()
+    assert sarah_bonus.amount == pytest.approx(5500.00)  # $110k * 5% (Platinum)
+
+    # === 2. ACT ===
+    # Cancel the $30k and $20k policies, plus an unknown ID and a repeat
+    cancel_resp = client.put(
+        "/api/sales/cancel", json={"sale_ids": [sale_ids[1], sale_ids[2], 9999]}
+    )
+    repeat_resp = client.put("/api/sales/cancel", json=[sale_ids[1]])
+
+    # === 3. ASSERT ===
+    assert cancel_resp.status_code == 200
+    assert cancel_resp.json["cancelled"] == [sale_ids[1], sale_ids[2]]
+    assert cancel_resp.json["not_found"] == [9999]
+    assert cancel_resp.json["commission_clawbacks"] == 8  # 2 sales x (FYC + 3 overrides)
+    assert repeat_resp.json["already_cancelled"] == [sale_ids[1]]
+    assert repeat_resp.json["cancelled"] == []
+
+    for sale_id in sale_ids[1:]:
+        assert db.session.get(Sale, sale_id).is_cancelled is True
+
+    bonus_clawbacks = (
+        db.session.query(Clawback).filter_by(original_bonus_id=sarah_bonus.id).all()
+    )
+    assert len(bonus_clawbacks) == 1
+    # New volume $60k (Gold 3%) -> $1800; adjustment = 1800 - 5500
+    assert bonus_clawbacks[0].amount == pytest.approx(-3700.00)
+    assert bonus_clawbacks[0].sale_id == sale_ids[1]  # Linked to the lowest triggering sale
+
+
+def test_batch_cancel_validation(client, db):
+    assert client.put("/api/sales/cancel", json={"sale_ids": []}).status_code == 400
+    assert client.put("/api/sales/cancel", json={"sale_ids": ["1"]}).status_code == 400
+    assert client.put("/api/sales/cancel", json={}).status_code == 400
+
+
+def test_cancel_sale_job_reports_progress(client, db, setup_hierarchy):
+    """The cancel response carries a job whose status shows the clawbacks written."""
+    sale_id = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-JOB-1", "policy_value": 1000.00, "agent_id": setup_hierarchy["agent_id"]},
+    ).json["sale_id"]
+
+    cancel_resp = client.put(f"/api/sales/{sale_id}/cancel")
+    job_resp = client.get(f"/api/sales/cancel-jobs/{cancel_resp.json['job_id']}")
+
+    assert job_resp.status_code == 200
+    assert job_resp.json["status"] == "completed"
+    assert job_resp.json["sale_ids"] == [sale_id]
+    assert job_resp.json["processed_sales"] == 1
+    assert job_resp.json["commission_clawbacks"] == 4
+    assert client.get("/api/sales/cancel-jobs/9999").status_code == 404
+
+
+def test_cancel_sale_clawbacks_run_in_worker_thread(app, client, db, setup_hierarchy, monkeypatch):
+    """Outside eager mode the request only flips is_cancelled; a worker writes clawbacks."""
+    import time
+
+    sale_id = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-JOB-2", "policy_value": 1000.00, "agent_id": setup_hierarchy["agent_id"]},
+    ).json["sale_id"]
+    monkeypatch.setitem(app.config, "CANCELLATION_JOBS_EAGER", False)
+
+    cancel_resp = client.put(f"/api/sales/{sale_id}/cancel")
+    assert cancel_resp.status_code == 200
+    job_id = cancel_resp.json["job_id"]
+
+    deadline = time.monotonic() + 10
+    status = None
+    while time.monotonic() < deadline:
+        status = client.get(f"/api/sales/cancel-jobs/{job_id}").json["status"]
+        if status in ("completed", "failed"):
+            break
+        time.sleep(0.05)
+
+    assert status == "completed"
+    db.session.expire_all()
+    assert db.session.get(Sale, sale_id).is_cancelled is True
+    assert db.session.query(Clawback).filter_by(sale_id=sale_id).count() == 4
+
+
+def test_concurrent_cancels_of_one_sale_queue_one_job(app, client, db, setup_hierarchy, monkeypatch):
+    """Two requests that both see the sale uncancelled write its clawbacks once."""
+    import threading
+    import time
+    import routes.sales
+
+    # === 1. ARRANGE ===
+    sale_id = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-RACE-1", "policy_value": 1000.00, "agent_id": setup_hierarchy["agent_id"]},
+    ).json["sale_id"]
+    monkeypatch.setitem(app.config, "CANCELLATION_JOBS_EAGER", False)
+
+    # Both requests pass the is_cancelled check before either writes; the
+    # second then writes only after the first request and its job are done
+    both_checked = threading.Barrier(2)
+    first_done = threading.Event()
+    arrivals = []
+    real_mark_sales_cancelled = routes.sales.mark_sales_cancelled
+
+    def racing_mark_sales_cancelled(sale_ids, db_session):
+        both_checked.wait(timeout=10)
+        arrivals.append(threading.current_thread().name)
+        if len(arrivals) == 2:
+            first_done.wait(timeout=10)
+        return real_mark_sales_cancelled(sale_ids, db_session)
+
+    monkeypatch.setattr(routes.sales, "mark_sales_cancelled", racing_mark_sales_cancelled)
+
+    def wait_for_job(job_id):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if client.get(f"/api/sales/cancel-jobs/{job_id}").json["status"] in ("completed", "failed"):
+                return
+            time.sleep(0.05)
+
+    responses = []
+
+    def cancel():
+        response = client.put(f"/api/sales/{sale_id}/cancel")
+        responses.append(response)
+        if "job_id" in response.json:
+            wait_for_job(response.json["job_id"])
+        first_done.set()
+
+    # === 2. ACT ===
+    threads = [threading.Thread(target=cancel) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    # === 3. ASSERT ===
+    assert [response.status_code for response in responses] == [200, 200]
+    assert sum("job_id" in response.json for response in responses) == 1
+    db.session.expire_all()
+    assert db.session.query(CancellationJob).count() == 1
+    assert db.session.query(CancellationJob).one().status == "completed"
+    assert db.session.query(Clawback).filter_by(sale_id=sale_id).count() == 4
+
+
+def test_stale_running_jobs_are_requeued_at_startup(app, client, db, setup_hierarchy):
+    """A job whose worker died mid-run is resumed once its lease expires; a live one is left alone."""
+    # === 1. ARRANGE ===
+    from datetime import timedelta
+    from services import mark_sales_cancelled, enqueue_cancellation_job, resume_pending_cancellation_jobs
+
+    sale_ids = [
+        client.post(
+            "/api/sales",
+            json={"policy_number": f"POL-STALE-{i}", "policy_value": 1000.00, "agent_id": setup_hierarchy["agent_id"]},
+        ).json["sale_id"]
+        for i in range(2)
+    ]
+    mark_sales_cancelled(sale_ids, db.session)
+    now = datetime.now(timezone.utc)
+    lease = timedelta(seconds=app.config["CANCELLATION_JOB_LEASE_SECONDS"])
+    stale_job = enqueue_cancellation_job(sale_ids[:1], db.session)
+    stale_job.status, stale_job.started_at = "running", now - lease - timedelta(seconds=1)
+    live_job = enqueue_cancellation_job(sale_ids[1:], db.session)
+    live_job.status, live_job.started_at = "running", now
+    db.session.commit()
+
+    # === 2. ACT ===
+    resume_pending_cancellation_jobs(app)
+
+    # === 3. ASSERT ===
+    db.session.expire_all()
+    assert db.session.get(CancellationJob, stale_job.id).status == "completed"
+    assert db.session.query(Clawback).filter_by(sale_id=sale_ids[0]).count() == 4
+    assert db.session.get(CancellationJob, live_job.id).status == "running"
+    assert db.session.query(Clawback).filter_by(sale_id=sale_ids[1]).count() == 0
+
+
+def test_failed_job_can_be_retried(client, db, setup_hierarchy, monkeypatch):
+    """A failed job keeps its sale cancelled without clawbacks until it is retried."""
+    # === 1. ARRANGE ===
+    import services.cancellation_jobs as cancellation_jobs
+
+    sale_id = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-RETRY", "policy_value": 1000.00, "agent_id": setup_hierarchy["agent_id"]},
+    ).json["sale_id"]
+
+    def fail(sale_ids, db_session):
+        raise RuntimeError("database is locked")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(cancellation_jobs, "create_cancellation_clawbacks", fail)
+        job_id = client.put(f"/api/sales/{sale_id}/cancel").json["job_id"]
+    failed = client.get(f"/api/sales/cancel-jobs/{job_id}").json
+
+    # === 2. ACT ===
+    retry_resp = client.post(f"/api/sales/cancel-jobs/{job_id}/retry")
+
+    # === 3. ASSERT ===
+    assert (failed["status"], failed["error"]) == ("failed", "database is locked")
+    assert retry_resp.status_code == 202
+    assert retry_resp.json["status"] == "completed"
+    assert retry_resp.json["error"] is None
+    assert db.session.query(Clawback).filter_by(sale_id=sale_id).count() == 4
+    # Only failed jobs go back to the queue
+    assert client.post(f"/api/sales/cancel-jobs/{job_id}/retry").status_code == 409
+    assert client.post("/api/sales/cancel-jobs/9999/retry").status_code == 404
+
+
+def test_legacy_snapshots_are_migrated_and_used_for_clawbacks(client, db, setup_hierarchy):
+    """Per-level snapshot rows are converted to one path per sale; cancellation reads it."""
+    from models import HierarchyPath
+    from services import migrate_hierarchy_snapshots, get_sale_hierarchy_agent_ids
+
+    # === 1. ARRANGE: a sale recorded in the legacy format ===
+    ids = setup_hierarchy
+    chain = [ids["agent_id"], ids["team_lead_id"], ids["manager_id"], ids["director_id"]]
+    sale_id = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-LEGACY", "policy_value": 10000.00, "agent_id": ids["agent_id"]},
+    ).json["sale_id"]
+    sale = db.session.get(Sale, sale_id)
+    sale.hierarchy_path_id = None
+    for level, agent_id in enumerate(chain):
+        db.session.add(
+            HierarchySnapshot(
+                sale_id=sale_id, agent_id=agent_id, upline_level=level, upline_agent_id=agent_id
+            )
+        )
+    db.session.commit()
+
+    # === 2. ACT ===
+    converted = migrate_hierarchy_snapshots(db.session)
+
+    # === 3. ASSERT ===
+    assert converted == 1
+    assert migrate_hierarchy_snapshots(db.session) == 0  # Idempotent
+    assert db.session.query(HierarchySnapshot).count() == 0
+    db.session.expire_all()
+    sale = db.session.get(Sale, sale_id)
+    assert db.session.get(HierarchyPath, sale.hierarchy_path_id).path == "/".join(
+        map(str, chain)
+    )
+    # The migrated path is shared with new sales by the same seller
+    assert db.session.query(HierarchyPath).count() == 1
+
+    # Cancellation reads the affected agents from the compact snapshot
+    assert get_sale_hierarchy_agent_ids([sale_id], db.session) == {sale_id: chain}
+    assert client.put(f"/api/sales/{sale_id}/cancel").status_code == 200
+    assert db.session.query(Clawback).filter_by(sale_id=sale_id).count() == 4
+
+
+def test_startup_leaves_legacy_snapshots_for_the_migration_command(app, client, db, setup_hierarchy):
+    """App start-up never deletes snapshots; unconverted sales still cancel correctly."""
+    from app import check_legacy_snapshots
+    from services import get_sale_hierarchy_agent_ids
+
+    # === 1. ARRANGE: a sale recorded in the legacy format ===
+    ids = setup_hierarchy
+    chain = [ids["agent_id"], ids["team_lead_id"], ids["manager_id"], ids["director_id"]]
+    sale_id = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-LEGACY-2", "policy_value": 10000.00, "agent_id": ids["agent_id"]},
+    ).json["sale_id"]
+    db.session.get(Sale, sale_id).hierarchy_path_id = None
+    for level, agent_id in enumerate(chain):
+        db.session.add(
+            HierarchySnapshot(sale_id=sale_id, agent_id=agent_id, upline_level=level, upline_agent_id=agent_id)
+        )
+    db.session.commit()
+
+    # === 2. ACT ===
+    check_legacy_snapshots(app)
+    cancel_resp = client.put(f"/api/sales/{sale_id}/cancel")
+
+    # === 3. ASSERT ===
+    assert db.session.query(HierarchySnapshot).count() == len(chain)
+    # Cancellation reads the unconverted sale's upline from its legacy rows
+    assert get_sale_hierarchy_agent_ids([sale_id], db.session) == {sale_id: chain}
+    assert cancel_resp.status_code == 200
+    assert db.session.query(Clawback).filter_by(sale_id=sale_id).count() == 4
+
+
+def test_cancel_bonus_recalculation_uses_constant_queries(client, db, sql_statements):
+    """Bonus clawbacks take the same number of queries for one seller or many."""
+    # === 1. ARRANGE ===
+    def add_agent(name, level, parent_id=None):
+        return client.post(
+            "/api/agents", json={"name": name, "level": level, "parent_id": parent_id}
+        ).json["id"]
+
+    dir_id = add_agent("Dir", 4)
+    mgr_id = add_agent("Mgr", 3, dir_id)
+    tl_id = add_agent("TL", 2, mgr_id)
+    agent_ids = [add_agent(f"A{i}", 1, tl_id) for i in range(6)]
+    client.post(
+        "/api/sales/batch",
+        json=[
+            {"policy_number": f"POL-CONST-{agent_id}-{i}", "policy_value": 40000, "agent_id": agent_id}
+            for agent_id in agent_ids
+            for i in range(2)
+        ],
+    )
+    now = datetime.now(timezone.utc)
+    quarter = (now.month - 1) // 3 + 1
+    client.post("/api/bonuses/calculate", json={"period": f"{now.year}-{now.month:02d}", "type": "Monthly"})
+    client.post("/api/bonuses/calculate", json={"period": f"{now.year}-Q{quarter}", "type": "Quarterly"})
+    client.post("/api/bonuses/calculate", json={"period": f"{now.year}", "type": "Annual"})
+
+    sale_ids = [
+        db.session.query(Sale).filter_by(policy_number=f"POL-CONST-{agent_id}-0").one().id
+        for agent_id in agent_ids
+    ]
+
+    # === 2. ACT ===
+    sql_statements.clear()
+    one_resp = client.put("/api/sales/cancel", json={"sale_ids": sale_ids[:1]})
+    one_seller_queries = len(sql_statements)
+    sql_statements.clear()
+    many_resp = client.put("/api/sales/cancel", json={"sale_ids": sale_ids[1:]})
+    many_seller_queries = len(sql_statements)
+
+    # === 3. ASSERT ===
+    # One seller: its 3 bonuses ($80k Gold -> $40k Silver) and the team lead's 3
+    assert one_resp.json["bonus_clawbacks"] == 6
+    # Five sellers: 15 level 1 bonuses and the team lead's 3 again
+    assert many_resp.json["bonus_clawbacks"] == 18
+    assert many_seller_queries == one_seller_queries
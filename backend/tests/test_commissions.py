@@ -1,6 +1,7 @@
 import pytest
 import json
-from models import db, Agent, Sale, Commission, HierarchySnapshot
+from models import db, Agent, Sale, Commission, HierarchySnapshot, HierarchyPath
+from services import rebuild_agent_closure
 
 
 # A "fixture" to create our 4-level hierarchy for the test
@@ -28,6 +29,9 @@ def setup_hierarchy(db):
     db.session.add(agent)
     db.session.flush()  # Flush to get agent.id
 
+    # Agents were inserted directly, so index them in the closure table
+    rebuild_agent_closure(db.session)
+
     # Commit so the data is available to the API endpoints
     db.session.commit()
 
@@ -76,9 +80,14 @@ def test_create_sale_and_calculate_commissions(client, db, setup_hierarchy):
     assert new_sale.policy_value == 100000.00
     assert new_sale.agent_id == agent_id
 
-    # --- Assert 3c: The Hierarchy Snapshot was saved
-    # (1 for the agent + 3 for the upline)
-    assert db.session.query(HierarchySnapshot).count() == 4
+    # --- Assert 3c: The Hierarchy Snapshot was saved as one compact path
+    # (the agent + 3 upline managers, seller first)
+    assert db.session.query(HierarchySnapshot).count() == 0
+    snapshot = db.session.get(HierarchyPath, new_sale.hierarchy_path_id)
+    assert snapshot.path == "/".join(
+        str(setup_hierarchy[key])
+        for key in ("agent_id", "team_lead_id", "manager_id", "director_id")
+    )
 
     # --- Assert 3d: All Commissions were created (The Core Test)
     assert db.session.query(Commission).count() == 4
@@ -0,0 +1,55 @@
+import json
+from models import Sale, Commission
+
+# Re-use the hierarchy setup fixture from commissions test
+from tests.test_commissions import setup_hierarchy
+
+
+def test_import_sales_ndjson_in_chunks(app, db, setup_hierarchy, tmp_path):
+    """The CLI streams NDJSON rows in chunks and reports bad rows by line number."""
+    agent_id = setup_hierarchy["agent_id"]
+    path = tmp_path / "sales.ndjson"
+    lines = [
+        json.dumps(
+            {
+                "policy_number": f"POL-NDJSON-{i}",
+                "policy_value": 1000,
+                "agent_id": agent_id,
+                "sale_date": "2025-01-10",
+            }
+        )
+        for i in range(25)
+    ]
+    lines.insert(3, "{not json")
+    lines.append(json.dumps({"policy_number": "POL-BAD", "policy_value": 0, "agent_id": agent_id}))
+    path.write_text("\n".join(lines) + "\n")
+
+    result = app.test_cli_runner().invoke(
+        args=["import-sales", str(path), "--chunk-size", "10"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Created: 25, Failed: 2" in result.output
+    assert "rows/sec" in result.output
+    assert "Row 4: Invalid JSON" in result.output
+    assert "Row 27: Policy value must be greater than zero" in result.output
+    assert db.session.query(Sale).count() == 25
+    assert db.session.query(Commission).count() == 25 * 4
+
+
+def test_import_sales_csv(app, db, setup_hierarchy, tmp_path):
+    agent_id = setup_hierarchy["agent_id"]
+    path = tmp_path / "sales.csv"
+    path.write_text(
+        "policy_number,policy_value,agent_id,sale_date\n"
+        f"POL-CSV-1,2500.50,{agent_id},2024-12-31T23:00:00\n"
+        f"POL-CSV-2,abc,{agent_id},\n"
+    )
+
+    result = app.test_cli_runner().invoke(args=["import-sales", str(path)])
+
+    assert result.exit_code == 0, result.output
+    assert "Created: 1, Failed: 1" in result.output
+    sale = db.session.query(Sale).filter_by(policy_number="POL-CSV-1").one()
+    assert sale.policy_value == 2500.50
+    assert sale.sale_date.year == 2024
@@ -0,0 +1,112 @@
+import pytest
+from datetime import datetime, timezone
+from models import AgentPayoutLedger
+from services import rebuild_payout_ledger
+
+# Re-use the hierarchy setup fixture from commissions test
+from tests.test_commissions import setup_hierarchy
+
+
+def ledger_rows(db):
+    return {
+        (row.agent_id, row.period): (row.commissions, row.bonuses, row.clawbacks, row.net)
+        for row in db.session.query(AgentPayoutLedger).all()
+    }
+
+
+def test_payout_ledger_tracks_commissions_bonuses_and_clawbacks(client, db, setup_hierarchy):
+    """The incrementally kept ledger matches a rebuild from the source tables."""
+    # === 1. ARRANGE ===
+    agent_id = setup_hierarchy["agent_id"]
+    team_lead_id = setup_hierarchy["team_lead_id"]
+    now = datetime.now(timezone.utc)
+    month = f"{now.year}-{now.month:02d}"
+
+    sale_id = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-LEDGER-1", "policy_value": 30000, "agent_id": agent_id},
+    ).json["sale_id"]
+    client.post(
+        "/api/sales/batch",
+        json=[
+            {"policy_number": f"POL-LEDGER-B{i}", "policy_value": 10000, "agent_id": agent_id}
+            for i in range(3)
+        ],
+    )
+
+    # === 2. ACT ===
+    client.post("/api/bonuses/calculate", json={"period": month, "type": "Monthly"})
+    client.post(
+        "/api/sales",
+        json={"policy_number": "POL-LEDGER-2", "policy_value": 20000, "agent_id": team_lead_id},
+    )
+    client.post("/api/bonuses/calculate", json={"period": month, "type": "Monthly"})
+    assert client.put(f"/api/sales/{sale_id}/cancel").status_code == 200
+
+    # === 3. ASSERT ===
+    # --- Assert 3a: net is the sum of the three columns, and the seller's
+    # commissions are its FYC on all five sales
+    incremental = ledger_rows(db)
+    for commissions, bonuses, clawbacks, net in incremental.values():
+        assert net == pytest.approx(commissions + bonuses + clawbacks)
+    commissions, bonuses, clawbacks, _ = incremental[(agent_id, month)]
+    assert commissions == pytest.approx(60000 * 0.50)
+    assert clawbacks < -30000 * 0.50
+
+    # --- Assert 3b: rebuilding from the source tables gives the same ledger
+    rebuild_payout_ledger(db.session)
+    db.session.commit()
+    rebuilt = ledger_rows(db)
+    assert rebuilt.keys() == incremental.keys()
+    for key, amounts in rebuilt.items():
+        assert incremental[key] == pytest.approx(amounts)
+
+    # --- Assert 3c: the statement route reads the ledger row
+    statement = client.get(f"/api/agents/{agent_id}/payouts?period={month}")
+    assert statement.status_code == 200
+    assert statement.json["net"] == pytest.approx(rebuilt[(agent_id, month)][3])
+    history = client.get(f"/api/agents/{agent_id}/payouts")
+    assert [row["period"] for row in history.json] == [month]
+
+
+def test_payout_statement_validation(client, db, setup_hierarchy):
+    agent_id = setup_hierarchy["agent_id"]
+    assert client.get(f"/api/agents/{agent_id}/payouts?period=2025-13").status_code == 400
+    assert client.get("/api/agents/99999/payouts?period=2025-01").status_code == 404
+    empty = client.get(f"/api/agents/{agent_id}/payouts?period=2020-01")
+    assert empty.status_code == 200
+    assert empty.json["net"] == 0.0
+
+
+def test_check_ledger_repairs_out_of_band_writes(app, client, db, setup_hierarchy):
+    """Commissions written around the ledger hooks are found and rebuilt by check-ledger."""
+    # === 1. ARRANGE ===
+    from models import Commission
+    from services import find_payout_ledger_drift
+
+    agent_id = setup_hierarchy["agent_id"]
+    sale_id = client.post(
+        "/api/sales",
+        json={"policy_number": "POL-LEDGER-DRIFT", "policy_value": 30000, "agent_id": agent_id},
+    ).json["sale_id"]
+    assert find_payout_ledger_drift(db.session) == []
+
+    payout_date = datetime(2025, 3, 15, tzinfo=timezone.utc)
+    db.session.add(
+        Commission(
+            sale_id=sale_id, agent_id=agent_id, amount=250.0,
+            commission_type="FYC", payout_date=payout_date,
+        )
+    )
+    db.session.commit()
+    assert find_payout_ledger_drift(db.session) == [(agent_id, "2025-03")]
+
+    # === 2. ACT ===
+    check = app.test_cli_runner().invoke(args=["check-ledger"])
+    repair = app.test_cli_runner().invoke(args=["check-ledger", "--repair"])
+
+    # === 3. ASSERT ===
+    assert check.exit_code == 1 and "Drifted" in check.output
+    assert repair.exit_code == 0, repair.output
+    assert find_payout_ledger_drift(db.session) == []
+    assert ledger_rows(db)[(agent_id, "2025-03")] == pytest.approx((250.0, 0.0, 0.0, 250.0))
@@ -0,0 +1,204 @@
+"""
+Query-plan regression test: every filtered statement issued by the routes and
+bonus_service must be answered through an index, never a full table scan.
+"""
+import re
+from datetime import datetime, timezone
+from sqlalchemy import event
+from models import db as sqlalchemy_db
+
+# "SCAN sale" reads the whole table and "SCAN sale USING INDEX ..." walks a
+# whole index; a filtered statement should SEARCH instead
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?$")
+HAS_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+# Keyset pages must come off an index in order, not sort every match first
+HAS_LIMIT = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+SORT_STEP = "USE TEMP B-TREE FOR ORDER BY"
+
+
+def exercise_api(client):
+    """Drives every route (and with it every bonus_service query) once."""
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+    mgr_id = client.post(
+        "/api/agents", json={"name": "Mgr", "level": 3, "parent_id": dir_id}
+    ).json["id"]
+    mgr2_id = client.post(
+        "/api/agents", json={"name": "Mgr2", "level": 3, "parent_id": dir_id}
+    ).json["id"]
+    tl_id = client.post(
+        "/api/agents", json={"name": "TL", "level": 2, "parent_id": mgr_id}
+    ).json["id"]
+    agent_id = client.post(
+        "/api/agents", json={"name": "Agent", "level": 1, "parent_id": tl_id}
+    ).json["id"]
+    spare_id = client.post(
+        "/api/agents", json={"name": "Spare", "level": 1, "parent_id": tl_id}
+    ).json["id"]
+
+    client.get("/api/agents")
+    client.get("/api/agents?level=1")
+    client.get(f"/api/agents/{dir_id}/subtree?depth=2&limit=2")
+    cursor = client.get(f"/api/agents/{dir_id}/subtree?depth=2&limit=2").json["next_cursor"]
+    client.get(f"/api/agents/{dir_id}/subtree?depth=2&limit=2&cursor={cursor}")
+    client.put(f"/api/agents/{tl_id}", json={"name": "TL renamed", "parent_id": mgr2_id})
+    client.delete(f"/api/agents/{spare_id}")
+    client.delete(f"/api/agents/{mgr_id}")
+
+    now = datetime.now(timezone.utc)
+    sale_ids = [
+        client.post(
+            "/api/sales",
+            json={"policy_number": f"POL-PLAN-{i}", "policy_value": 60000, "agent_id": agent_id},
+        ).json["sale_id"]
+        for i in range(3)
+    ]
+    client.post(
+        "/api/sales/batch",
+        json=[
+            {
+                "policy_number": f"POL-PLAN-B{i}",
+                "policy_value": 1000,
+                "agent_id": agent_id,
+                "sale_date": now.isoformat(),
+            }
+            for i in range(3)
+        ],
+    )
+
+    client.get("/api/sales")
+    cursor = client.get("/api/sales?limit=2").json["next_cursor"]
+    client.get(f"/api/sales?limit=2&cursor={cursor}")
+    client.get(f"/api/sales?limit=2&agent_id={agent_id}&from=2020-01-01&to=2100-01-01")
+    client.get(f"/api/sales?limit=2&agent_id={agent_id}&cursor={cursor}")
+    client.get("/api/sales?stream=true")
+
+    quarter = (now.month - 1) // 3 + 1
+    for period, bonus_type in [
+        (f"{now.year}-{now.month:02d}", "Monthly"),
+        (f"{now.year}-Q{quarter}", "Quarterly"),
+        (f"{now.year}", "Annual"),
+    ]:
+        client.post("/api/bonuses/calculate", json={"period": period, "type": bonus_type})
+    client.post("/api/bonuses/calculate?dry_run=true", json={"year": now.year})
+    client.get("/api/bonuses")
+
+    job_id = client.put(f"/api/sales/{sale_ids[0]}/cancel").json["job_id"]
+    client.get(f"/api/sales/cancel-jobs/{job_id}")
+    client.put("/api/sales/cancel", json={"sale_ids": sale_ids[1:]})
+    # Incremental re-run over the agents the cancellations marked dirty
+    client.post("/api/bonuses/calculate", json={"year": now.year})
+
+    client.get("/api/dashboard/summary")
+    client.get(f"/api/agents/{agent_id}/payouts?period={now.year}-{now.month:02d}")
+    client.get(f"/api/agents/{agent_id}/payouts")
+
+
+def test_hot_queries_use_indexes(client, db):
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        if executemany:
+            parameters = parameters[0]
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    try:
+        exercise_api(client)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record_statement)
+
+    table_names = set(sqlalchemy_db.metadata.tables)
+    full_scans = []
+    checked = 0
+    with db.engine.connect() as conn:
+        for statement, parameters in dict.fromkeys(
+            (s, tuple(p) if isinstance(p, (list, tuple)) else p) for s, p in statements
+        ):
+            # Statements without a WHERE clause read whole tables by design
+            # (full listings, dashboard totals, cache loads)
+            if not HAS_WHERE.search(statement) or statement.startswith(("PRAGMA", "ALTER")):
+                continue
+            checked += 1
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            for row in plan:
+                match = FULL_SCAN.match(row[-1])
+                if match and match.group(1) in table_names:
+                    full_scans.append(f"{row[-1]}  <-  {statement}")
+                elif row[-1] == SORT_STEP and HAS_LIMIT.search(statement):
+                    full_scans.append(f"{row[-1]}  <-  {statement}")
+
+    assert checked > 10  # Sanity check that the scenario exercised the hot paths
+    assert full_scans == [], "Full table scans:\n" + "\n".join(full_scans)
+
+
+def explain_request(client, db, url):
+    """Query plan details for each filtered statement a GET request issues."""
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    try:
+        assert client.get(url).status_code == 200
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record_statement)
+
+    with db.engine.connect() as conn:
+        return [
+            [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            for statement, parameters in statements
+            if HAS_WHERE.search(statement)
+        ]
+
+
+def test_sales_pages_seek_through_an_index(client, db):
+    """Every paginated sales page is an index range search with no sort step."""
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+    client.post(
+        "/api/sales/batch",
+        json=[
+            {
+                "policy_number": f"POL-SEEK-{i}",
+                "policy_value": 1000,
+                "agent_id": dir_id,
+                "sale_date": f"2025-05-{1 + i // 2:02d}T12:00:00",
+            }
+            for i in range(6)
+        ],
+    )
+    cursor = client.get("/api/sales?limit=2").json["next_cursor"]
+
+    for url in (
+        f"/api/sales?limit=2&cursor={cursor}",
+        f"/api/sales?limit=2&agent_id={dir_id}",
+        f"/api/sales?limit=2&agent_id={dir_id}&cursor={cursor}",
+    ):
+        plans = explain_request(client, db, url)
+        sale_steps = [d for plan in plans for d in plan if re.match(r"(SCAN|SEARCH) sale\b", d)]
+        assert sale_steps, url
+        assert all(step.startswith("SEARCH sale ") for step in sale_steps), (url, plans)
+        assert not any("TEMP B-TREE" in d for plan in plans for d in plan), (url, plans)
+
+
+def test_subtree_pages_seek_through_the_closure_index(client, db):
+    """Subtree pages and their child counts are closure index searches with no sort step."""
+    dir_id = client.post("/api/agents", json={"name": "Dir", "level": 4}).json["id"]
+    for i in range(3):
+        mgr_id = client.post(
+            "/api/agents", json={"name": f"Mgr{i}", "level": 3, "parent_id": dir_id}
+        ).json["id"]
+        client.post("/api/agents", json={"name": f"TL{i}", "level": 2, "parent_id": mgr_id})
+    cursor = client.get(f"/api/agents/{dir_id}/subtree?depth=2&limit=2").json["next_cursor"]
+
+    for url in (
+        f"/api/agents/{dir_id}/subtree?depth=2&limit=2",
+        f"/api/agents/{dir_id}/subtree?depth=2&limit=2&cursor={cursor}",
+    ):
+        plans = explain_request(client, db, url)
+        closure_steps = [
+            d for plan in plans for d in plan if re.match(r"(SCAN|SEARCH) agent_closure\b", d)
+        ]
+        assert closure_steps, url
+        assert all(step.startswith("SEARCH agent_closure ") for step in closure_steps), (url, plans)
+        assert not any("TEMP B-TREE" in d for plan in plans for d in plan), (url, plans)
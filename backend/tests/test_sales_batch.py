@@ -0,0 +1,87 @@
+import pytest
+from datetime import datetime
+from models import Sale, Commission, HierarchyPath
+
+# Re-use the hierarchy setup fixture from commissions test
+from tests.test_commissions import setup_hierarchy
+
+
+def test_batch_sales_write_sales_snapshots_and_commissions(client, db, setup_hierarchy):
+    """A batch creates the same records as the single-sale route, in one request."""
+    # === 1. ARRANGE ===
+    agent_id = setup_hierarchy["agent_id"]
+    sales = [
+        {
+            "policy_number": f"POL-BATCH-{i}",
+            "policy_value": 10000.00,
+            "agent_id": agent_id,
+            "sale_date": "2025-03-15T10:00:00+00:00",
+        }
+        for i in range(50)
+    ]
+
+    # === 2. ACT ===
+    response = client.post("/api/sales/batch", json={"sales": sales})
+
+    # === 3. ASSERT ===
+    assert response.status_code == 201
+    assert response.json["created"] == 50
+    assert response.json["failed"] == 0
+    assert db.session.query(Sale).count() == 50
+    # All 50 sales share one compact snapshot path (seller + 3 managers)
+    assert db.session.query(HierarchyPath).count() == 1
+    assert db.session.query(Sale).filter(Sale.hierarchy_path_id.is_(None)).count() == 0
+    assert db.session.query(Commission).count() == 50 * 4  # FYC + 3 overrides
+
+    # Historical sale date is preserved
+    sale = db.session.query(Sale).filter_by(policy_number="POL-BATCH-0").one()
+    assert sale.sale_date.replace(tzinfo=None) == datetime(2025, 3, 15, 10, 0)
+
+    # Commission amounts match the single-sale rates
+    tl_override = (
+        db.session.query(Commission)
+        .filter_by(sale_id=sale.id, agent_id=setup_hierarchy["team_lead_id"])
+        .one()
+    )
+    assert tl_override.commission_type == "Override"
+    assert tl_override.amount == pytest.approx(200.00)  # 2% of $10k
+    fyc = db.session.query(Commission).filter_by(sale_id=sale.id, agent_id=agent_id).one()
+    assert fyc.amount == pytest.approx(5000.00)
+
+
+def test_batch_sales_report_per_row_errors(client, db, setup_hierarchy):
+    """Invalid rows are reported by index while valid rows are still recorded."""
+    agent_id = setup_hierarchy["agent_id"]
+    client.post(
+        "/api/sales",
+        json={"policy_number": "POL-EXISTING", "policy_value": 100, "agent_id": agent_id},
+    )
+
+    sales = [
+        {"policy_number": "POL-OK", "policy_value": 1000, "agent_id": agent_id},
+        {"policy_number": "POL-EXISTING", "policy_value": 1000, "agent_id": agent_id},
+        {"policy_number": "POL-OK", "policy_value": 1000, "agent_id": agent_id},
+        {"policy_number": "POL-NEG", "policy_value": -5, "agent_id": agent_id},
+        {"policy_number": "POL-NOAGENT", "policy_value": 1000, "agent_id": 9999},
+        {"policy_number": "POL-DATE", "policy_value": 1000, "agent_id": agent_id, "sale_date": "nope"},
+    ]
+    response = client.post("/api/sales/batch", json=sales)
+
+    assert response.status_code == 201
+    assert response.json["created"] == 1
+    assert [e["index"] for e in response.json["errors"]] == [1, 2, 3, 4, 5]
+    assert response.json["errors"][0]["error"] == "Policy number POL-EXISTING already exists"
+    assert response.json["errors"][3]["error"] == "Agent with ID 9999 not found"
+    assert db.session.query(Sale).count() == 2
+
+
+def test_batch_sales_validation(client, db):
+    assert client.post("/api/sales/batch", json=[]).status_code == 400
+    assert client.post("/api/sales/batch", json={"sales": "nope"}).status_code == 400
+
+    response = client.post(
+        "/api/sales/batch",
+        json=[{"policy_number": "POL-X", "policy_value": 10, "agent_id": 1}],
+    )
+    assert response.status_code == 400  # Nothing could be created
+    assert response.json["failed"] == 1
@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+from services import iter_json_array
+
+# Re-use the hierarchy setup fixture from commissions test
+from tests.test_commissions import setup_hierarchy
+
+
+def create_dated_sales(client, agent_id, count):
+    """Creates `count` sales over a few days; several share a sale_date."""
+    sales = [
+        {
+            "policy_number": f"POL-LIST-{i:03d}",
+            "policy_value": 1000 + i,
+            "agent_id": agent_id,
+            "sale_date": f"2025-05-{1 + i // 3:02d}T12:00:00",
+        }
+        for i in range(count)
+    ]
+    response = client.post("/api/sales/batch", json=sales)
+    assert response.status_code == 201
+
+
+def test_get_sales_keyset_pagination(client, db, setup_hierarchy):
+    """Walking every page returns each sale exactly once, newest first."""
+    create_dated_sales(client, setup_hierarchy["agent_id"], 20)
+
+    pages = []
+    url = "/api/sales?limit=6"
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append(response.json["sales"])
+        cursor = response.json["next_cursor"]
+        url = f"/api/sales?limit=6&cursor={cursor}" if cursor else None
+
+    assert [len(page) for page in pages] == [6, 6, 6, 2]
+    sales = [sale for page in pages for sale in page]
+    assert len({sale["id"] for sale in sales}) == 20
+    keys = [(sale["sale_date"], sale["id"]) for sale in sales]
+    assert keys == sorted(keys, reverse=True)
+
+    # Without pagination parameters the full list is still returned
+    assert len(client.get("/api/sales").json) == 20
+
+
+def test_get_sales_filters(client, db, setup_hierarchy):
+    create_dated_sales(client, setup_hierarchy["agent_id"], 9)  # May 1st-3rd, 3 per day
+    first_id = client.get("/api/sales?limit=1").json["sales"][0]["id"]
+    client.put(f"/api/sales/{first_id}/cancel")
+
+    response = client.get("/api/sales?limit=50&from=2025-05-02&to=2025-05-03")
+    assert len(response.json["sales"]) == 3
+    assert all(s["sale_date"].startswith("2025-05-02") for s in response.json["sales"])
+
+    assert len(client.get("/api/sales?limit=50&is_cancelled=true").json["sales"]) == 1
+    assert len(client.get("/api/sales?limit=50&is_cancelled=false").json["sales"]) == 8
+    agent_id = setup_hierarchy["agent_id"]
+    assert len(client.get(f"/api/sales?limit=50&agent_id={agent_id}").json["sales"]) == 9
+    assert client.get(f"/api/sales?limit=50&agent_id={agent_id + 100}").json["sales"] == []
+
+
+def test_get_sales_pagination_validation(client, db):
+    assert client.get("/api/sales?limit=0").status_code == 400
+    assert client.get("/api/sales?limit=100000").status_code == 400
+    assert client.get("/api/sales?cursor=not-a-cursor").status_code == 400
+    assert client.get("/api/sales?is_cancelled=maybe").status_code == 400
+    assert client.get("/api/sales?from=yesterday").status_code == 400
+
+
+def test_get_sales_stream_matches_list(client, db, setup_hierarchy):
+    """The streamed array has the same content as the regular list response."""
+    create_dated_sales(client, setup_hierarchy["agent_id"], 12)
+
+    streamed = client.get("/api/sales?stream=true")
+    assert streamed.status_code == 200
+    assert streamed.mimetype == "application/json"
+    assert streamed.json == client.get("/api/sales").json
+
+    filtered = client.get("/api/sales?stream=true&from=2025-05-03&to=2025-05-04")
+    assert len(filtered.json) == 3
+
+    # Chunked output stays a valid array for empty, partial and exact chunks
+    for count in (0, 1, 4, 5):
+        text = "".join(iter_json_array(range(count), lambda n: n, chunk_size=2))
+        assert text == str(list(range(count))).replace(" ", "")
+
+
+def test_get_bonuses_stream_matches_list(client, db, setup_hierarchy):
+    client.post(
+        "/api/sales",
+        json={"policy_number": "POL-S", "policy_value": 70000, "agent_id": setup_hierarchy["agent_id"]},
+    )
+    now = datetime.now(timezone.utc)
+    client.post(
+        "/api/bonuses/calculate",
+        json={"period": f"{now.year}-{now.month:02d}", "type": "Monthly"},
+    )
+
+    streamed = client.get("/api/bonuses?stream=true")
+    assert streamed.status_code == 200
+    assert len(streamed.json) >= 1
+    assert streamed.json == client.get("/api/bonuses").json